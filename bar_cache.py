@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from prices import Bars, FIELDS, empty_bars, fetch_many, save_array
+from profiling import count
+
+try:
+	import fcntl
+except ImportError:
+	# no flock on windows, the cache still works for a single process there
+	fcntl = None
+
+# ---------------------------
+# PERSISTENT BAR CACHE
+# ---------------------------
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'backtest', 'bars')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# new york hour after which the day's bar is final, the close is at 16 and yahoo settles it a bit later
+SETTLE_HOUR = 18
+try:
+	from zoneinfo import ZoneInfo
+	NEW_YORK = ZoneInfo('America/New_York')
+except Exception:
+	# no tz database, eastern standard time is off by an hour in summer which only moves the cutoff
+	NEW_YORK = timezone(timedelta(hours=-5))
+
+# one row per trading day, saved as a single .npy per ticker so it can be memory-mapped
+BAR_DTYPE = np.dtype([('date', 'datetime64[D]')] + [(field, 'f8') for field in FIELDS])
+
+'''
+merge_ranges function sorts and joins overlapping or touching [start, end) day ranges
+(list) [[start, end], ...] of iso date strings -> (list) merged ranges
+'''
+def merge_ranges(ranges):
+	merged = []
+	for start, end in sorted(ranges):
+		if merged and start <= merged[-1][1]:
+			merged[-1][1] = max(merged[-1][1], end)
+		else:
+			merged.append([start, end])
+	return merged
+
+'''
+missing_ranges function returns the parts of [start, end) not covered by ranges
+'''
+def missing_ranges(ranges, start, end):
+	gaps = []
+	cursor = start
+	for have_start, have_end in merge_ranges(ranges):
+		if have_end <= cursor:
+			continue
+		if have_start >= end:
+			break
+		if have_start > cursor:
+			gaps.append([cursor, have_start])
+		cursor = max(cursor, have_end)
+	if cursor < end:
+		gaps.append([cursor, end])
+	return gaps
+
+def day_str(date):
+	return date.strftime('%Y-%m-%d')
+
+def to_datetime(day):
+	return datetime.strptime(day, '%Y-%m-%d')
+
+'''
+settled_end function returns the first day whose bar may still change, as an iso date string:
+today until SETTLE_HOUR new york time, tomorrow after it. A range reaching past it is never
+marked covered, so today's partial bar is downloaded again once the session is over
+[optional] (datetime) now, aware -> (string) day
+'''
+def settled_end(now=None):
+	now = (now or datetime.now(timezone.utc)).astimezone(NEW_YORK)
+	day = now.date() + timedelta(days=1) if now.hour >= SETTLE_HOUR else now.date()
+	return day.strftime('%Y-%m-%d')
+
+def bars_to_records(bars):
+	records = np.empty(len(bars), dtype=BAR_DTYPE)
+	records['date'] = bars.dates
+	for field in FIELDS:
+		records[field] = bars.columns[field]
+	return records
+
+def records_to_bars(records):
+	return Bars(records['date'], {field: records[field] for field in FIELDS})
+
+'''
+BarCache class. A source that wraps another source (usually YahooSource) and keeps
+every ticker it has seen on disk under cache_dir:
+	index.json          covered date ranges, size and last use per ticker
+	<ticker>.npy        structured array of bars, opened memory-mapped
+A fetch only asks the upstream source for the gaps between what is on disk and what
+was requested, then appends them. Days that are not over yet are never marked covered.
+When the cache grows past max_bytes the least recently used tickers are dropped. offline
+True never asks the upstream source, a fetch returns whatever part of the range is on disk.
+Index and file reads and writes happen under an flock on cache_dir/.lock so several backtest
+processes on one box can share the directory, the downloads happen outside it so one process
+waiting on the network never holds up the others.
+'''
+class BarCache:
+	def __init__(self, upstream, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+		self.upstream = upstream
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.offline = offline
+		os.makedirs(cache_dir, exist_ok=True)
+
+	@contextmanager
+	def locked(self):
+		with open(os.path.join(self.cache_dir, '.lock'), 'a') as lock:
+			if fcntl is not None:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				if fcntl is not None:
+					fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def path(self, ticker):
+		return os.path.join(self.cache_dir, ticker + '.npy')
+
+	def read_index(self):
+		try:
+			with open(os.path.join(self.cache_dir, 'index.json')) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def write_index(self, index):
+		path = os.path.join(self.cache_dir, 'index.json')
+		with open(path + '.tmp', 'w') as f:
+			json.dump(index, f)
+		os.replace(path + '.tmp', path)
+
+	def write_records(self, ticker, records):
+		save_array(self.path(ticker), records)
+
+	def load(self, ticker):
+		if not os.path.exists(self.path(ticker)):
+			return np.empty(0, dtype=BAR_DTYPE)
+		return np.load(self.path(ticker), mmap_mode='r')
+
+	'''
+	fetch function returns the cached bars of ticker for start <= date < end,
+	downloading and appending only the date ranges the cache does not hold yet
+	(string) ticker, (datetime) start, (datetime) end -> Bars
+	'''
+	def fetch(self, ticker, start, end):
+		ticker = ticker.lower()
+		gaps = self.gaps([ticker], start, end)[ticker]
+		fetched = {}
+		if gaps and not self.offline:
+			# downloaded outside the lock, an upstream error propagates and the gap stays uncovered
+			fetched[ticker] = [(gap_start, gap_end, self.upstream.fetch(ticker, to_datetime(gap_start), to_datetime(gap_end))) for gap_start, gap_end in gaps]
+		records = self.commit(fetched, [ticker])[ticker]
+		if len(records) == 0:
+			return empty_bars()
+		return records_to_bars(records).between(start, end)
+
+	'''
+	fetch_many function is fetch for a batch of tickers: the gaps of every ticker are grouped by
+	date range and each group goes to the upstream source as one batch, so a YahooSource
+	downloads them concurrently
+	(list) tickers, (datetime) start, (datetime) end -> (dict) ticker -> Bars, or the upstream exception
+	'''
+	def fetch_many(self, tickers, start, end):
+		tickers = [ticker.lower() for ticker in tickers]
+		gaps = self.gaps(tickers, start, end)
+		batches = {}
+		if not self.offline:
+			for ticker in tickers:
+				for gap in gaps[ticker]:
+					batches.setdefault(tuple(gap), []).append(ticker)
+		fetched = {}
+		errors = {}
+		for (gap_start, gap_end), batch in batches.items():
+			answers = fetch_many(self.upstream, batch, to_datetime(gap_start), to_datetime(gap_end))
+			for ticker in batch:
+				if isinstance(answers[ticker], Exception):
+					# the gap stays uncovered, like an upstream error in fetch
+					errors[ticker] = answers[ticker]
+				else:
+					fetched.setdefault(ticker, []).append((gap_start, gap_end, answers[ticker]))
+		records = self.commit(fetched, tickers)
+		results = {}
+		for ticker in tickers:
+			if ticker in errors:
+				results[ticker] = errors[ticker]
+			else:
+				results[ticker] = records_to_bars(records[ticker]).between(start, end) if len(records[ticker]) else empty_bars()
+		return results
+
+	'''
+	gaps function reads the index and returns the parts of [start, end) each ticker is missing
+	(list) tickers, (datetime) start, end -> (dict) ticker -> (list) gaps
+	'''
+	def gaps(self, tickers, start, end):
+		with self.locked():
+			index = self.read_index()
+		result = {}
+		for ticker in tickers:
+			ranges = index[ticker]['ranges'] if ticker in index else []
+			result[ticker] = missing_ranges(ranges, day_str(start), day_str(end))
+			count('bar_cache.miss' if result[ticker] else 'bar_cache.hit')
+		return result
+
+	'''
+	commit function merges downloaded gaps into the cache and marks the tickers used. The index
+	and each ticker's file are read again under the lock, another process may have written them
+	while this one was downloading. Only the settled part of a gap (see settled_end) is marked
+	covered, the bars after it are kept but asked for again by the next fetch
+	(dict) ticker -> list of (gap_start, gap_end, Bars), (list) tickers -> (dict) ticker -> records
+	'''
+	def commit(self, fetched, tickers):
+		settled = settled_end()
+		with self.locked():
+			index = self.read_index()
+			for ticker, gaps in fetched.items():
+				entry = index.setdefault(ticker, {'ranges': [], 'bytes': 0, 'used': 0})
+				bars = records_to_bars(np.array(self.load(ticker)))
+				for gap_start, gap_end, answer in gaps:
+					bars = bars.merge(answer)
+					covered_end = min(gap_end, settled)
+					if gap_start < covered_end:
+						entry['ranges'].append([gap_start, covered_end])
+				records = bars_to_records(bars)
+				self.write_records(ticker, records)
+				entry['ranges'] = merge_ranges(entry['ranges'])
+				entry['bytes'] = int(records.nbytes)
+			now = time.time()
+			for ticker in tickers:
+				index.setdefault(ticker, {'ranges': [], 'bytes': 0, 'used': 0})['used'] = now
+			self.evict(index, keep=set(tickers))
+			self.write_index(index)
+			return {ticker: self.load(ticker) for ticker in tickers}
+
+	'''
+	evict function drops least recently used tickers until the cache fits in max_bytes
+	'''
+	def evict(self, index, keep=()):
+		total = sum(entry['bytes'] for entry in index.values())
+		for ticker in sorted(index, key=lambda t: index[t]['used']):
+			if total <= self.max_bytes:
+				break
+			if ticker in keep:
+				continue
+			total -= index[ticker]['bytes']
+			del index[ticker]
+			if os.path.exists(self.path(ticker)):
+				os.remove(self.path(ticker))
+
+	'''
+	clear function removes everything in the cache directory
+	'''
+	def clear(self):
+		with self.locked():
+			for name in os.listdir(self.cache_dir):
+				if name != '.lock':
+					path = os.path.join(self.cache_dir, name)
+					if os.path.isdir(path):
+						shutil.rmtree(path)
+					else:
+						os.remove(path)
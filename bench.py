@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import bt
+from prices import Bars, PriceStore, MemorySource, to_day
+from trading_calendar import nyse_calendar
+from insider import InsiderFeed, Filing
+from tradability import TradabilityService
+
+try:
+	import resource
+except ImportError:
+	# no getrusage on windows, peak memory is reported as 0 there
+	resource = None
+
+# ---------------------------
+# BENCHMARKS
+# ---------------------------
+
+DEFAULT_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baselines.json')
+
+'''
+scenario name -> (int) years of sessions, (int) algos, (int) tickers, (int) filings per day
+'''
+SCENARIOS = {
+	'tiny': (0.25, 4, 20, 5),
+	'1y_10': (1, 10, 100, 20),
+	'1y_100': (1, 100, 200, 20),
+	'5y_100': (5, 100, 500, 30),
+	'10y_500': (10, 500, 1000, 50),
+}
+
+# engines cycled through to build a scenario's algos
+ENGINES = [bt.noop_engine, bt.basic_stock_engine, bt.basic_msft_stock_engine, bt.basic_arkk_stock_engine] + [getattr(bt, 'openinsider_cluster_stock_engine' + suffix) for suffix in [''] + [str(i) for i in range(2, 13)]] + [bt.openinsider_universe_engine, bt.openinsider_universe_engine2]
+
+# tickers the engines ask for by name, always part of the synthetic universe
+NAMED_TICKERS = ['spy', 'msft', 'arkk']
+
+'''
+synthetic_bars function generates deterministic daily bars for every ticker over the sessions:
+a geometric random walk per ticker with a gap between each close and the next open, starting
+prices spread from $1 to $60 so every cluster engine's price screen finds something
+(list) tickers, (np.array) sessions datetime64[D], [optional] (int) seed -> (dict) ticker -> Bars
+'''
+def synthetic_bars(tickers, sessions, seed=0):
+	rng = np.random.default_rng(seed)
+	days, count = len(sessions), len(tickers)
+	first = rng.uniform(1, 60, count)
+	closes = first * np.exp(np.cumsum(rng.normal(0.0002, 0.02, (days, count)), axis=0))
+	opens = np.vstack([first, closes[:-1]]) * np.exp(rng.normal(0, 0.01, (days, count)))
+	highs = np.maximum(opens, closes) * (1 + np.abs(rng.normal(0, 0.01, (days, count))))
+	lows = np.minimum(opens, closes) * (1 - np.abs(rng.normal(0, 0.01, (days, count))))
+	volumes = np.round(rng.lognormal(13, 1, (days, count)))
+	bars = {}
+	for column, ticker in enumerate(tickers):
+		bars[ticker] = Bars(sessions, {'open': opens[:, column], 'high': highs[:, column], 'low': lows[:, column], 'close': closes[:, column], 'adjclose': closes[:, column], 'volume': volumes[:, column]})
+	return bars
+
+'''
+synthetic_filings function generates deterministic insider purchases, filings_per_day of them
+each session at that day's close, by one of five insiders per ticker so the cluster screens
+(min_insiders 3 and 4) fire now and then
+(dict) ticker -> Bars, (np.array) sessions, (int) filings_per_day, [optional] (int) seed -> InsiderFeed
+'''
+def synthetic_filings(bars, sessions, filings_per_day, seed=0):
+	rng = np.random.default_rng(seed + 1)
+	tickers = sorted(bars)
+	filings = []
+	for row, day in enumerate(sessions):
+		for column in rng.integers(0, len(tickers), filings_per_day):
+			ticker = tickers[column]
+			insider = int(rng.integers(5))
+			filings.append(Filing(ticker, day + int(rng.integers(0, 3)), day, round(float(bars[ticker].columns['close'][row]), 2), 1, float(rng.uniform(1e4, 5e5)), ticker + ' insider %d' % insider))
+	return InsiderFeed(filings)
+
+'''
+make_scenario function builds everything a scenario's backtest needs, all in memory
+(string) name, [optional] (int) seed -> (tuple) start, end as m-d-Y, algos, store, calendar, insider feed
+'''
+def make_scenario(name, seed=0):
+	years, algo_count, ticker_count, filings_per_day = SCENARIOS[name]
+	calendar = nyse_calendar()
+	end = datetime(2020, 12, 31)
+	start = end - timedelta(days=int(365 * years))
+	lookback = 30
+	sessions = calendar.sessions[(calendar.sessions >= to_day(start - timedelta(days=lookback))) & (calendar.sessions < to_day(end))]
+	tickers = NAMED_TICKERS + ['t%04d' % i for i in range(ticker_count - len(NAMED_TICKERS))]
+	bars = synthetic_bars(tickers, sessions, seed)
+	feed = synthetic_filings(bars, sessions, filings_per_day, seed)
+	algos = [bt.Algo('%s_%d' % (getattr(ENGINES[i % len(ENGINES)], '__name__', 'cluster'), i), ENGINES[i % len(ENGINES)]) for i in range(algo_count)]
+	store = PriceStore(MemorySource(bars))
+	return start.strftime('%m-%d-%Y'), end.strftime('%m-%d-%Y'), algos, store, calendar, feed
+
+def peak_memory_mb():
+	if resource is None:
+		return 0.0
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# linux reports kilobytes, macos bytes
+	return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+'''
+run_scenario function backtests one scenario and measures it, data generation is not timed.
+Meant to run in a fresh process (see run_benchmarks) so peak memory is this scenario's own
+(tuple) name, processes, valuation -> (dict) result
+'''
+def run_scenario(task):
+	name, processes, valuation = task
+	start, end, algos, store, calendar, feed = make_scenario(name)
+	backtester = bt.Backtester(start, end, algos, 2000, store=store, calendar=calendar, insider_feed=feed, tradability=TradabilityService(cache_path=None, offline=True), processes=processes, valuation=valuation)
+	began = time.perf_counter()
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		backtester.backtest()
+	seconds = time.perf_counter() - began
+	sessions = len(backtester.dates)
+	return {
+		'scenario': name,
+		'sessions': sessions,
+		'algos': len(algos),
+		'seconds': seconds,
+		'throughput': sessions * len(algos) / seconds,
+		'peak_mb': peak_memory_mb(),
+	}
+
+'''
+run_benchmarks function runs each scenario repeat times, each time in a fresh process, and
+keeps the fastest run (the least disturbed by whatever else the machine was doing)
+(list) names, [optional] (int) processes per backtest, (string) valuation, (int) repeat -> (list) results
+'''
+def run_benchmarks(names, processes=1, valuation='daily', repeat=3):
+	results = []
+	for name in names:
+		runs = []
+		for _ in range(repeat):
+			with ProcessPoolExecutor(max_workers=1) as pool:
+				runs.append(pool.submit(run_scenario, (name, processes, valuation)).result())
+		results.append(max(runs, key=lambda result: result['throughput']))
+	return results
+
+def load_baselines(path):
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def save_baselines(results, path):
+	baselines = load_baselines(path)
+	for result in results:
+		baselines[result['scenario']] = {'throughput': result['throughput'], 'peak_mb': result['peak_mb']}
+	with open(path, 'w') as f:
+		json.dump(baselines, f, indent=1)
+
+'''
+compare function checks results against the stored baselines, a scenario regresses when its
+throughput drops or its peak memory grows by more than tolerance
+(list) results, (dict) baselines, [optional] (float) tolerance -> (list) regression messages
+'''
+def compare(results, baselines, tolerance=0.2):
+	regressions = []
+	for result in results:
+		baseline = baselines.get(result['scenario'])
+		if baseline is None:
+			continue
+		if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+			regressions.append('%s throughput %.0f < baseline %.0f' % (result['scenario'], result['throughput'], baseline['throughput']))
+		if baseline['peak_mb'] and result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance):
+			regressions.append('%s peak memory %.0f MB > baseline %.0f MB' % (result['scenario'], result['peak_mb'], baseline['peak_mb']))
+	return regressions
+
+def report(results, baselines):
+	print('%-10s %9s %7s %10s %16s %10s %12s' % ('scenario', 'sessions', 'algos', 'seconds', 'session*algo/s', 'peak MB', 'vs baseline'))
+	for result in results:
+		baseline = baselines.get(result['scenario'])
+		change = '%+.1f%%' % (100 * (result['throughput'] / baseline['throughput'] - 1)) if baseline else ''
+		print('%-10s %9d %7d %10.2f %16.0f %10.1f %12s' % (result['scenario'], result['sessions'], result['algos'], result['seconds'], result['throughput'], result['peak_mb'], change))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Backtester benchmarks on synthetic market data')
+	parser.add_argument('scenarios', nargs='*', default=['tiny', '1y_10'], help='any of ' + ', '.join(SCENARIOS))
+	parser.add_argument('--processes', type=int, default=1)
+	parser.add_argument('--valuation', default='daily', choices=['daily', 'post'])
+	parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the fastest is kept')
+	parser.add_argument('--baselines', default=DEFAULT_BASELINES)
+	parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown or memory growth before a run counts as a regression')
+	parser.add_argument('--save', action='store_true', help='store these results as the new baselines')
+	args = parser.parse_args()
+	results = run_benchmarks(args.scenarios, args.processes, args.valuation, args.repeat)
+	baselines = load_baselines(args.baselines)
+	report(results, baselines)
+	if args.save:
+		save_baselines(results, args.baselines)
+	else:
+		regressions = compare(results, baselines, args.tolerance)
+		for regression in regressions:
+			print('REGRESSION', regression)
+		sys.exit(1 if regressions else 0)
@@ -1,12 +1,45 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from datetime import datetime, timedelta
-import yahoo_fin.stock_info as si
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+import contextvars
+import inspect
+import os
+import gzip
+import tempfile
+import pickle
+from prices import PriceStore, YahooSource, to_day
+from bar_cache import BarCache
+from trading_calendar import nyse_calendar
+from indicators import Indicators
+from insider import Screen, openinsider_url, parse_table, page_screen
+import profiling
+from profiling import Profiler, span, count
+from tradability import TradabilityService
+from portfolio import Portfolio, BUY, SELL
+from valuation import equity_curve
+import report
+import vectorized
+import numpy as np
 
 # GLOBAL vars
 
+# every price lookup below is answered from this store, Backtester swaps in its own
+price_store = PriceStore()
+# trading sessions used for the date axis and the indicator windows
+trading_calendar = nyse_calendar()
+# memoized whole-history indicator series over price_store
+indicators = Indicators(price_store)
+# InsiderFeed answering the cluster engines' screens in memory, None means ask the live screener
+insider_feed = None
+# intraday.IntradayStore the stops are run against when set, None means daily open/close only
+intraday_store = None
+# execution.ExecutionModel the orders go through when set, None fills them at the asked price
+execution = None
+# answers check_if_rh_valid, Backtester can swap in an offline or listing backed one
+tradability = TradabilityService()
+# (algo name, date) of the engine being run, a context variable instead of module globals
+# so buy/sell logging stays right when several backtests run in threads or processes
+trade_context = contextvars.ContextVar('trade_context', default=('', None))
+
 
 # ---------------------------
 # CLASSES
@@ -16,11 +49,25 @@ from bs4 import BeautifulSoup
 Algo class. Initialized with a (string) name, and a (function) decision_engine
 The decision_engine is a function that takes in a given portfolio dict and datetime date 
 and decides what to do on that given date, whether to buy, sell, do nothing, etc.
+[optional] (list) tickers the engine trades, prefetched before the run. By default the
+engine's ticker argument default, e.g. 'msft' for basic_msft_stock_engine
 '''
 class Algo:
-	def __init__(self, name, decision_engine):
+	def __init__(self, name, decision_engine, tickers=None):
 		self.decision_engine = decision_engine
 		self.name = name
+		self.tickers = tickers if tickers is not None else engine_tickers(decision_engine)
+
+def engine_tickers(decision_engine):
+	if isinstance(getattr(decision_engine, 'tickers', None), list):
+		return list(decision_engine.tickers)
+	try:
+		parameter = inspect.signature(decision_engine).parameters.get('ticker')
+	except (TypeError, ValueError):
+		return []
+	if parameter is None or parameter.default is inspect.Parameter.empty:
+		return []
+	return [parameter.default]
 
 '''
 Portfolio object format
@@ -31,6 +78,8 @@ Portfolio object format
 	},
 	'cash' : 2000
 }
+Backtester hands engines a portfolio.Portfolio, which reads and writes like this dict but keeps
+positions in numpy arrays and logs every order to its ledger. Plain dicts still work everywhere
 '''
 
 # ---------------------------
@@ -42,54 +91,83 @@ get_stock function returns the opening and closing price of a stock on a given d
 (string) ticker, (datetime) date -> dictionary with open and close price (string to float)
 '''
 def get_stock(ticker, date):
-	# format:
-	# 			open			high				low				close				adj close		vol		tkr
-	# [[757.9199829101562, 758.760009765625, 747.7000122070312, 753.6699829101562, 753.6699829101562, 3521100, 'AMZN']]
-	res = si.get_data(ticker, start_date = date.strftime("%m-%d-%Y"), end_date = (date + timedelta(days=1)).strftime("%m-%d-%Y")).values.tolist()[0]
-	return {'open': res[0], 'close': res[3]}
+	# served from the price store, raises KeyError if the ticker has no bar that day
+	bar = price_store.bar(ticker, date)
+	return {'open': bar['open'], 'close': bar['close']}
 
 def sma(ticker, interval, date):
 	# we call this on a specific trading day, we can only know the SMA of the previous X days. So technically this is 
-	# the SMA of the previous day using the close prices
-	# fetch the last 12 days to be safe and not miss data from holidays and weekends
-	# we'll take only the last 5
-	res = si.get_data(ticker, start_date = (date - timedelta(days=12)).strftime("%m-%d-%Y"), end_date = date.strftime("%m-%d-%Y")).values.tolist()[-interval:]
-	closes = []
-	for result in res:
-		closes.append(result[3])
-	return sum(closes) / len(closes)
+	# the SMA of the previous day using the close prices, over exactly the last X sessions
+	window_start = trading_calendar.sessions_back(date, interval)
+	closes = price_store.get(ticker, date).between(window_start, date).columns['close']
+	return float(closes.sum()) / len(closes)
 
 def sma_volume(ticker, interval, date):
-	# we call this on a specific trading day, we can only know the SMA of the previous X days. So technically this is 
-	# the SMA of the previous day using the close prices
-	# fetch the last 12 days to be safe and not miss data from holidays and weekends
-	# we'll take only the last 5
-	res = si.get_data(ticker, start_date = (date - timedelta(days=12)).strftime("%m-%d-%Y"), end_date = date.strftime("%m-%d-%Y")).values.tolist()[-interval:]
-	closes = []
-	for result in res:
-		closes.append(result[5])
-	return sum(closes) / len(closes)
+	# same as sma but over the previous X sessions of volume
+	window_start = trading_calendar.sessions_back(date, interval)
+	volumes = price_store.get(ticker, date).between(window_start, date).columns['volume']
+	return float(volumes.sum()) / len(volumes)
+
+# ranked screener tables (insider.Screen) by url, the cluster engines (and sweep configs) ask
+# for the same screens again and again
+openinsider_cache = {}
+
+'''
+get_openinsider_screen function returns the whole ranked results table of a screener page
+(string) url -> Screen
+'''
+def get_openinsider_screen(url):
+	if url in openinsider_cache:
+		count('screener.hit')
+		return openinsider_cache[url]
+	count('screener.miss')
+	import requests
+	with span('screener'):
+		req = requests.get(url, headers={"content-type":"text"})
+	count('http.bytes', len(req.content))
+	# only the results table is parsed, see insider.parse_table
+	openinsider_cache[url] = page_screen(*parse_table(req.content))
+	return openinsider_cache[url]
 
 def get_openinsider(url):
-	req = requests.get(url, headers={"content-type":"text"})
-	soup = BeautifulSoup(req.content, 'html.parser')
-	table = []
-	for row in soup.select('thead tr'):
-		table.append([x.text for x in row.find_all('th')])
-	for row in soup.select('tbody tr'):
-		table.append([x.text for x in row.find_all('td')])
-	# this is a cool table, but for now lets just grab the ticker
-	if len(table) > 0:
-		return table[2][3].strip()
-	else:
-		return ''
+	tickers = get_openinsider_screen(url).tickers
+	return tickers[0] if len(tickers) else ''
+
+'''
+prefetch_openinsider function downloads every screener page in urls that is not cached yet
+concurrently and fills openinsider_cache, a page that fails is left for get_openinsider to retry
+(iterable) urls, [optional] (AsyncFetcher) fetcher -> (dict) url -> Screen
+'''
+def prefetch_openinsider(urls, fetcher=None):
+	urls = list(dict.fromkeys(urls))
+	missing = [url for url in urls if url not in openinsider_cache]
+	if fetcher is None:
+		from fetcher import AsyncFetcher
+		fetcher = AsyncFetcher(concurrency=8, headers={"content-type":"text"})
+	count('screener.hit', len(urls) - len(missing))
+	count('screener.miss', len(missing))
+	with span('screener.prefetch'):
+		bodies = fetcher.fetch_all(missing)
+	for url, body in zip(missing, bodies):
+		if isinstance(body, Exception):
+			print('Screener fetch failed', url, body)
+			continue
+		openinsider_cache[url] = page_screen(*parse_table(body))
+	return {url: openinsider_cache[url] for url in urls if url in openinsider_cache}
 
-def limit_sells(portfolio, date, stop_loss, stop_gain):
+'''
+limit_sells function sells every holding past its stop levels on date
+(dict) portfolio, (datetime) date, (float) stop_loss, stop_gain, [optional] (list) tickers, only
+these holdings are checked -> (dict) portfolio
+'''
+def limit_sells(portfolio, date, stop_loss, stop_gain, tickers=None):
+	if isinstance(portfolio, Portfolio):
+		return limit_sells_arrays(portfolio, date, stop_loss, stop_gain, tickers)
 	# cannot change dictionary size during iteration
 	# therefore can't use syntax ticker 'in portfolio'
 	# need to forrce a separate copy of list of keys, not an iterator of actual dict
 	for ticker in list(portfolio):
-		if ticker != 'cash':
+		if ticker != 'cash' and (tickers is None or ticker in tickers):
 			stock = get_stock(ticker, date)
 			if (stock['open'] < (1 - stop_loss) * portfolio[ticker]['purchase_price']):
 				# at open, we're below stop loss
@@ -105,12 +183,49 @@ def limit_sells(portfolio, date, stop_loss, stop_gain):
 				portfolio = sell_all(portfolio, ticker, stock['close'])
 	return portfolio
 
+'''
+limit_sells_arrays function is limit_sells for a Portfolio, the stop levels of every holding are
+checked at once against arrays of the day's opens and closes. With an intraday store, holdings
+that have intraday bars that day are stopped out on their real path instead, at the first bar
+that reaches a level (see intraday.first_crossings)
+(Portfolio) portfolio, (datetime) date, (float) stop_loss, stop_gain, [optional] (list) tickers -> (Portfolio) portfolio
+'''
+def limit_sells_arrays(portfolio, date, stop_loss, stop_gain, tickers=None):
+	ids = portfolio.held_ids()
+	if tickers is not None:
+		ids = np.array([id for id in ids if portfolio.tickers[id] in tickers], dtype=np.int64)
+	if len(ids) == 0:
+		return portfolio
+	low = (1 - stop_loss) * portfolio.purchase_prices[ids]
+	high = (1 + stop_gain) * portfolio.purchase_prices[ids]
+	if intraday_store is not None:
+		with span('intraday.stops'):
+			covered, exited, prices = intraday_store.stop_exits([portfolio.tickers[id] for id in ids], date, low, high)
+		for id, price in zip(ids[exited], prices[exited]):
+			portfolio = sell_all(portfolio, portfolio.tickers[id], float(price))
+		# the rest fall back to the daily open/close check
+		ids, low, high = ids[~covered], low[~covered], high[~covered]
+		if len(ids) == 0:
+			return portfolio
+	bars = [get_stock(portfolio.tickers[id], date) for id in ids]
+	opens = np.array([bar['open'] for bar in bars])
+	closes = np.array([bar['close'] for bar in bars])
+	# past a stop at the open sells at the open, otherwise past one at the close sells at the close
+	at_open = (opens < low) | (opens > high)
+	at_close = ~at_open & ((closes < low) | (closes > high))
+	for id, price in zip(ids[at_open], opens[at_open]):
+		portfolio = sell_all(portfolio, portfolio.tickers[id], float(price))
+	for id, price in zip(ids[at_close], closes[at_close]):
+		portfolio = sell_all(portfolio, portfolio.tickers[id], float(price))
+	return portfolio
+
 
 def sell(portfolio, ticker, shares, sell_price):
 	try:
 		if portfolio[ticker]['shares'] - shares < 0:
 			print('Cannot sell that many shares')
 		else:
+			record_trade(portfolio, SELL, ticker, shares, sell_price, portfolio[ticker]['purchase_price'])
 			portfolio[ticker]['shares'] -= shares
 			portfolio['cash'] += shares * sell_price
 	except:
@@ -118,20 +233,63 @@ def sell(portfolio, ticker, shares, sell_price):
 	finally:
 		return portfolio
 
+'''
+print_trade function prints one transaction, the fee only for fills of an execution model.
+Every trade line goes through here, so --quiet and the sweep workers silence them all at once
+(string) algo, (datetime) date, (string) side, ticker, (float) shares, price, [optional] fee -> None
+'''
+def print_trade(algo, date, side, ticker, shares, price, fee=None):
+	line = [date.strftime("%m-%d-%Y") if date is not None else '', algo, side, ticker, shares, price, shares * price]
+	print(*(line if fee is None else line + ['fee', fee]))
+
+'''
+log_trade function prints a transaction with the algo and date of the current trade_context,
+with an execution model the fills are printed when the book is settled instead
+'''
+def log_trade(side, ticker, shares, price):
+	if execution is not None:
+		return
+	algo, date = trade_context.get()
+	print_trade(algo, date, side, ticker, shares, price)
+
+'''
+record_trade function appends an order to the portfolio's ledger, plain dict portfolios have none.
+With an execution model the order goes to the session's book instead and the fill is recorded
+once it settles. Called before the order moves the cash, the book keeps the cash it started from
+'''
+def record_trade(portfolio, side, ticker, shares, price, purchase_price=0.0):
+	if not isinstance(portfolio, Portfolio):
+		return
+	algo, date = trade_context.get()
+	if execution is not None:
+		execution.submit(algo, portfolio['cash'], side, ticker, shares, price, purchase_price)
+	else:
+		portfolio.record(date, ticker, side, shares, price)
+
 def sell_all(portfolio, ticker, sell_price):
 	try:
 		holdings = portfolio.pop(ticker)
-		print(glbl_date.strftime("%m-%d-%Y"), glbl_algo, 'Sell', ticker, holdings['shares'], sell_price, holdings['shares'] * sell_price)
+		log_trade('Sell', ticker, holdings['shares'], sell_price)
+		record_trade(portfolio, SELL, ticker, holdings['shares'], sell_price, holdings['purchase_price'])
 		portfolio['cash'] += holdings['shares'] * sell_price
 	except:
 		print("Don't own the stock trying to be sold")
 	finally:
 		return portfolio
 
+'''
+buy function buys shares at purchase_price when the cash covers the whole order. With an
+execution model the order is first trimmed to what the cash covers once slippage and
+commission are paid
+(dict) portfolio, (string) ticker, (float) shares, purchase_price -> (dict) portfolio
+'''
 def buy(portfolio, ticker, shares, purchase_price):
-	if portfolio['cash'] > purchase_price:
+	if execution is not None and isinstance(portfolio, Portfolio):
+		shares = execution.affordable(ticker, shares, purchase_price, portfolio['cash'], trade_context.get()[1], indicators)
+	if shares > 0 and shares * purchase_price <= portfolio['cash']:
 		# if we buy a stock that already exists, average the purchase price and add the shares
-		print(glbl_date.strftime("%m-%d-%Y"), glbl_algo, 'Buy', ticker, shares, purchase_price, shares * purchase_price)
+		log_trade('Buy', ticker, shares, purchase_price)
+		record_trade(portfolio, BUY, ticker, shares, purchase_price)
 		if ticker in portfolio:
 			portfolio[ticker] = {'shares': shares + portfolio[ticker]['shares'], 'purchase_price': (purchase_price * shares + portfolio[ticker]['purchase_price'] * portfolio[ticker]['shares']) / (shares + portfolio[ticker]['shares'])}
 		else:
@@ -141,30 +299,39 @@ def buy(portfolio, ticker, shares, purchase_price):
 
 '''
 utility function to check if a ticker is a valid robinhood stock or not available
-due to being OTCMKT or some other reason
+due to being OTCMKT or some other reason. Answered by the tradability service, which
+caches answers between runs or reads them from a local listing file
 '''
 def check_if_rh_valid(ticker):
-	url = 'https://robinhood.com/stocks/' + ticker
-	req = requests.get(url, headers={"content-type":"text"})
-	soup = BeautifulSoup(req.content, 'html.parser')
-	for row in soup.select('header h1'):
-		if row.text == '404':
-			return False
-	return True
+	with span('tradability'):
+		return tradability.check(ticker)
+
+'''
+check_many_rh_valid function is check_if_rh_valid for a batch of tickers, the unknown ones are
+fetched concurrently and saved together
+(list) tickers -> (dict) lowercase ticker -> bool
+'''
+def check_many_rh_valid(tickers):
+	with span('tradability'):
+		return tradability.check_many(tickers)
 
 
 '''
-calculate_portfolio_value function returns the total portfolio worth at close on given date
+calculate_portfolio_value function returns the total portfolio worth at close on given date.
+A holding without a bar that day is valued at its last close, like valuation.close_matrix does
 (dict) portfolio, (datetime) date -> (float) total
 '''
 def calculate_portfolio_value(portfolio, date):
+	if isinstance(portfolio, Portfolio):
+		closes = np.array([price_store.last_close(portfolio.tickers[id], date) for id in portfolio.held_ids()])
+		return portfolio.market_value(closes)
 	total = 0
 	total += portfolio['cash']
 	for ticker in portfolio:
 		if ticker == 'cash':
 			continue
 		else:
-			closing_price_on_date = si.get_data(ticker, start_date = date.strftime("%m-%d-%Y"), end_date = (date + timedelta(days=1)).strftime("%m-%d-%Y")).values.tolist()[0][3]
+			closing_price_on_date = price_store.last_close(ticker, date)
 			shares = portfolio[ticker]['shares']
 			total += (closing_price_on_date * shares)
 	return total
@@ -177,13 +344,13 @@ def calculate_portfolio_value(portfolio, date):
 if the 5-day SPY SMA is increasing return true
 '''
 def fiveday_spy_sma_3_apart_indicator(date):
-	return (sma('spy', 5, date) - sma('spy', 5, date - timedelta(days=2))) > 0
+	return (indicators.value('spy', 'sma', date, 5) - indicators.value('spy', 'sma', date - timedelta(days=2), 5)) > 0
 
 '''
 if the 5-day SPY SMA volume is increasing return true
 '''
 def fiveday_spy_vol_sma_3_apart_indicator(date):
-	return (sma_volume('spy', 5, date) - sma_volume('spy', 5, date - timedelta(days=2))) > 0
+	return (indicators.value('spy', 'sma_volume', date, 5) - indicators.value('spy', 'sma_volume', date - timedelta(days=2), 5)) > 0
 
 # ---------------------------
 # DECISION ENGINES
@@ -218,154 +385,361 @@ def basic_msft_stock_engine(portfolio, date, ticker='msft'):
 def basic_arkk_stock_engine(portfolio, date, ticker='arkk'):
 	return basic_stock_engine(portfolio, date, ticker)
 
-# 2 day window, min price 3, insiders 4, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=3&ph=&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=2&nfl=&nfh=&nil=4&nih=&nol=0&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
+'''
+ClusterEngine class. A decision engine parameterized by the openinsider screen it trades:
+each day sell anything past the stop levels, then (if the optional market indicator agrees)
+buy the top insider purchase of the last window calendar days.
+(int) window days, (float) min_price, max_price, min_value in $k, (int) min_insiders,
+(float) stop_loss, stop_gain, (function) indicator of date -> bool
+An instance is called like any other engine, (dict) portfolio, (datetime) date -> (dict) portfolio,
+and unlike a closure it can be pickled into worker processes
+'''
+class ClusterEngine:
+	def __init__(self, window=2, min_price=None, max_price=None, min_value=None, min_insiders=None, stop_loss=0.05, stop_gain=0.02, indicator=None):
+		self.window = window
+		self.min_price = min_price
+		self.max_price = max_price
+		self.min_value = min_value
+		self.min_insiders = min_insiders
+		self.stop_loss = stop_loss
+		self.stop_gain = stop_gain
+		self.indicator = indicator
+
+	def __call__(self, pf, date):
+		portfolio = limit_sells(pf, date, self.stop_loss, self.stop_gain)
+		if self.indicator is not None and not self.indicator(date):
+			return portfolio
+		stock = self.screen(date)
+		if stock != '':
+			return basic_stock_engine(portfolio, date, stock)
+		else:
+			return portfolio
+
+	# how many of a screen's top tickers the engine can buy, Backtester.prefetch_data loads that many
+	depth = 1
+
+	'''
+	screen function returns the top ticker of this engine's screen on date
+	'''
+	def screen(self, date):
+		tickers = self.screen_table(date).tickers
+		return tickers[0] if len(tickers) else ''
+
+	'''
+	screen_table function returns the whole ranked screen on date, from the insider feed when
+	one is loaded and from the live screener otherwise
+	(datetime) date -> Screen
+	'''
+	def screen_table(self, date):
+		if insider_feed is not None:
+			with span('insider_feed.screen'):
+				return insider_feed.screen_table(date - timedelta(days=self.window), date, self.min_price, self.max_price, self.min_value, self.min_insiders)
+		return get_openinsider_screen(self.screen_url(date))
+
+	def screen_url(self, date):
+		return openinsider_url(date - timedelta(days=self.window), date, self.min_price, self.max_price, self.min_value, self.min_insiders)
+
+	def __repr__(self):
+		params = ['%s=%s' % (key, getattr(value, '__name__', value)) for key, value in vars(self).items() if value is not None]
+		return type(self).__name__ + '(' + ', '.join(params) + ')'
 
-# 2 day window, min price 3, insiders 4, vol indicator, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine2(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	if not fiveday_spy_vol_sma_3_apart_indicator(date):
-		return portfolio
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=3&ph=&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=2&nfl=&nfh=&nil=4&nih=&nol=0&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
+'''
+make_cluster_engine function is the factory the sweep runner uses, same params as ClusterEngine
+'''
+def make_cluster_engine(**params):
+	return ClusterEngine(**params)
 
+# 2 day window, min price 3, insiders 4, stop loss 5%, stop gain 2%
+openinsider_cluster_stock_engine = make_cluster_engine(min_price=3, min_insiders=4)
+# 2 day window, min price 3, insiders 4, vol indicator, stop loss 5%, stop gain 2%
+openinsider_cluster_stock_engine2 = make_cluster_engine(min_price=3, min_insiders=4, indicator=fiveday_spy_vol_sma_3_apart_indicator)
 # 2 day window, max price 5, min val 50k, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine3(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=50&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine3 = make_cluster_engine(max_price=5, min_value=50)
 # 2 day window, max price 50, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine4(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=50&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine4 = make_cluster_engine(max_price=50)
 # 2 day window, max price 5, stop loss 8%, stop gain 5%
-def openinsider_cluster_stock_engine5(pf, date, stop_loss=0.08, stop_gain=0.05):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine5 = make_cluster_engine(max_price=5, stop_loss=0.08, stop_gain=0.05)
 # 2 day window, max price 5, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine6(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine6 = make_cluster_engine(max_price=5)
 # 2 day window, max price 6, insiders 3, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine7(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=6&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=2&nfl=&nfh=&nil=3&nih=&nol=0&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine7 = make_cluster_engine(max_price=6, min_insiders=3)
 # 2 day window, max price 5, sma indicator, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine8(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	if not fiveday_spy_sma_3_apart_indicator(date):
-		return portfolio
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
-
+openinsider_cluster_stock_engine8 = make_cluster_engine(max_price=5, indicator=fiveday_spy_sma_3_apart_indicator)
 # 2 day window, min price 3, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine9(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=2)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=3&ph=&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
+openinsider_cluster_stock_engine9 = make_cluster_engine(min_price=3)
+# 0 day window, max price 5, stop loss 5%, stop gain 2%
+openinsider_cluster_stock_engine10 = make_cluster_engine(window=0, max_price=5)
+# 4 day window, max price 5, stop loss 5%, stop gain 2%
+openinsider_cluster_stock_engine11 = make_cluster_engine(window=4, max_price=5)
+# 3 day window, max price 5, stop loss 5%, stop gain 2%
+openinsider_cluster_stock_engine12 = make_cluster_engine(window=3, max_price=5)
 
-# 0 day window, max price 5, stop loss 5%, stop gain 7%
-def openinsider_cluster_stock_engine10(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=1)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date2 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
+# ---------------------------
+# UNIVERSE ENGINES
+# ---------------------------
 
-# 4 day window, max price 5, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine11(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=4)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
-		return portfolio
+'''
+Universe class. The candidates of one day as columnar arrays: tickers in screen rank order,
+then any held ticker the screen did not return, and one float array per feature, nan where
+a value is unknown. Always there:
+	rank			position in the screen, inf for held tickers outside it
+	insider_price, insider_value, insiders		the screen row's price, $ value and insider count
+	held, shares, weight		1.0 when held, shares held, share of equity at today's open
+	open, prev_close			today's open (nan without a bar) and the last close before today
+plus one array per entry of the engine's features. cash and equity (at today's open) ride along
+'''
+class Universe:
+	def __init__(self, tickers, features, cash, equity):
+		self.tickers = tickers
+		self.features = features
+		self.cash = cash
+		self.equity = equity
 
-# 3 day window, max price 5, stop loss 5%, stop gain 2%
-def openinsider_cluster_stock_engine12(pf, date, stop_loss=0.05, stop_gain=0.02):
-	portfolio = limit_sells(pf, date, stop_loss, stop_loss)
-	date2 = date.strftime("%m-%d-%Y").replace('-', '%2F')
-	date1 = (date - timedelta(days=3)).strftime("%m-%d-%Y").replace('-', '%2F')
-	url = "http://openinsider.com/screener?s=&o=&pl=&ph=5&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=0&nfl=&nfh=&nil=&nih=&nol=&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=100&page=1"
-	stock = get_openinsider(url)
-	if stock != '':
-		return basic_stock_engine(portfolio, date, stock)
-	else:
+	def __len__(self):
+		return len(self.tickers)
+
+	def __getitem__(self, name):
+		return self.features[name]
+
+'''
+build_universe function gathers a Universe for date from a ranked Screen and the portfolio
+(Screen) screen, (Portfolio) portfolio, (datetime) date, (dict) features name -> (indicator, *params) -> Universe
+'''
+def build_universe(screen, portfolio, date, features):
+	held = [ticker for ticker in portfolio if ticker != 'cash']
+	ranked = list(screen.tickers)
+	in_screen = set(ranked)
+	outside = [ticker for ticker in held if ticker not in in_screen]
+	tickers = np.array(ranked + outside, dtype=object)
+	padding = np.full(len(outside), np.nan)
+	columns = {
+		'rank': np.concatenate([np.arange(len(ranked), dtype=np.float64), np.full(len(outside), np.inf)]),
+		'insider_price': np.concatenate([np.asarray(screen.prices, dtype=np.float64), padding]),
+		'insider_value': np.concatenate([np.asarray(screen.values, dtype=np.float64), padding]),
+		'insiders': np.concatenate([np.asarray(screen.insiders, dtype=np.float64), padding]),
+		'shares': np.array([portfolio[ticker]['shares'] if ticker in portfolio else 0.0 for ticker in tickers], dtype=np.float64),
+	}
+	# every feature is read out of the indicators' stacked whole-history matrices, no per ticker lookups
+	stack = indicators.stack(tickers, date)
+	stacked = stack.columns_of(tickers)
+	rows = stack.rows_before(stacked, date)
+	known = rows >= 0
+	before = np.maximum(rows, 0)
+	today = np.minimum(rows + 1, len(stack.dates) - 1)
+	traded = (rows + 1 < stack.lengths[stacked]) & (stack.dates[today, stacked] == to_day(date))
+	columns['open'] = np.where(traded, stack.columns['open'][today, stacked], np.nan)
+	columns['prev_close'] = np.where(known, stack.columns['close'][before, stacked], np.nan)
+	for name, spec in features.items():
+		columns[name] = np.where(known, indicators.stacked_series(spec[0], *spec[1:])[before, stacked], np.nan)
+	columns['held'] = (columns['shares'] > 0).astype(np.float64)
+	# a held ticker without a bar today is valued at its last close, like the post valuation does
+	marks = np.where(np.isnan(columns['open']), columns['prev_close'], columns['open'])
+	holdings = np.where(columns['shares'] > 0, columns['shares'] * np.nan_to_num(marks), 0)
+	equity = portfolio['cash'] + holdings.sum()
+	columns['weight'] = holdings / equity if equity > 0 else np.zeros(len(tickers))
+	return Universe(tickers, columns, portfolio['cash'], equity)
+
+'''
+scoring functions, (Universe) universe -> (np.array) score per ticker, higher is better,
+nan or -inf means never buy
+'''
+def rank_score(universe):
+	return -universe['rank']
+
+def value_score(universe):
+	return universe['insider_value']
+
+def insiders_score(universe):
+	# more insiders first, screen rank breaks ties
+	return universe['insiders'] - universe['rank'] / (len(universe) + 1)
+
+'''
+FillSlots class. The default sizing: hold positions until the stops sell them and fill each
+free slot (out of slots) with the best scoring candidate that has a bar today, each getting an
+equal 1 / slots share of equity, or an even split of the cash left when that is less
+(int) slots, [optional] (function) score from above -> callable (Universe) -> (np.array) target weights
+'''
+class FillSlots:
+	def __init__(self, slots=5, score=rank_score):
+		self.slots = slots
+		self.score = score
+
+	def __call__(self, universe):
+		weights = universe['weight'].copy()
+		held = universe['held'] > 0
+		free = self.slots - int(held.sum())
+		if free <= 0 or universe.equity <= 0:
+			return weights
+		scores = np.asarray(self.score(universe), dtype=np.float64)
+		buyable = ~held & np.isfinite(universe['open']) & ~np.isnan(scores) & (scores > -np.inf)
+		order = np.argsort(-np.where(buyable, scores, -np.inf), kind='stable')[:free]
+		order = order[buyable[order]]
+		if len(order):
+			weights[order] = min(1 / self.slots, universe.cash / universe.equity / len(order))
+		return weights
+
+	def __repr__(self):
+		return 'FillSlots(%d, %s)' % (self.slots, getattr(self.score, '__name__', self.score))
+
+'''
+rebalance function trades the portfolio at today's open toward target weights of equity in
+whole shares: sells first (to zero or down to the target), then buys in universe order while
+the cash lasts. Tickers without a bar today are left alone
+(Portfolio) portfolio, (datetime) date, (Universe) universe, (np.array) targets -> (Portfolio) portfolio
+'''
+def rebalance(portfolio, date, universe, targets):
+	opens = universe['open']
+	current = universe['shares']
+	tradable = np.isfinite(opens)
+	targets = np.where(tradable, np.nan_to_num(targets), 0)
+	# a held position sized at exactly its current weight must not lose a share to rounding
+	wanted = np.where(tradable, np.floor(targets * universe.equity / np.where(tradable, opens, 1) + 1e-9), current)
+	for i in np.flatnonzero(tradable & (wanted < current)):
+		if wanted[i] <= 0:
+			portfolio = sell_all(portfolio, universe.tickers[i], float(opens[i]))
+		else:
+			log_trade('Sell', universe.tickers[i], float(current[i] - wanted[i]), float(opens[i]))
+			portfolio = sell(portfolio, universe.tickers[i], float(current[i] - wanted[i]), float(opens[i]))
+	buys = np.flatnonzero(tradable & (wanted > current))
+	# the day's buy candidates are checked as one batch
+	valid = check_many_rh_valid([universe.tickers[i] for i in buys]) if len(buys) else {}
+	for i in buys:
+		units = min(wanted[i] - current[i], portfolio['cash'] // opens[i])
+		if units > 0 and valid[universe.tickers[i].lower()]:
+			portfolio = buy(portfolio, universe.tickers[i], float(units), float(opens[i]))
+	return portfolio
+
+'''
+UniverseEngine class. A ClusterEngine that buys many names instead of one: each day, after the
+stop sells, the top candidates of its screen (plus whatever it holds) become a Universe with
+precomputed features, decide turns that into target weights with array math over the whole
+universe, and the portfolio is rebalanced toward them at the open.
+Same screen params as ClusterEngine, plus
+	candidates	how many of the screen's top tickers make the universe
+	features	extra feature name -> (indicators name, *params), e.g. {'rsi': ('rsi', 14)}
+	decide		(Universe) -> (np.array) target weights of equity, FillSlots(5) by default
+'''
+class UniverseEngine(ClusterEngine):
+	def __init__(self, window=2, min_price=None, max_price=None, min_value=None, min_insiders=None, stop_loss=0.05, stop_gain=0.02, indicator=None, candidates=50, features=None, decide=None):
+		super().__init__(window, min_price, max_price, min_value, min_insiders, stop_loss, stop_gain, indicator)
+		self.candidates = candidates
+		self.features = features or {}
+		self.decide = decide if decide is not None else FillSlots()
+
+	@property
+	def depth(self):
+		return self.candidates
+
+	def __call__(self, pf, date):
+		portfolio = limit_sells(pf, date, self.stop_loss, self.stop_gain)
+		if self.indicator is not None and not self.indicator(date):
+			return portfolio
+		universe = self.universe(portfolio, date)
+		if len(universe) == 0:
+			return portfolio
+		with span('universe.decide'):
+			targets = self.decide(universe)
+		return rebalance(portfolio, date, universe, targets)
+
+	def universe(self, portfolio, date):
+		screen = self.screen_table(date)
+		screen = Screen(*(column[:self.candidates] for column in screen))
+		with span('universe.build'):
+			return build_universe(screen, portfolio, date, self.features)
+
+def make_universe_engine(**params):
+	return UniverseEngine(**params)
+
+# 2 day window, max price 50, the top 20 screen names, 5 equal slots, stop loss 5%, stop gain 2%
+openinsider_universe_engine = make_universe_engine(max_price=50, candidates=20)
+# 2 day window, min value 100k, the 10 names with the most insiders, stop loss 8%, stop gain 5%
+openinsider_universe_engine2 = make_universe_engine(min_value=100, candidates=50, stop_loss=0.08, stop_gain=0.05, decide=FillSlots(10, insiders_score))
+
+# ---------------------------
+# TARGET WEIGHT ENGINES
+# ---------------------------
+
+'''
+WeightsEngine class. Trades a (dates x tickers) target weight matrix with the semantics of
+vectorized.backtest_weights(whole_shares=True), one session at a time: each day the holdings
+whose weight went off sell at the open, then the stops (limit_sells), then every ticker to buy
+(the first day of its block, or with reenter any day of a block it is not held) gets
+min(floor(weight * equity at the open / open), cash // open) shares. A ticker without a bar
+that day is left alone. Backtester runs these engines over the whole history at once with
+vectorized.backtest_weights when nothing the vectorized run does not model (an execution
+model, intraday stops) is set, and through this day by day path otherwise, to the same curve.
+	tickers		the columns of the weight matrix
+	weights		function (np.array) opens, closes (sessions x tickers, nan without a bar) ->
+				(np.array) weights of equity, row i traded at session i's open, so it should
+				only look at the rows before i
+	stop_loss, stop_gain, reenter	see vectorized
+The matrices are built for the run's sessions by prepare, which Backtester calls before the
+sessions run. An instance backs one run at a time
+'''
+class WeightsEngine:
+	def __init__(self, tickers, weights, stop_loss=None, stop_gain=None, reenter=False):
+		self.tickers = [ticker.lower() for ticker in tickers]
+		self.weights = weights
+		self.stop_loss = stop_loss
+		self.stop_gain = stop_gain
+		self.reenter = reenter
+		self.key = None
+		self.frame = None
+		self.rows = {}
+
+	'''
+	prepare function builds the price and weight matrices over sessions, once per store and range
+	(PriceStore) store, (list) sessions -> (dict) vectorized.weight_frame
+	'''
+	def prepare(self, store, sessions):
+		key = (id(store), sessions[0], sessions[-1]) if len(sessions) else None
+		if self.key != key or self.frame is None:
+			opens, closes = vectorized.price_matrices(store, self.tickers, sessions)
+			self.frame = vectorized.weight_frame(opens, closes, self.weights(opens, closes), self.reenter)
+			self.rows = {date: row for row, date in enumerate(sessions)}
+			self.key = key
+		return self.frame
+
+	def __call__(self, pf, date):
+		row = self.rows.get(date)
+		if row is None:
+			return pf
+		frame = self.frame
+		columns = {ticker: column for column, ticker in enumerate(self.tickers)}
+		portfolio = pf
+		held = [ticker for ticker in portfolio if ticker in columns]
+		for ticker in held:
+			column = columns[ticker]
+			if frame['bar'][row, column] and not frame['on'][row, column]:
+				portfolio = sell_all(portfolio, ticker, float(frame['opens'][row, column]))
+		held = [ticker for ticker in portfolio if ticker in columns]
+		if self.stop_loss is not None or self.stop_gain is not None:
+			stop_loss, stop_gain = vectorized.stop_levels(self.stop_loss, self.stop_gain)
+			portfolio = limit_sells(portfolio, date, stop_loss, stop_gain, [ticker for ticker in held if frame['bar'][row, columns[ticker]]])
+			held = [ticker for ticker in portfolio if ticker in columns]
+		buying = [column for column in np.flatnonzero(frame['buys'][row]) if self.tickers[column] not in portfolio]
+		if not buying:
+			return portfolio
+		# equity at the open summed in holding order, a holding without a bar today at its last close
+		marks = np.array([frame['open_marks'][row, columns[ticker]] for ticker in held])
+		shares = np.array([portfolio[ticker]['shares'] for ticker in held])
+		budget = portfolio['cash'] + float(np.add.accumulate(shares * marks)[-1]) if held else portfolio['cash']
+		for column in buying:
+			price = frame['opens'][row, column]
+			units = min(np.floor(frame['weights'][row, column] * budget / price), portfolio['cash'] // price)
+			if units > 0:
+				portfolio = buy(portfolio, self.tickers[column], float(units), float(price))
 		return portfolio
-		
+
+	def __getstate__(self):
+		# the matrices are rebuilt by prepare in whatever process runs the engine next
+		state = dict(self.__dict__)
+		state.update(key=None, frame=None, rows={})
+		return state
+
+	def __repr__(self):
+		return 'WeightsEngine(%d tickers, %s, stop_loss=%s, stop_gain=%s, reenter=%s)' % (len(self.tickers), getattr(self.weights, '__name__', self.weights), self.stop_loss, self.stop_gain, self.reenter)
+
 '''
 theres a lot of room to fiddle arround with adding overrall market indicator flags, sort by different things, different stop limits
 zacks doesn't look accessible, but maybe i could use a stock screener for undersold and highest volume
@@ -380,88 +754,395 @@ also print actual transactions
 '''
 Backtester class. Initialized with a (datetime) start_date and end_date, (list) array of
 algo objects to backtest, and (int) starting portfolio cash. Log portfolio worth each day
-and graph with matplotlib
+and graph with matplotlib. [optional] (PriceStore) store to serve prices from, by default
+a yahoo backed store that fetches each ticker's whole range once and keeps it in the
+on-disk bar cache, so re-running the same window does not download it again.
+[optional] (TradingCalendar) calendar of sessions to run on, by default the NYSE rule table.
+[optional] (int) lookback_days of price history loaded before start_date for the indicators,
+long screens like the 200-day SMA need about 300.
+[optional] (int) processes to split the algos over, each worker process runs its share of
+the algos against the prices the parent prefetched, shared read-only through one
+memory-mapped file. Decision engines have to be picklable (module level functions) for this.
+[optional] (InsiderFeed) insider_feed loaded for the run, the cluster engines screen it in
+memory instead of requesting a screener page per engine per day.
+[optional] (TradabilityService) tradability answering check_if_rh_valid, e.g. one backed by a
+listing file so the run never waits on robinhood.
+[optional] (string) valuation 'daily' values every portfolio after each session, 'post' only
+records the orders and rebuilds every equity curve at the end from the ledgers and a close
+matrix. 'post' needs every trade to go through buy/sell/sell_all
+[optional] (bool) prefetch the prices of every ticker the algos can touch in one concurrent
+batch before the first session, see prefetch_data
+[optional] (IntradayStore) intraday bars the stop sells run against, holdings without intraday
+bars on a day keep the daily open/close check
+[optional] (ExecutionModel) execution the orders go through: slippage, commission and volume
+capped partial fills, settled for every algo at once after each session's engines. None fills
+every order in full at the asked price
+[optional] (bool) profile times the run's phases (fetches, screener, tradability, each algo's
+engine, valuation) and counts cache hits, requests and bytes into self.profiler, a
+profiling.Profiler: print(bt.profiler.table()), bt.profiler.save_json(path) or
+bt.profiler.save_trace(path) for chrome://tracing. Off, the probes cost next to nothing
+[optional] (bool) history False stops dates and portfolio_values from growing, for long runs
+that stream iter_days() to disk instead. Needs valuation 'daily'
+[optional] (bool) vectorized runs the WeightsEngine algos over the whole history at once with
+vectorized.backtest_weights instead of session by session, see backtest_vectorized
+A run can be saved with checkpoint(path), picked up again with Backtester.resume(path) and
+carried past its end_date with extend(new_end_date), which only runs the new sessions.
+report(out_dir) writes the results to disk without a display, graph() opens them in a window
 '''
 class Backtester:
 
-	def __init__(self, start_date, end_date, algos, starting_wallet):
+	def __init__(self, start_date, end_date, algos, starting_wallet, store=None, calendar=None, lookback_days=30, processes=1, insider_feed=None, tradability=None, valuation='daily', prefetch=True, history=True, profile=False, intraday=None, execution=None, vectorized=True):
+		if valuation == 'post' and not history:
+			raise ValueError("valuation 'post' rebuilds the curves from the run's dates, it needs history=True")
+		self.lookback_days = lookback_days
+		self.processes = processes
 		self.start_date = datetime.strptime(start_date, '%m-%d-%Y')
 		self.end_date = datetime.strptime(end_date, '%m-%d-%Y')
+		self.store = store if store is not None else PriceStore(BarCache(YahooSource()))
+		self.store.set_range(self.start_date - timedelta(days=lookback_days), self.end_date)
+		self.calendar = calendar if calendar is not None else nyse_calendar()
+		self.indicators = Indicators(self.store)
+		self.insider_feed = insider_feed
+		self.tradability = tradability
+		self.valuation = valuation
+		self.prefetch = prefetch
+		self.history = history
+		self.profiler = Profiler() if profile else None
+		self.intraday = intraday
+		self.execution = execution
+		self.vectorized = vectorized
 		self.algos = algos
 		self.cash = starting_wallet
 		self.run = False
-		self.portfolios = {algo.name: {'cash': starting_wallet} for algo in self.algos}
+		self.portfolios = {algo.name: Portfolio(starting_wallet) for algo in self.algos}
 		self.dates = []
 		self.portfolio_values = {algo.name: [] for algo in self.algos}
+		# last session run, the next iter_days/extend picks up after it
+		self.last_date = None
+		# names of the algos the current backtest() runs vectorized, the session loop skips them
+		self.precomputed = set()
 		
 
 	def backtest(self):
-		delta = timedelta(days=1)
-		while self.start_date < self.end_date:
-			print(self.start_date.strftime("%m-%d-%Y"))
-			# skip over all weekends
-			if (self.start_date.weekday() < 5 ):
-				try:
-					# check if valid trading day (not holiday)
-					test_data = si.get_data("amzn", start_date = self.start_date.strftime("%m-%d-%Y"), end_date = (self.start_date + delta).strftime("%m-%d-%Y"))
-
-					self.dates.append(self.start_date)
-					for algo in self.algos:
-						# run engine and update portfolio for this day
-						try:
-							global glbl_algo
-							glbl_algo = algo.name
-							global glbl_date
-							glbl_date = self.start_date
-							self.portfolios[algo.name] = algo.decision_engine(self.portfolios[algo.name], self.start_date)
-						except Exception as e:
-							print('THE DECISION ENGINE FAILED ', algo.name, e)
-						# log the portfolio value
-						self.portfolio_values[algo.name].append(calculate_portfolio_value(self.portfolios[algo.name], self.start_date))
-				except:
-					# not a valid trading day
+		self.use_data()
+		vectorized_algos = self.vectorized_algos()
+		self.precomputed = {algo.name for algo in vectorized_algos}
+		parallel = self.processes > 1 and len(self.algos) - len(vectorized_algos) > 1 and self.last_date is None
+		# the workers only read what the parent loaded, so a parallel run always prefetches
+		if self.prefetch or parallel:
+			with span('prefetch'):
+				self.prefetch_data(self.next_date(), self.end_date)
+		try:
+			if parallel:
+				self.backtest_parallel()
+			else:
+				for date, values in self.iter_days():
 					pass
-			self.start_date += delta
+			self.backtest_vectorized(vectorized_algos)
+		finally:
+			self.precomputed = set()
+		if self.valuation == 'post' and not parallel:
+			self.value_portfolios()
+		self.run = True
+		return
+
+	'''
+	vectorized_algos function returns the algos backtest() hands to backtest_vectorized: the
+	WeightsEngine ones, on a fresh run with history and nothing the vectorized run does not
+	model (an execution model, intraday stops). Any other run takes them session by session
+	'''
+	def vectorized_algos(self):
+		if not self.vectorized or not self.history or self.last_date is not None or self.execution is not None or self.intraday is not None:
+			return []
+		return [algo for algo in self.algos if isinstance(algo.decision_engine, WeightsEngine)]
+
+	'''
+	backtest_vectorized function runs WeightsEngine algos over every session of the run at once
+	with vectorized.backtest_weights, after the session loop has set self.dates. Each gets the
+	curve and the portfolio (positions, cash and ledger) the session loop would have left it
+	(list) algos -> None
+	'''
+	def backtest_vectorized(self, algos):
+		if not algos:
+			return
+		self.use_data()
+		sessions = self.calendar.between(self.start_date, self.end_date)
+		rows = {date: row for row, date in enumerate(sessions)}
+		for algo in algos:
+			engine = algo.decision_engine
+			with span('vectorized', algo.name):
+				frame = engine.prepare(self.store, sessions)
+				result = vectorized.backtest_weights(frame['opens'], frame['closes'], frame['weights'], self.cash, engine.stop_loss, engine.stop_gain, engine.reenter, whole_shares=True)
+			portfolio = Portfolio(self.cash)
+			for trade in result['trades']:
+				portfolio.record(sessions[trade['row']], engine.tickers[trade['ticker']], int(trade['side']), float(trade['shares']), float(trade['price']))
+			for column in np.flatnonzero(result['shares'] > 0):
+				portfolio[engine.tickers[column]] = {'shares': float(result['shares'][column]), 'purchase_price': float(result['purchase_prices'][column])}
+			portfolio['cash'] = float(result['cash'][-1]) if len(sessions) else self.cash
+			self.portfolios[algo.name] = portfolio
+			self.portfolio_values[algo.name] = [float(result['equity'][rows[date]]) for date in self.dates]
+
+	'''
+	extend function carries the run on to a later end date, only the sessions after the last one
+	already run are processed
+	(string) end_date as m-d-Y -> None
+	'''
+	def extend(self, end_date):
+		self.end_date = max(self.end_date, datetime.strptime(end_date, '%m-%d-%Y'))
+		self.store.set_range(self.start_date - timedelta(days=self.lookback_days), self.end_date)
+		self.run = False
+		self.backtest()
+
+	def next_date(self):
+		return self.start_date if self.last_date is None else self.last_date + timedelta(days=1)
+
+	'''
+	iter_days function is the backtest as a generator: it runs the sessions after the last one
+	run up to end_date and yields each day's values as soon as they are computed. values is
+	empty with valuation 'post'. Stopping early is fine, the next call picks up where it stopped
+	[optional] (datetime) end_date, the run's by default -> yields (datetime) date, (dict) algo name -> value
+	'''
+	def iter_days(self, end_date=None):
+		self.prepare_engines()
+		for date in self.calendar.between(self.next_date(), end_date or self.end_date):
+			yield date, self.run_day(date)
+		# tradability answers fetched during the run are saved once, here
+		self.use_data()
+		tradability.flush()
+
+	'''
+	prepare_engines function builds the WeightsEngine matrices over the run's sessions
+	'''
+	def prepare_engines(self):
+		engines = [algo.decision_engine for algo in self.algos if isinstance(algo.decision_engine, WeightsEngine) and algo.name not in self.precomputed]
+		if engines:
+			self.use_data()
+			sessions = self.calendar.between(self.start_date, self.end_date)
+			for engine in engines:
+				engine.prepare(self.store, sessions)
+
+	'''
+	checkpoint function saves everything needed to carry the run on later to a gzipped pickle:
+	the settings, algos (so engines keep any state of their own), portfolios with their ledgers,
+	dates, value series as arrays and the screener answers. Prices, calendar, insider feed and
+	tradability are not saved, hand them to resume again
+	(string) path -> None
+	'''
+	def checkpoint(self, path):
+		state = {
+			'start_date': self.start_date,
+			'end_date': self.end_date,
+			'last_date': self.last_date,
+			'starting_wallet': self.cash,
+			'lookback_days': self.lookback_days,
+			'valuation': self.valuation,
+			'algos': self.algos,
+			'portfolios': self.portfolios,
+			'dates': np.array([date.strftime('%Y-%m-%d') for date in self.dates], dtype='datetime64[D]'),
+			'portfolio_values': {name: np.array(values, dtype=np.float64) for name, values in self.portfolio_values.items()},
+			'screens': dict(openinsider_cache),
+			'execution': self.execution,
+			'run': self.run,
+		}
+		tmp = path + '.%d.tmp' % os.getpid()
+		with gzip.open(tmp, 'wb') as f:
+			pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp, path)
+
+	'''
+	resume function rebuilds a Backtester from a checkpoint file, ready for iter_days, extend or graph
+	(string) path, [optional] same data args as the constructor -> Backtester
+	'''
+	@classmethod
+	def resume(cls, path, store=None, calendar=None, processes=1, insider_feed=None, tradability=None, prefetch=True, history=True, intraday=None):
+		with gzip.open(path, 'rb') as f:
+			state = pickle.load(f)
+		bt = cls(state['start_date'].strftime('%m-%d-%Y'), state['end_date'].strftime('%m-%d-%Y'), state['algos'], state['starting_wallet'], store=store, calendar=calendar, lookback_days=state['lookback_days'], processes=processes, insider_feed=insider_feed, tradability=tradability, valuation=state['valuation'], prefetch=prefetch, history=history, intraday=intraday, execution=state.get('execution'))
+		bt.portfolios = state['portfolios']
+		bt.dates = [datetime.combine(day, datetime.min.time()) for day in state['dates'].tolist()]
+		bt.portfolio_values = {name: values.tolist() for name, values in state['portfolio_values'].items()}
+		bt.last_date = state['last_date']
+		bt.run = state['run']
+		openinsider_cache.update(state['screens'])
+		return bt
+
+	'''
+	prefetch_data function loads the prices of every ticker the algos can touch between start and
+	end before the first session: their own tickers, spy for the market indicators and every
+	ticker the cluster engines' screens return. Without an insider feed the screener pages are
+	downloaded concurrently first. The prices then go out as one batch through PriceStore.load,
+	and every day's candidates are checked for tradability as one batch too, so the engines'
+	checks during the run are all answered from memory. With universe engines the indicators'
+	stack of every ticker is built here too
+	(datetime) start, end -> None
+	'''
+	def prefetch_data(self, start, end):
+		self.use_data()
+		sessions = self.calendar.between(start, end)
+		tickers = ['spy']
+		engines = []
+		for algo in self.algos:
+			tickers += algo.tickers
+			if isinstance(algo.decision_engine, ClusterEngine):
+				engines.append(algo.decision_engine)
+		if self.insider_feed is None:
+			screens = prefetch_openinsider(engine.screen_url(date) for engine in engines for date in sessions)
+			for engine in engines:
+				for date in sessions:
+					tickers += list(screens.get(engine.screen_url(date), Screen([], [], [], [])).tickers[:engine.depth])
+		else:
+			for engine in engines:
+				for date in sessions:
+					tickers += list(engine.screen_table(date).tickers[:engine.depth])
+		self.store.load(tickers)
+		check_many_rh_valid(dict.fromkeys(tickers))
+		if any(isinstance(engine, UniverseEngine) for engine in engines):
+			# the universes read their features out of one stack of every ticker they can meet, built once here
+			with span('indicators.stack'):
+				self.indicators.stack(dict.fromkeys(ticker.lower() for ticker in tickers))
+
+	'''
+	value_portfolios function fills portfolio_values for the whole run in one pass per algo
+	'''
+	def value_portfolios(self):
+		self.use_data()
+		for algo in self.algos:
+			with span('valuation.post', algo.name):
+				self.portfolio_values[algo.name] = equity_curve(self.portfolios[algo.name], self.cash, self.dates, self.store).tolist()
+
+	'''
+	use_data function points the module level price store, calendar, indicators and insider feed at this backtest's
+	'''
+	def use_data(self):
+		global price_store, trading_calendar, indicators, insider_feed, tradability, intraday_store, execution
+		profiling.active = self.profiler
+		intraday_store = self.intraday
+		execution = self.execution
+		price_store = self.store
+		trading_calendar = self.calendar
+		indicators = self.indicators
+		insider_feed = self.insider_feed
+		if self.tradability is not None:
+			tradability = self.tradability
+
+	'''
+	run_day function runs every algo's engine on one session and logs the portfolio values
+	(datetime) date -> (dict) algo name -> value at close, empty with valuation 'post'
+	'''
+	def run_day(self, date):
+		self.use_data()
+		print(date.strftime("%m-%d-%Y"))
+		values = {}
+		valued = True
+		algos = [algo for algo in self.algos if algo.name not in self.precomputed]
+		try:
+			for algo in algos:
+				# run engine and update portfolio for this day
+				try:
+					token = trade_context.set((algo.name, date))
+					with span('engine', algo.name):
+						portfolio = algo.decision_engine(self.portfolios[algo.name], date)
+					if not isinstance(portfolio, Portfolio):
+						# engines written against plain dicts may hand back a new dict
+						portfolio = Portfolio.from_dict(portfolio, self.portfolios[algo.name])
+					self.portfolios[algo.name] = portfolio
+				except Exception as e:
+					print('THE DECISION ENGINE FAILED ', algo.name, e)
+				finally:
+					trade_context.reset(token)
+			# every algo's orders of the day fill together
+			if self.execution is not None:
+				with span('execution'):
+					self.execution.fill(date, self.portfolios, self.indicators, log=print_trade)
+			# value the portfolios, the post valuation does it once at the end
+			if self.valuation == 'daily':
+				for algo in algos:
+					with span('valuation', algo.name):
+						values[algo.name] = calculate_portfolio_value(self.portfolios[algo.name], date)
+		except Exception as e:
+			# a holding with no close at all on or before date, the day is left out of every curve
+			print('COULD NOT VALUE PORTFOLIOS ', date.strftime("%m-%d-%Y"), e)
+			values = {}
+			valued = False
+		if self.history and valued:
+			self.dates.append(date)
+			for name, value in values.items():
+				self.portfolio_values[name].append(value)
+		self.last_date = date
+		return values
+
+	'''
+	backtest_parallel function splits the algos round robin into self.processes groups,
+	backtests each group in a worker process and merges the portfolios and value series back.
+	The prefetched prices are written once to a memory-mapped file (PriceStore.share) that every
+	worker reads, instead of each worker getting its own pickled copy of the store
+	'''
+	def backtest_parallel(self):
+		algos = [algo for algo in self.algos if algo.name not in self.precomputed]
+		groups = [algos[i::self.processes] for i in range(self.processes)]
+		groups = [group for group in groups if group]
+		with tempfile.TemporaryDirectory(prefix='backtest') as directory:
+			with span('prefetch.share'):
+				store = self.store.share(os.path.join(directory, 'prices'))
+			tasks = [(self.start_date, self.end_date, group, self.cash, store, self.calendar, self.lookback_days, self.insider_feed, self.tradability, self.valuation, dict(openinsider_cache), self.profiler is not None, self.intraday, self.execution) for group in groups]
+			with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+				for dates, portfolios, portfolio_values, profiler in pool.map(run_algo_group, tasks):
+					if profiler is not None:
+						self.profiler.merge(profiler)
+					self.dates = dates
+					self.portfolios.update(portfolios)
+					self.portfolio_values.update(portfolio_values)
+		if self.dates:
+			self.last_date = self.dates[-1]
 		self.run = True
 		return
 
 	def graph(self):
 		if not self.run:
 			self.backtest()
+		# pyplot is only imported here so compute only runs never pay for it
+		import matplotlib.pyplot as plt
+		import matplotlib.style
 
-		# plot config
-		plt.style.use('seaborn-darkgrid') # style
-		palette = plt.get_cmap('Set1') # line colors
-		fig, ax = plt.subplots(constrained_layout=True)
-		locator = mdates.AutoDateLocator() # date formatter on axis
-		formatter = mdates.ConciseDateFormatter(locator)
-		ax.xaxis.set_major_locator(locator)
-		ax.xaxis.set_major_formatter(formatter)
-		plt.title("Backtester", loc='left', fontsize=14, fontweight=0, color='black')
-		plt.ylabel("Portfolio Value ($)")
-
-		# plot algos
-		for index, ticker in enumerate(self.portfolios):
-			ax.plot(self.dates, self.portfolio_values[ticker], marker='', color=palette(index), linewidth=2, alpha=0.9, label=ticker)
-		plt.legend(loc=2, ncol=2) # legend top left
+		with matplotlib.style.context(report.darkgrid_style()):
+			fig = plt.figure(layout='constrained')
+			report.plot_equity(fig, self.dates, self.portfolio_values)
 		plt.show()
 
 		return
 
+	'''
+	report function writes the finished run to out_dir, metrics and equity curves as csv or
+	parquet tables and charts rendered headless, see report.export
+	(string) out_dir, [optional] (tuple) formats like 'png', 'svg', (string) table 'csv' or 'parquet',
+	(int) per_chart algos per chart, (int) max_points per plotted curve -> (dict) paths written
+	'''
+	def report(self, out_dir, formats=('png',), table='csv', per_chart=report.ALGOS_PER_CHART, max_points=2000):
+		if not self.run:
+			raise ValueError('nothing to report, run backtest() first')
+		with span('report'):
+			return report.export(self.dates, self.portfolio_values, out_dir, formats, table, per_chart, max_points)
 
-if __name__ == '__main__':
-	# could make these dates and starting funds command line arguments
-	start = '1-15-2021'
-	end = '3-05-2021'
-	algos = [Algo('nop', noop_engine), Algo('spy', basic_stock_engine), Algo('cluster3', openinsider_cluster_stock_engine3), Algo('cluster5', openinsider_cluster_stock_engine5), Algo('cluster6', openinsider_cluster_stock_engine6), Algo('cluster10', openinsider_cluster_stock_engine10), Algo('cluster11', openinsider_cluster_stock_engine11), Algo('cluster12', openinsider_cluster_stock_engine12)]
-	starting_funds = 2000
-	glbl_date = None
-	glbl_algo = None
-	bt = Backtester(start, end, algos, starting_funds)
-	bt.graph()
 
+'''
+run_algo_group function is the worker side of Backtester.backtest_parallel, it backtests one
+group of algos in its own process and sends the results back
+(tuple) start_date, end_date, algos, starting_wallet, store, calendar, lookback_days, insider_feed, tradability, valuation,
+screener cache, profile, intraday, execution -> (tuple) dates, portfolios, portfolio_values, profiler
+'''
+def run_algo_group(task):
+	start_date, end_date, algos, starting_wallet, store, calendar, lookback_days, insider_feed, tradability, valuation, screens, profile, intraday, execution = task
+	# the parent already prefetched, the store maps its shared price file and the screener cache arrives filled
+	openinsider_cache.update(screens)
+	bt = Backtester(start_date.strftime('%m-%d-%Y'), end_date.strftime('%m-%d-%Y'), algos, starting_wallet, store=store, calendar=calendar, lookback_days=lookback_days, insider_feed=insider_feed, tradability=tradability, valuation=valuation, prefetch=False, profile=profile, intraday=intraday, execution=execution)
+	bt.backtest()
+	return bt.dates, bt.portfolios, bt.portfolio_values, bt.profiler
 
 
+if __name__ == '__main__':
+	# the command line lives in cli.py, python cli.py --help
+	import cli
+	cli.main()
 
 
 
@@ -0,0 +1,140 @@
+import os
+import sys
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+
+# ---------------------------
+# COMMAND LINE
+# ---------------------------
+
+# nothing heavy is imported up here, main() only imports what the chosen mode needs so --help
+# is instant and an offline run never loads the network stack
+
+DEFAULT_ALGOS = ['nop=noop_engine', 'spy=basic_stock_engine', 'cluster3=openinsider_cluster_stock_engine3', 'cluster5=openinsider_cluster_stock_engine5', 'cluster6=openinsider_cluster_stock_engine6', 'cluster10=openinsider_cluster_stock_engine10', 'cluster11=openinsider_cluster_stock_engine11', 'cluster12=openinsider_cluster_stock_engine12']
+
+# longest screen window of the cluster engines, the downloaded insider feed starts this far before start
+FEED_LOOKBACK_DAYS = 4
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description='Backtest decision engines over a date range')
+	parser.add_argument('--start', default='1-15-2021', help='first session, m-d-Y')
+	parser.add_argument('--end', default='3-05-2021', help='end of the run (exclusive), m-d-Y')
+	parser.add_argument('--algos', nargs='+', default=DEFAULT_ALGOS, metavar='[NAME=]ENGINE', help='engines by their name in bt.py, see --list')
+	parser.add_argument('--list', action='store_true', help='print the engine names and exit')
+	parser.add_argument('--funds', type=float, default=2000, help='starting cash of every algo')
+	parser.add_argument('--mode', default='live', choices=['live', 'offline'], help='live downloads what is missing, offline only reads local files and caches')
+	parser.add_argument('--prices', help='csv/parquet price file or directory of them (prices.FileSource) instead of yahoo')
+	parser.add_argument('--cache-dir', help='bar cache directory')
+	parser.add_argument('--feed', nargs='+', help='insider filings as one csv (InsiderFeed.save_csv) or saved screener pages')
+	parser.add_argument('--download-feed', action='store_true', help='live mode: download the insider filings of the run once instead of asking the openinsider screener each session')
+	parser.add_argument('--listing', help='symbol listing answering the tradability checks')
+	parser.add_argument('--lookback', type=int, default=30, help='days of price history loaded before start')
+	parser.add_argument('--processes', type=int, default=1)
+	parser.add_argument('--valuation', default='daily', choices=['daily', 'post'])
+	parser.add_argument('--profile', action='store_true', help='print the per phase profile at the end')
+	parser.add_argument('--quiet', action='store_true', help='no per trade output')
+	parser.add_argument('--report', metavar='DIR', help='write metrics, curves and charts to DIR')
+	parser.add_argument('--formats', nargs='*', default=['png'], help='chart formats for --report, none for tables only')
+	parser.add_argument('--table', default='csv', choices=['csv', 'parquet'], help='table format for --report')
+	parser.add_argument('--graph', action='store_true', help='show the equity curves in a window')
+	return parser.parse_args(argv)
+
+'''
+engines function returns every decision engine bt.py defines by name: the engine functions and
+the ClusterEngine (and UniverseEngine) instances
+(module) bt -> (dict) name -> engine
+'''
+def engines(bt):
+	found = {}
+	for name, value in vars(bt).items():
+		if isinstance(value, bt.ClusterEngine) or (callable(value) and name.endswith('_engine') and not name.startswith('make_')):
+			found[name] = value
+	return found
+
+'''
+make_algos function turns NAME=ENGINE (or just ENGINE) specs into Algos
+(module) bt, (list) specs -> (list) Algo
+'''
+def make_algos(bt, specs):
+	known = engines(bt)
+	algos = []
+	for spec in specs:
+		name, _, engine = spec.rpartition('=')
+		if engine not in known:
+			raise SystemExit('unknown engine %s, see --list' % engine)
+		algos.append(bt.Algo(name or engine, known[engine]))
+	return algos
+
+'''
+make_store function builds the PriceStore for the mode: local files when given, otherwise the
+bar cache in front of yahoo, never asking yahoo when offline
+'''
+def make_store(args):
+	from prices import PriceStore, FileSource, YahooSource
+	if args.prices:
+		return PriceStore(FileSource(args.prices))
+	from bar_cache import BarCache, DEFAULT_CACHE_DIR
+	return PriceStore(BarCache(YahooSource(), cache_dir=args.cache_dir or DEFAULT_CACHE_DIR, offline=args.mode == 'offline'))
+
+'''
+make_feed function loads the insider feed from --feed files, or downloads it in live mode when
+an algo screens and --download-feed asks for it. None leaves the screens to the live screener,
+the same default as Backtester
+'''
+def make_feed(args, start, end, screens):
+	from insider import InsiderFeed
+	if args.feed:
+		if len(args.feed) == 1 and args.feed[0].endswith('.csv'):
+			return InsiderFeed.from_csv(args.feed[0])
+		return InsiderFeed.from_html(args.feed)
+	if not screens:
+		return None
+	if args.mode == 'offline':
+		raise SystemExit('offline runs of screening engines need insider filings, pass --feed')
+	if not args.download_feed:
+		return None
+	# one download of every insider purchase in the window (plus the longest screen lookback)
+	return InsiderFeed.download(start - timedelta(days=FEED_LOOKBACK_DAYS), end)
+
+def make_tradability(args):
+	from tradability import TradabilityService
+	if args.listing:
+		return TradabilityService(listing=args.listing)
+	if args.mode == 'offline':
+		return TradabilityService(offline=True)
+	return TradabilityService()
+
+def print_summary(backtester):
+	from metrics import summarize
+	print('%-30s %12s %9s %9s %8s' % ('algo', 'final value', 'cagr', 'drawdown', 'sharpe'))
+	for name, values in backtester.portfolio_values.items():
+		metrics = summarize(backtester.dates, values)
+		print('%-30s %12.2f %8.1f%% %8.1f%% %8.2f' % (name, metrics['final_value'], 100 * metrics['cagr'], 100 * metrics['max_drawdown'], metrics['sharpe']))
+
+def main(argv=None):
+	args = parse_args(argv)
+	import bt
+	if args.list:
+		for name, engine in engines(bt).items():
+			print('%-40s %s' % (name, repr(engine) if isinstance(engine, bt.ClusterEngine) else ''))
+		return 0
+	start = datetime.strptime(args.start, '%m-%d-%Y')
+	end = datetime.strptime(args.end, '%m-%d-%Y')
+	algos = make_algos(bt, args.algos)
+	feed = make_feed(args, start, end, any(isinstance(algo.decision_engine, bt.ClusterEngine) for algo in algos))
+	backtester = bt.Backtester(args.start, args.end, algos, args.funds, store=make_store(args), lookback_days=args.lookback, processes=args.processes, insider_feed=feed, tradability=make_tradability(args), valuation=args.valuation, profile=args.profile)
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+		backtester.backtest()
+	print_summary(backtester)
+	if args.profile:
+		print(backtester.profiler.table())
+	if args.report:
+		for kind, paths in backtester.report(args.report, formats=tuple(args.formats), table=args.table).items():
+			print(kind, paths)
+	if args.graph:
+		backtester.graph()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,315 @@
+import numpy as np
+from portfolio import BUY
+
+# ---------------------------
+# ORDER EXECUTION
+# ---------------------------
+
+# every model below works on arrays, one entry per order of the session: side is +1 for a buy
+# and -1 for a sell, price the price the engine asked for (the open, the close, a stop level)
+# and volume the ticker's average daily volume before the session (nan when unknown)
+
+# ---------------------------
+# slippage models, (np.array) side, shares, price, volume -> (np.array) fill price
+# ---------------------------
+
+class NoSlippage:
+	def __call__(self, side, shares, price, volume):
+		return price
+
+	def __repr__(self):
+		return 'NoSlippage()'
+
+'''
+FixedSlippage class. Buys fill bps basis points over the asked price, sells that much under it
+'''
+class FixedSlippage:
+	def __init__(self, bps=5):
+		self.bps = bps
+
+	def __call__(self, side, shares, price, volume):
+		return price * (1 + side * self.bps / 10000)
+
+	def __repr__(self):
+		return 'FixedSlippage(%s)' % self.bps
+
+'''
+VolumeSlippage class. Half the spread plus a square root market impact, the usual rule of thumb
+that impact grows with the square root of the order's share of the day's volume:
+	fill = price * (1 + side * (spread_bps / 2 / 10000 + impact * sqrt(shares / volume)))
+Orders on tickers with unknown volume only pay the spread
+'''
+class VolumeSlippage:
+	def __init__(self, spread_bps=5, impact=0.1):
+		self.spread_bps = spread_bps
+		self.impact = impact
+
+	def __call__(self, side, shares, price, volume):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			participation = np.where(volume > 0, shares / volume, 0.0)
+		return price * (1 + side * (self.spread_bps / 20000 + self.impact * np.sqrt(participation)))
+
+	def __repr__(self):
+		return 'VolumeSlippage(%s, %s)' % (self.spread_bps, self.impact)
+
+# ---------------------------
+# commission models, (np.array) shares, price -> (np.array) fee in $
+# ---------------------------
+
+class NoCommission:
+	def __call__(self, shares, price):
+		return np.zeros(len(shares))
+
+	def __repr__(self):
+		return 'NoCommission()'
+
+'''
+PerShareCommission class. rate $ per share, at least minimum $ and at most maximum of the
+order's value per order, like most per share broker plans
+'''
+class PerShareCommission:
+	def __init__(self, rate=0.005, minimum=1.0, maximum=0.01):
+		self.rate = rate
+		self.minimum = minimum
+		self.maximum = maximum
+
+	def __call__(self, shares, price):
+		return np.minimum(np.maximum(self.rate * shares, self.minimum), self.maximum * shares * price)
+
+	def __repr__(self):
+		return 'PerShareCommission(%s, %s, %s)' % (self.rate, self.minimum, self.maximum)
+
+'''
+PercentCommission class. rate of the order's value, at least minimum $ per order
+'''
+class PercentCommission:
+	def __init__(self, rate=0.001, minimum=0.0):
+		self.rate = rate
+		self.minimum = minimum
+
+	def __call__(self, shares, price):
+		return np.maximum(self.rate * shares * price, self.minimum)
+
+	def __repr__(self):
+		return 'PercentCommission(%s, %s)' % (self.rate, self.minimum)
+
+# ---------------------------
+# fill models, (np.array) shares, volume -> (np.array) shares filled
+# ---------------------------
+
+class FullFill:
+	def __call__(self, shares, volume):
+		return shares
+
+	def __repr__(self):
+		return 'FullFill()'
+
+'''
+VolumeFill class. An order fills up to participation of the average daily volume, the rest is
+cancelled at the end of the session. Whole share orders fill whole shares, unknown volume fills
+in full
+'''
+class VolumeFill:
+	def __init__(self, participation=0.1):
+		self.participation = participation
+
+	def __call__(self, shares, volume):
+		cap = np.where(np.isfinite(volume), self.participation * np.nan_to_num(volume), np.inf)
+		cap = np.where(shares == np.floor(shares), np.floor(cap), cap)
+		return np.minimum(shares, cap)
+
+	def __repr__(self):
+		return 'VolumeFill(%s)' % self.participation
+
+'''
+OrderBook class. The orders of one session in columns, appended as the engines place them
+and emptied by the fill step. cash holds each algo's cash before its first order of the day
+'''
+class OrderBook:
+	def __init__(self):
+		self.clear()
+
+	def clear(self):
+		self.algos = []
+		self.sides = []
+		self.tickers = []
+		self.shares = []
+		self.prices = []
+		self.purchase_prices = []
+		self.cash = {}
+
+	def __len__(self):
+		return len(self.algos)
+
+	def add(self, algo, cash, side, ticker, shares, price, purchase_price):
+		self.cash.setdefault(algo, cash)
+		self.algos.append(algo)
+		self.sides.append(side)
+		self.tickers.append(ticker)
+		self.shares.append(shares)
+		self.prices.append(price)
+		self.purchase_prices.append(purchase_price)
+
+'''
+step_down function scales orders down to what a budget pays for. A per order minimum fee makes
+cost not proportional to shares, so one scaling may not fit: whole share orders always lose at
+least a share and fractional ones a hair more than the scale, and the callers repeat until it fits
+(np.array or float) shares, scale, whole -> (np.array) shares
+'''
+def step_down(shares, scale, whole):
+	return np.where(whole, np.minimum(np.floor(shares * scale), shares - 1), shares * scale * (1 - 1e-9))
+
+'''
+ExecutionModel class. Turns the orders the engines place into fills. buy, sell and sell_all
+still update the portfolio right away at the asked price, so an engine sees its cash and
+positions move as before, but the order also waits in the session's OrderBook. Once every
+algo has run, fill settles the whole book in one vectorized step: fill sizes from the fill
+model, fill prices from the slippage model and fees from the commission model over the arrays
+of all orders, then each portfolio gets back what did not fill, has its cost basis moved to
+the fill prices and its cash replayed from the fills in the ledger (so valuation 'post' gives
+the same curve to the bit). The engines sized their buys from sell proceeds at the asked price,
+before slippage, fees and partial fills, so when an algo's fills would leave its cash below 0
+its buys are trimmed pro rata until they fit (see within_cash).
+	slippage		NoSlippage(), FixedSlippage(bps) or VolumeSlippage(spread_bps, impact)
+	commission		NoCommission(), PerShareCommission(rate, minimum, maximum) or PercentCommission(rate, minimum)
+	fill			FullFill() or VolumeFill(participation)
+	volume_window	sessions averaged for the volume the models see, as known at the open
+'''
+class ExecutionModel:
+	def __init__(self, slippage=None, commission=None, fill=None, volume_window=20):
+		self.slippage = slippage if slippage is not None else NoSlippage()
+		self.commission = commission if commission is not None else NoCommission()
+		self.fill_model = fill if fill is not None else FullFill()
+		self.volume_window = volume_window
+		self.book = OrderBook()
+
+	def volume(self, indicators, ticker, date):
+		return indicators.value(ticker, 'sma_volume', date, self.volume_window)
+
+	'''
+	cost function returns what buying shares would cost in cash with slippage and commission
+	'''
+	def cost(self, shares, price, volume):
+		fill = float(self.slippage(np.ones(1), np.array([shares], dtype=np.float64), np.array([price], dtype=np.float64), np.array([volume]))[0])
+		return shares * fill + float(self.commission(np.array([shares], dtype=np.float64), np.array([fill]))[0])
+
+	'''
+	affordable function trims a buy to what cash pays for once slippage and commission are
+	added, whole share orders stay whole
+	(string) ticker, (float) shares, price, cash, (datetime) date, (Indicators) indicators -> (float) shares
+	'''
+	def affordable(self, ticker, shares, price, cash, date, indicators):
+		volume = self.volume(indicators, ticker, date)
+		whole = float(shares).is_integer()
+		for _ in range(32):
+			if shares <= 0:
+				return 0.0
+			cost = self.cost(shares, price, volume)
+			if cost <= cash:
+				return shares
+			shares = step_down(shares, cash / cost, whole).item()
+		return 0.0
+
+	def submit(self, algo, cash, side, ticker, shares, price, purchase_price):
+		self.book.add(algo, cash, side, ticker, shares, price, purchase_price)
+
+	'''
+	within_cash function trims one algo's buy fills pro rata (whole share orders to whole shares)
+	until the session's flows leave cash at or above 0, recomputing fill prices and fees for
+	the smaller orders each time. Sells are not trimmed, but once no buy is left a sell whose
+	fee is more than it brings in (a minimum fee on a few dollars) is cancelled and stays held
+	(float) cash the algo started the session with, (np.array) sides, filled, prices, volume,
+	fills, fees of its orders -> (np.array) filled, fills, fees
+	'''
+	def within_cash(self, cash, sides, filled, prices, volume, fills, fees):
+		buys = (sides == BUY) & (filled > 0)
+		whole = filled == np.floor(filled)
+		for _ in range(32):
+			flows = -sides * filled * fills - fees
+			left = float(np.add.accumulate(np.concatenate([[cash], flows]))[-1])
+			if left >= 0:
+				break
+			if not buys.any():
+				losing = (sides != BUY) & (filled > 0) & (flows < 0)
+				filled = np.where(losing, 0.0, filled)
+				fees = np.where(losing, 0.0, fees)
+				break
+			spent = float(-flows[buys].sum())
+			scale = max(0.0, (spent + left) / spent)
+			filled = np.where(buys, np.maximum(step_down(filled, scale, whole), 0), filled)
+			buys = buys & (filled > 0)
+			fills = self.slippage(sides, filled, prices, volume)
+			fees = np.where(filled > 0, self.commission(filled, fills), 0.0)
+		return filled, fills, fees
+
+	'''
+	fill function settles the session's book, see the class. Each fill is handed to log, the
+	same trade printer the engines' orders go through when there is no execution model
+	(datetime) date, (dict) algo name -> Portfolio, (Indicators) indicators, [optional] (function)
+	log of algo, date, side, ticker, shares, price, fee -> None
+	'''
+	def fill(self, date, portfolios, indicators, log=None):
+		book = self.book
+		if len(book) == 0:
+			return
+		algos = np.array(book.algos, dtype=object)
+		sides = np.array(book.sides, dtype=np.float64)
+		asked = np.array(book.shares, dtype=np.float64)
+		prices = np.array(book.prices, dtype=np.float64)
+		volumes = {ticker: self.volume(indicators, ticker, date) for ticker in set(book.tickers)}
+		volume = np.array([volumes[ticker] for ticker in book.tickers])
+		filled = np.clip(self.fill_model(asked, volume), 0, asked)
+		fills = self.slippage(sides, filled, prices, volume)
+		fees = np.where(filled > 0, self.commission(filled, fills), 0.0)
+		for algo in book.cash:
+			portfolio = portfolios[algo]
+			rows = np.flatnonzero(algos == algo)
+			filled[rows], fills[rows], fees[rows] = self.within_cash(book.cash[algo], sides[rows], filled[rows], prices[rows], volume[rows], fills[rows], fees[rows])
+			for i in rows:
+				settle(portfolio, book.tickers[i], book.sides[i], asked[i], prices[i], float(filled[i]), float(fills[i]), book.purchase_prices[i])
+				if filled[i] > 0:
+					if log is not None:
+						log(algo, date, 'Buy' if book.sides[i] == BUY else 'Sell', book.tickers[i], float(filled[i]), float(fills[i]), float(fees[i]))
+					portfolio.record(date, book.tickers[i], book.sides[i], float(filled[i]), float(fills[i]), float(fees[i]))
+			done = rows[filled[rows] > 0]
+			# the same flows, in the same order, as valuation.equity_curve sums from the ledger
+			flows = -sides[done] * filled[done] * fills[done] - fees[done]
+			portfolio['cash'] = float(np.add.accumulate(np.concatenate([[book.cash[algo]], flows]))[-1])
+		book.clear()
+
+	def __getstate__(self):
+		# settings only, a book is never carried from one session to the next
+		state = dict(self.__dict__)
+		state['book'] = OrderBook()
+		return state
+
+	def __repr__(self):
+		return 'ExecutionModel(%r, %r, %r, volume_window=%d)' % (self.slippage, self.commission, self.fill_model, self.volume_window)
+
+'''
+settle function moves one order's position from what the engine was given (asked shares at
+the asked price) to what filled: unfilled buy shares come off the position, unfilled sell
+shares go back on at the cost they were held at, and filled buys carry their fill price in
+the cost basis
+(Portfolio) portfolio, (string) ticker, (int) side, (float) asked shares, asked price, filled shares, fill price,
+purchase price the sold shares were held at -> None
+'''
+def settle(portfolio, ticker, side, asked, price, filled, fill, purchase_price):
+	unfilled = asked - filled
+	if side == BUY:
+		if ticker not in portfolio or (unfilled == 0 and fill == price):
+			return
+		held = portfolio[ticker]['shares']
+		basis = portfolio[ticker]['purchase_price'] * held - price * asked + fill * filled
+		if held - unfilled <= 0:
+			del portfolio[ticker]
+		else:
+			portfolio[ticker] = {'shares': held - unfilled, 'purchase_price': basis / (held - unfilled)}
+		return
+	if unfilled <= 0:
+		return
+	if ticker in portfolio:
+		held = portfolio[ticker]['shares']
+		portfolio[ticker] = {'shares': held + unfilled, 'purchase_price': (portfolio[ticker]['purchase_price'] * held + purchase_price * unfilled) / (held + unfilled)}
+	else:
+		portfolio[ticker] = {'shares': unfilled, 'purchase_price': purchase_price}
@@ -0,0 +1,135 @@
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from profiling import count
+
+# ---------------------------
+# CONCURRENT FETCHING
+# ---------------------------
+
+# answers worth asking again, everything else >= 400 fails right away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class FetchError(Exception):
+	def __init__(self, url, status):
+		super().__init__('HTTP %d for %s' % (status, url))
+		self.url = url
+		self.status = status
+
+'''
+RateLimiter class. Spaces request starts at least 1 / rate seconds apart across every
+coroutine sharing it, rate None means no limit
+'''
+class RateLimiter:
+	def __init__(self, rate=None):
+		self.interval = 1.0 / rate if rate else 0.0
+		self.next_slot = 0.0
+
+	async def wait(self):
+		if not self.interval:
+			return
+		now = time.monotonic()
+		# claim the next free slot before sleeping so concurrent waiters queue up behind it
+		slot = max(now, self.next_slot)
+		self.next_slot = slot + self.interval
+		if slot > now:
+			await asyncio.sleep(slot - now)
+
+'''
+AsyncFetcher class. Downloads a batch of urls concurrently so a universe wide prefetch takes
+about as long as its slowest request instead of the sum of all of them:
+	concurrency		requests in flight at once, also the size of the connection pool
+	rate			most request starts per second, None for no limit
+	retries			extra attempts after a network error or a RETRY_STATUSES answer, waiting
+					backoff * 2**attempt seconds (or the server's Retry-After) in between
+Uses aiohttp when it is installed, otherwise a pooled requests.Session on a thread pool.
+fetch_all never raises for a single url, a url that keeps failing comes back as its exception
+'''
+class AsyncFetcher:
+	def __init__(self, concurrency=16, rate=None, retries=3, backoff=0.5, timeout=30, headers=None):
+		self.concurrency = concurrency
+		self.rate = rate
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.headers = headers or {}
+
+	'''
+	fetch_all function downloads every url
+	(list) urls -> (list) response bodies as bytes, or the exception, in url order
+	'''
+	def fetch_all(self, urls):
+		urls = list(urls)
+		if not urls:
+			return []
+		return asyncio.run(self.gather(urls))
+
+	async def gather(self, urls):
+		semaphore = asyncio.Semaphore(self.concurrency)
+		limiter = RateLimiter(self.rate)
+		try:
+			import aiohttp
+		except ImportError:
+			aiohttp = None
+		if aiohttp is not None:
+			connector = aiohttp.TCPConnector(limit=self.concurrency)
+			timeout = aiohttp.ClientTimeout(total=self.timeout)
+			async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+				async def request(url):
+					async with session.get(url) as response:
+						return response.status, await response.read(), response.headers.get('Retry-After')
+				return await asyncio.gather(*[self.get(request, url, semaphore, limiter) for url in urls])
+
+		import requests
+		session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+		session.mount('http://', adapter)
+		session.mount('https://', adapter)
+		session.headers.update(self.headers)
+		executor = ThreadPoolExecutor(max_workers=self.concurrency)
+		loop = asyncio.get_running_loop()
+		async def request(url):
+			response = await loop.run_in_executor(executor, lambda: session.get(url, timeout=self.timeout))
+			return response.status_code, response.content, response.headers.get('Retry-After')
+		try:
+			return await asyncio.gather(*[self.get(request, url, semaphore, limiter) for url in urls])
+		finally:
+			executor.shutdown(wait=False)
+			session.close()
+
+	'''
+	get function is one url with its retries, the semaphore is only held while a request is in
+	flight so a url sleeping off a backoff doesn't block the others
+	'''
+	async def get(self, request, url, semaphore, limiter):
+		error = None
+		for attempt in range(self.retries + 1):
+			retry_after = None
+			async with semaphore:
+				await limiter.wait()
+				count('http.requests')
+				try:
+					status, body, retry_after = await request(url)
+				except Exception as e:
+					error = e
+				else:
+					if status < 400:
+						count('http.bytes', len(body))
+						return body
+					error = FetchError(url, status)
+					if status not in RETRY_STATUSES:
+						count('http.errors')
+						return error
+			if attempt < self.retries:
+				count('http.retries')
+				await asyncio.sleep(self.delay(attempt, retry_after))
+		count('http.errors')
+		return error
+
+	def delay(self, attempt, retry_after=None):
+		try:
+			return float(retry_after)
+		except (TypeError, ValueError):
+			# jitter keeps a batch that failed together from retrying in lockstep
+			return self.backoff * 2 ** attempt * (1 + random.random() / 2)
@@ -0,0 +1,258 @@
+import math
+import numpy as np
+from prices import FIELDS, to_day
+
+# ---------------------------
+# ROLLING INDICATORS
+# ---------------------------
+
+'''
+Every function here takes whole-history numpy arrays of one ticker and returns an
+array of the same length, where row i only uses data up to and including row i.
+Rows without enough history are nan. They also take (rows x tickers) matrices with one
+ticker's history down each column from row 0 and nan below its last row (see Stack), and
+work down every column at once to the same numbers as one column at a time.
+'''
+
+'''
+rolling_mean function returns the trailing n row mean, one cumsum for the whole array
+(np.array) values, (int) n -> (np.array) means
+'''
+def rolling_mean(values, n):
+	out = np.full(values.shape, np.nan)
+	if len(values) < n:
+		return out
+	sums = np.cumsum(np.concatenate([np.zeros((1,) + values.shape[1:]), values]), axis=0)
+	out[n - 1:] = (sums[n:] - sums[:-n]) / n
+	return out
+
+'''
+smooth function is an exponential moving average with smoothing factor alpha, seeded
+with the mean of the first n rows. The recursion is unrolled in blocks short enough
+that the decay powers stay inside float range, so there is no per-row python loop.
+(np.array) values, (float) alpha, (int) n -> (np.array) averages
+'''
+def smooth(values, alpha, n):
+	out = np.full(values.shape, np.nan)
+	if len(values) < n:
+		return out
+	decay = 1.0 - alpha
+	if decay <= 0:
+		out[n - 1:] = values[n - 1:]
+		return out
+	# a column at a time, a mean down a matrix adds in another order than the mean of one column
+	prev = values[:n].mean() if values.ndim == 1 else np.array([column.mean() for column in values[:n].T])
+	out[n - 1] = prev
+	block = max(1, int(30 / -math.log10(decay)))
+	i = n
+	while i < len(values):
+		chunk = values[i:i + block]
+		powers = decay ** np.arange(1, len(chunk) + 1).reshape((-1,) + (1,) * (values.ndim - 1))
+		# ema[j] = decay^(j+1) * prev + alpha * sum_k decay^(j-k) * x[k]
+		out[i:i + len(chunk)] = powers * prev + alpha * powers * np.cumsum(chunk / powers, axis=0)
+		prev = out[i + len(chunk) - 1]
+		i += len(chunk)
+	return out
+
+def ema(values, n):
+	return smooth(values, 2.0 / (n + 1), n)
+
+'''
+rsi function returns the n day relative strength index with wilder smoothing
+(np.array) closes, (int) n -> (np.array) rsi 0-100
+'''
+def rsi(closes, n=14):
+	out = np.full(closes.shape, np.nan)
+	if len(closes) <= n:
+		return out
+	change = np.diff(closes, axis=0)
+	gain = smooth(np.maximum(change, 0), 1.0 / n, n)
+	loss = smooth(np.maximum(-change, 0), 1.0 / n, n)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out[1:] = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+	return out
+
+'''
+atr function returns the n day average true range with wilder smoothing
+(np.array) highs, lows, closes, (int) n -> (np.array) atr
+'''
+def atr(highs, lows, closes, n=14):
+	prev_close = np.concatenate([closes[:1], closes[:-1]]) if len(closes) else closes
+	true_range = np.maximum(highs, prev_close) - np.minimum(lows, prev_close)
+	return smooth(true_range, 1.0 / n, n)
+
+'''
+relative_volume function returns each day's volume over the mean volume of the n days before it
+(np.array) volumes, (int) n -> (np.array) ratios
+'''
+def relative_volume(volumes, n=20):
+	out = np.full(volumes.shape, np.nan)
+	means = rolling_mean(volumes, n)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		out[1:] = volumes[1:] / means[:-1]
+	return out
+
+'''
+name -> function of (Bars or Stack, *params) returning the whole-history series
+'''
+INDICATORS = {
+	'close': lambda bars: bars.columns['close'],
+	'sma': lambda bars, n: rolling_mean(bars.columns['close'], n),
+	'sma_volume': lambda bars, n: rolling_mean(bars.columns['volume'], n),
+	'ema': lambda bars, n: ema(bars.columns['close'], n),
+	'rsi': lambda bars, n=14: rsi(bars.columns['close'], n),
+	'atr': lambda bars, n=14: atr(bars.columns['high'], bars.columns['low'], bars.columns['close'], n),
+	'relative_volume': lambda bars, n=20: relative_volume(bars.columns['volume'], n),
+}
+
+'''
+Indicators class. Initialized with a PriceStore. Computes each (ticker, indicator, params)
+series once over the whole stored range and memoizes it, so decision engines read a
+precomputed value by date instead of re-summing a window every day.
+'''
+class Indicators:
+	def __init__(self, store):
+		self.store = store
+		self.memo = {}
+		self.stacked = None
+		self.stacked_memo = {}
+
+	'''
+	series function returns the Bars and whole-history series of an indicator
+	(string) ticker, (string) name, [optional] params, [optional] (datetime) date the range must cover
+	'''
+	def series(self, ticker, name, *params, date=None):
+		bars = self.store.get(ticker, date)
+		key = (ticker.lower(), name, params)
+		cached = self.memo.get(key)
+		# the store hands back new Bars when its range grows, recompute then
+		if cached is None or cached[0] is not bars:
+			cached = (bars, INDICATORS[name](bars, *params))
+			self.memo[key] = cached
+		return cached
+
+	'''
+	value function returns an indicator as known at the open of date, i.e. its value on
+	the last session before date. nan when there is not enough history
+	(string) ticker, (string) name, (datetime) date, [optional] params -> (float) value
+	'''
+	def value(self, ticker, name, date, *params):
+		bars, values = self.series(ticker, name, *params, date=date)
+		row = int(np.searchsorted(bars.dates, to_day(date), side='left')) - 1
+		if row < 0:
+			return float('nan')
+		return float(values[row])
+
+	'''
+	stack function returns the Stack every stacked indicator is computed over, grown to cover
+	tickers (and date) first. It holds every ticker asked for so far and is only rebuilt when a
+	new ticker comes in or the store hands back new Bars, so once a run's tickers are loaded
+	(Backtester.prefetch_data asks for all of them) every day reads the same matrices
+	(list) tickers, [optional] (datetime) date the range must cover -> Stack
+	'''
+	def stack(self, tickers, date=None):
+		bars = {ticker.lower(): self.store.get(ticker, date) for ticker in tickers}
+		stack = self.stacked
+		if stack is None or any(stack.bars.get(ticker) is not value for ticker, value in bars.items()):
+			merged = dict(stack.bars) if stack is not None else {}
+			# tickers whose Bars changed are taken fresh from the store too
+			merged = {ticker: self.store.get(ticker, date) for ticker in merged}
+			merged.update(bars)
+			self.stacked = stack = Stack(merged)
+			self.stacked_memo = {}
+		return stack
+
+	'''
+	stacked_series function returns the whole-history series of an indicator for every column of
+	the current stack, the same numbers series gives one ticker at a time
+	(string) name, [optional] params -> (np.array) rows x tickers
+	'''
+	def stacked_series(self, name, *params):
+		key = (name, params)
+		if key not in self.stacked_memo:
+			self.stacked_memo[key] = INDICATORS[name](self.stacked, *params)
+		return self.stacked_memo[key]
+
+	'''
+	values function is value for many tickers at once: each ticker's indicator on its last
+	session before date, read out of the stacked matrices with one fancy index
+	(list) tickers, (string) name, (datetime) date, [optional] params -> (np.array) values, nan where unknown
+	'''
+	def values(self, tickers, name, date, *params):
+		stack = self.stack(tickers, date)
+		columns = stack.columns_of(tickers)
+		rows = stack.rows_before(columns, date)
+		series = self.stacked_series(name, *params)
+		return np.where(rows >= 0, series[np.maximum(rows, 0), columns], np.nan)
+
+'''
+Stack class. Many tickers' Bars side by side: one (rows x tickers) matrix per field with each
+ticker's bars down its column from row 0, nan below its last bar (NaT in dates), so the
+indicator functions run down every column at once
+(dict) ticker -> Bars
+'''
+class Stack:
+	def __init__(self, bars):
+		self.bars = bars
+		self.tickers = list(bars)
+		self.index = {ticker: column for column, ticker in enumerate(self.tickers)}
+		self.lengths = np.array([len(value) for value in bars.values()], dtype=np.int64)
+		# at least one row, all nan, so indexing a stack of tickers without bars still works
+		rows = max(1, int(self.lengths.max()) if len(self.lengths) else 0)
+		self.dates = np.full((rows, len(self.tickers)), np.datetime64('NaT'), dtype='datetime64[D]')
+		self.columns = {field: np.full((rows, len(self.tickers)), np.nan) for field in FIELDS}
+		for column, value in enumerate(bars.values()):
+			self.dates[:len(value), column] = value.dates
+			for field in FIELDS:
+				self.columns[field][:len(value), column] = value.columns[field]
+
+	def columns_of(self, tickers):
+		return np.array([self.index[ticker.lower()] for ticker in tickers], dtype=np.int64)
+
+	'''
+	rows_before function returns the row of each column's last bar strictly before date, -1 when none
+	(np.array) columns, (datetime) date -> (np.array) rows
+	'''
+	def rows_before(self, columns, date):
+		return (self.dates[:, columns] < to_day(date)).sum(axis=0) - 1
+
+# ---------------------------
+# SCREENS
+# ---------------------------
+
+'''
+finviz style screens from the notes at the bottom of bt.py, all as of the open of date
+(Indicators) indicators, (string) ticker, (datetime) date -> (bool)
+'''
+def price_above_sma(indicators, ticker, date, n):
+	return indicators.value(ticker, 'close', date) > indicators.value(ticker, 'sma', date, n)
+
+def price_below_sma(indicators, ticker, date, n):
+	return indicators.value(ticker, 'close', date) < indicators.value(ticker, 'sma', date, n)
+
+def rsi_oversold(indicators, ticker, date, level=40, n=14):
+	return indicators.value(ticker, 'rsi', date, n) < level
+
+def relative_volume_over(indicators, ticker, date, ratio=3, n=20):
+	return indicators.value(ticker, 'relative_volume', date, n) > ratio
+
+def atr_over(indicators, ticker, date, level=0.25, n=14):
+	return indicators.value(ticker, 'atr', date, n) > level
+
+'''
+trending up: price above the 20, 50 and 200 day SMA
+'''
+def trending_up(indicators, ticker, date):
+	return all(price_above_sma(indicators, ticker, date, n) for n in (20, 50, 200))
+
+'''
+reversing up: price above the 20 day SMA but still below the 50 and 200 day SMA
+'''
+def reversing_up(indicators, ticker, date):
+	return price_above_sma(indicators, ticker, date, 20) and price_below_sma(indicators, ticker, date, 50) and price_below_sma(indicators, ticker, date, 200)
+
+'''
+breakout: RSI oversold and relative volume over 3
+'''
+def breakout(indicators, ticker, date):
+	return rsi_oversold(indicators, ticker, date) and relative_volume_over(indicators, ticker, date, 3)
@@ -0,0 +1,250 @@
+import csv
+import numpy as np
+from collections import namedtuple
+from html.parser import HTMLParser
+
+# ---------------------------
+# OPENINSIDER FEED
+# ---------------------------
+
+'''
+openinsider_url function builds the openinsider screener url for insider purchases traded
+between date1 and date2. Setting min_insiders switches to the cluster buy grouping
+(datetime) date1, date2, [optional] (float) min_price, max_price, min_value in $k, (int) min_insiders,
+(int) count rows per page, page -> (string) url
+'''
+def openinsider_url(date1, date2, min_price=None, max_price=None, min_value=None, min_insiders=None, count=100, page=1):
+	def param(value):
+		return '' if value is None else ('%g' % value)
+	date1 = date1.strftime("%m-%d-%Y").replace('-', '%2F')
+	date2 = date2.strftime("%m-%d-%Y").replace('-', '%2F')
+	grp = '0' if min_insiders is None else '2'
+	nol = '' if min_insiders is None else '0'
+	return "http://openinsider.com/screener?s=&o=&pl=" + param(min_price) + "&ph=" + param(max_price) + "&ll=&lh=&fd=0&fdr=&td=-1&tdr=" + date1 + "+-+" + date2 + "&fdlyl=&fdlyh=&daysago=&xp=1&vl=" + param(min_value) + "&vh=&ocl=&och=&sic1=-1&sicl=100&sich=9999&isofficer=1&iscob=1&isceo=1&ispres=1&iscoo=1&iscfo=1&isgc=1&isvp=1&grp=" + grp + "&nfl=&nfh=&nil=" + param(min_insiders) + "&nih=&nol=" + nol + "&noh=&v2l=&v2h=&oc2l=&oc2h=&sortcol=8&cnt=" + str(count) + "&page=" + str(page)
+
+'''
+one insider purchase. insiders is 1 for a single filing, or the insider count of a cluster row
+'''
+Filing = namedtuple('Filing', ['ticker', 'filing_date', 'trade_date', 'price', 'insiders', 'value', 'insider'])
+
+'''
+a ranked screen result, best first and one row per ticker: the tickers plus the price,
+value and insider count of each row as arrays
+'''
+Screen = namedtuple('Screen', ['tickers', 'prices', 'values', 'insiders'])
+
+'''
+rank_rows function builds a Screen from rows already in rank order, a ticker showing up
+several times keeps its best (first) row
+(np.array) tickers, prices, values, insiders -> Screen
+'''
+def rank_rows(tickers, prices, values, insiders):
+	if len(tickers) == 0:
+		return Screen(np.array([], dtype=object), np.array([]), np.array([]), np.array([], dtype=np.int64))
+	first = np.sort(np.unique(tickers.astype(str), return_index=True)[1])
+	return Screen(tickers[first], prices[first], values[first], insiders[first])
+
+'''
+page_screen function is the Screen of one screener page, in the page's order
+(list) header, (list) rows from parse_table -> Screen
+'''
+def page_screen(header, rows):
+	filings = rows_to_filings(header, rows)
+	return rank_rows(np.array([filing.ticker for filing in filings], dtype=object), np.array([filing.price for filing in filings], dtype=np.float64), np.array([filing.value for filing in filings], dtype=np.float64), np.array([filing.insiders for filing in filings], dtype=np.int64))
+
+'''
+TableParser class. Streams the screener page through the stdlib tokenizer and keeps only the
+cells of the results table (class tinytable), no tree is built for the rest of the page
+'''
+class TableParser(HTMLParser):
+	def __init__(self):
+		super().__init__()
+		self.depth = 0
+		self.rows = []
+		self.cell = None
+
+	def handle_starttag(self, tag, attrs):
+		if tag == 'table':
+			if self.depth or 'tinytable' in (dict(attrs).get('class') or ''):
+				self.depth += 1
+		elif self.depth and tag == 'tr':
+			self.rows.append([])
+		elif self.depth and tag in ('td', 'th'):
+			self.cell = []
+
+	def handle_endtag(self, tag):
+		if tag == 'table' and self.depth:
+			self.depth -= 1
+		elif self.depth and tag in ('td', 'th') and self.cell is not None:
+			self.rows[-1].append(''.join(self.cell).replace('\xa0', ' ').strip())
+			self.cell = None
+
+	def handle_data(self, data):
+		if self.cell is not None:
+			self.cell.append(data)
+
+'''
+parse_table function returns the header and data rows of the screener results table, using
+lxml's C parser when it is installed and the streaming stdlib parser otherwise
+(string or bytes) html -> (list) header, (list) rows
+'''
+def parse_table(html):
+	try:
+		import lxml.html
+	except ImportError:
+		lxml = None
+	if lxml is not None:
+		tables = lxml.html.fromstring(html).find_class('tinytable')
+		if not tables:
+			return [], []
+		rows = [[cell.text_content().replace('\xa0', ' ').strip() for cell in tr.iterchildren('td', 'th')] for tr in tables[0].iter('tr')]
+	else:
+		parser = TableParser()
+		parser.feed(html.decode('utf-8', 'replace') if isinstance(html, bytes) else html)
+		rows = parser.rows
+	if not rows:
+		return [], []
+	return rows[0], [row for row in rows[1:] if len(row) == len(rows[0])]
+
+def parse_number(text):
+	text = text.replace('$', '').replace(',', '').replace('+', '').strip()
+	try:
+		return float(text)
+	except ValueError:
+		return float('nan')
+
+def parse_day(text):
+	return np.datetime64(text.strip()[:10], 'D')
+
+'''
+rows_to_filings function turns screener rows into Filings by header name, so both the single
+filing (grp=0) and the cluster (grp=2, with an Ins column) layouts work
+'''
+def rows_to_filings(header, rows):
+	column = {name: i for i, name in enumerate(header)}
+	filings = []
+	for row in rows:
+		filings.append(Filing(
+			ticker=row[column['Ticker']].lower(),
+			filing_date=parse_day(row[column['Filing Date']]),
+			trade_date=parse_day(row[column['Trade Date']]),
+			price=parse_number(row[column['Price']]),
+			insiders=int(parse_number(row[column['Ins']])) if 'Ins' in column else 1,
+			value=parse_number(row[column['Value']]),
+			insider=row[column['Insider Name']] if 'Insider Name' in column else '',
+		))
+	return filings
+
+'''
+InsiderFeed class. Every insider purchase of a date range held as columnar numpy arrays.
+Load it once per run (InsiderFeed.download, from_html or from_csv) and every screen and window
+the cluster engines ask for is answered by screen() with an in-memory filter instead of a
+screener request.
+'''
+class InsiderFeed:
+	def __init__(self, filings):
+		filings = sorted(filings, key=lambda filing: (filing.trade_date, filing.ticker))
+		self.filings = filings
+		self.tickers = np.array([filing.ticker for filing in filings], dtype=object)
+		self.filing_dates = np.array([filing.filing_date for filing in filings], dtype='datetime64[D]')
+		self.trade_dates = np.array([filing.trade_date for filing in filings], dtype='datetime64[D]')
+		self.prices = np.array([filing.price for filing in filings], dtype=np.float64)
+		self.insiders = np.array([filing.insiders for filing in filings], dtype=np.int64)
+		self.values = np.array([filing.value for filing in filings], dtype=np.float64)
+		self.names = np.array([filing.insider for filing in filings], dtype=object)
+
+	def __len__(self):
+		return len(self.filings)
+
+	'''
+	download function pulls every insider purchase traded in [start, end] from the screener,
+	a page of count rows at a time
+	(datetime) start, end -> InsiderFeed
+	'''
+	@classmethod
+	def download(cls, start, end, count=1000, max_pages=100):
+		import requests
+		filings = []
+		for page in range(1, max_pages + 1):
+			req = requests.get(openinsider_url(start, end, count=count, page=page), headers={"content-type":"text"})
+			header, rows = parse_table(req.content)
+			if not rows:
+				break
+			filings += rows_to_filings(header, rows)
+			if len(rows) < count:
+				break
+		return cls(filings)
+
+	'''
+	from_html function parses one or more saved screener pages
+	(list) paths -> InsiderFeed
+	'''
+	@classmethod
+	def from_html(cls, paths):
+		filings = []
+		for path in ([paths] if isinstance(paths, str) else paths):
+			with open(path, 'rb') as f:
+				filings += rows_to_filings(*parse_table(f.read()))
+		return cls(filings)
+
+	@classmethod
+	def from_csv(cls, path):
+		with open(path, newline='') as f:
+			filings = [Filing(row['ticker'], np.datetime64(row['filing_date'], 'D'), np.datetime64(row['trade_date'], 'D'), float(row['price']), int(row['insiders']), float(row['value']), row['insider']) for row in csv.DictReader(f)]
+		return cls(filings)
+
+	def save_csv(self, path):
+		with open(path, 'w', newline='') as f:
+			writer = csv.writer(f)
+			writer.writerow(Filing._fields)
+			for filing in self.filings:
+				writer.writerow([filing.ticker, str(filing.filing_date), str(filing.trade_date), filing.price, filing.insiders, filing.value, filing.insider])
+
+	'''
+	screen function is the in-memory version of the openinsider screener: purchases traded
+	between date1 and date2 (inclusive) that pass the price and value limits, ranked by price
+	high to low like sortcol=8. With min_insiders set the purchases are grouped by ticker first
+	and a ticker needs that many distinct insiders, like the cluster buy (grp=2) screen
+	(datetime) date1, date2, [optional] min_price, max_price, min_value in $k, min_insiders -> (list) tickers
+	'''
+	def screen(self, date1, date2, min_price=None, max_price=None, min_value=None, min_insiders=None):
+		return list(self.screen_table(date1, date2, min_price, max_price, min_value, min_insiders).tickers)
+
+	'''
+	screen_table function is screen returning the whole ranked table as a Screen
+	'''
+	def screen_table(self, date1, date2, min_price=None, max_price=None, min_value=None, min_insiders=None):
+		lo = int(np.searchsorted(self.trade_dates, np.datetime64(date1.strftime('%Y-%m-%d'), 'D'), side='left'))
+		hi = int(np.searchsorted(self.trade_dates, np.datetime64(date2.strftime('%Y-%m-%d'), 'D'), side='right'))
+		tickers = self.tickers[lo:hi]
+		prices = self.prices[lo:hi]
+		values = self.values[lo:hi]
+		if min_insiders is not None and len(tickers):
+			groups, group_of = np.unique(tickers.astype(str), return_inverse=True)
+			# a group's price is its value weighted average, its value the total
+			totals = np.bincount(group_of, weights=values, minlength=len(groups))
+			shares = np.bincount(group_of, weights=np.where(prices > 0, values / prices, 0), minlength=len(groups))
+			with np.errstate(divide='ignore', invalid='ignore'):
+				prices = totals / shares
+			values = totals
+			# a cluster row already carries its insider count, single filings count distinct names
+			single = self.insiders[lo:hi] == 1
+			names = {}
+			for group, name in zip(group_of[single], self.names[lo:hi][single]):
+				names.setdefault(group, set()).add(name)
+			insiders = np.bincount(group_of, weights=np.where(single, 0, self.insiders[lo:hi]), minlength=len(groups))
+			insiders += np.array([len(names.get(group, ())) for group in range(len(groups))])
+			tickers = groups.astype(object)
+			keep = insiders >= min_insiders
+		else:
+			insiders = self.insiders[lo:hi]
+			keep = np.ones(len(tickers), dtype=bool)
+		if min_price is not None:
+			keep &= prices >= min_price
+		if max_price is not None:
+			keep &= prices <= max_price
+		if min_value is not None:
+			keep &= values >= min_value * 1000
+		order = np.argsort(-prices[keep], kind='stable')
+		# a ticker bought by several insiders shows up once, at its best rank
+		return rank_rows(tickers[keep][order], prices[keep][order], values[keep][order], insiders[keep][order])
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+from collections import OrderedDict
+from prices import to_day, save_array
+
+# ---------------------------
+# INTRADAY BARS
+# ---------------------------
+
+INTRADAY_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+# one row per minute (or hour) bar, times in exchange local time
+INTRADAY_DTYPE = np.dtype([('time', 'datetime64[m]')] + [(field, 'f8') for field in INTRADAY_FIELDS])
+
+# one row per session: the rows [start, end) of the bar file that fall on day
+SESSION_DTYPE = np.dtype([('day', 'datetime64[D]'), ('start', 'i8'), ('end', 'i8')])
+
+'''
+session_index function returns the SESSION_DTYPE index of bar times already sorted
+(np.array) times datetime64[m] -> (np.array) sessions
+'''
+def session_index(times):
+	days = times.astype('datetime64[D]')
+	starts = np.flatnonzero(np.concatenate([[True], days[1:] != days[:-1]])) if len(days) else np.array([], dtype=np.int64)
+	index = np.empty(len(starts), dtype=SESSION_DTYPE)
+	index['day'] = days[starts]
+	index['start'] = starts
+	index['end'] = np.append(starts[1:], len(days))
+	return index
+
+'''
+IntradayStore class. Intraday bars on disk under path, two files per ticker:
+	<ticker>.npy			structured INTRADAY_DTYPE array of every bar, sorted by time
+	<ticker>.sessions.npy	SESSION_DTYPE index of where each session's bars start and end
+Both are opened memory-mapped, so session() hands back a view straight into the page cache:
+nothing is copied and only the sessions actually touched are ever read. At most max_open
+tickers stay mapped, the least recently used one is closed to make room, so memory stays
+flat however big the dataset on disk is.
+'''
+class IntradayStore:
+	def __init__(self, path, max_open=256):
+		self.path = path
+		self.max_open = max_open
+		self.maps = OrderedDict()
+		os.makedirs(path, exist_ok=True)
+
+	def files(self, ticker):
+		base = os.path.join(self.path, ticker.lower())
+		return base + '.npy', base + '.sessions.npy'
+
+	def __getstate__(self):
+		# worker processes map the files again themselves instead of getting a pickled copy
+		return {'path': self.path, 'max_open': self.max_open, 'maps': OrderedDict()}
+
+	def has(self, ticker):
+		return os.path.exists(self.files(ticker)[0])
+
+	'''
+	write function saves a ticker's bars (replacing what was there) and builds its session index
+	(string) ticker, (np.array) times datetime64, (dict) columns field -> np.array -> None
+	'''
+	def write(self, ticker, times, columns):
+		times = np.asarray(times).astype('datetime64[m]')
+		order = np.argsort(times, kind='stable')
+		records = np.empty(len(times), dtype=INTRADAY_DTYPE)
+		records['time'] = times[order]
+		for field in INTRADAY_FIELDS:
+			records[field] = np.asarray(columns[field], dtype=np.float64)[order]
+		bars_path, index_path = self.files(ticker)
+		self.maps.pop(ticker.lower(), None)
+		save_array(bars_path, records)
+		save_array(index_path, session_index(records['time']))
+
+	'''
+	write_frame function is write for a dataframe with a datetime index (or 'time' column)
+	and the INTRADAY_FIELDS columns
+	'''
+	def write_frame(self, ticker, frame):
+		times = frame['time'].values if 'time' in frame.columns else frame.index.values
+		self.write(ticker, times, {field: frame[field].values for field in INTRADAY_FIELDS})
+
+	def open(self, ticker):
+		ticker = ticker.lower()
+		if ticker in self.maps:
+			self.maps.move_to_end(ticker)
+			return self.maps[ticker]
+		bars_path, index_path = self.files(ticker)
+		if not os.path.exists(bars_path):
+			self.maps[ticker] = None
+		else:
+			self.maps[ticker] = (np.load(bars_path, mmap_mode='r'), np.load(index_path))
+		if len(self.maps) > self.max_open:
+			self.maps.popitem(last=False)
+		return self.maps[ticker]
+
+	'''
+	session function returns a ticker's bars on one day as a zero copy view, empty when there are none
+	(string) ticker, (datetime) date -> (np.array) INTRADAY_DTYPE records
+	'''
+	def session(self, ticker, date):
+		mapped = self.open(ticker)
+		if mapped is None:
+			return np.empty(0, dtype=INTRADAY_DTYPE)
+		records, index = mapped
+		day = to_day(date)
+		row = int(np.searchsorted(index['day'], day))
+		if row == len(index) or index['day'][row] != day:
+			return np.empty(0, dtype=INTRADAY_DTYPE)
+		return records[index['start'][row]:index['end'][row]]
+
+	'''
+	stop_exits function runs the stops of many positions over their real intraday path on date,
+	see first_crossings
+	(list) tickers, (datetime) date, (np.array) low, high stop levels ->
+	(np.array) covered (had bars that day), exited, exit price
+	'''
+	def stop_exits(self, tickers, date, low, high):
+		sessions = [self.session(ticker, date) for ticker in tickers]
+		covered = np.array([len(session) > 0 for session in sessions], dtype=bool)
+		exited, prices = first_crossings([session for session in sessions if len(session)], np.asarray(low)[covered], np.asarray(high)[covered])
+		all_exited = np.zeros(len(tickers), dtype=bool)
+		all_prices = np.full(len(tickers), np.nan)
+		all_exited[covered] = exited
+		all_prices[covered] = prices
+		return covered, all_exited, all_prices
+
+'''
+first_crossings function finds, for every position at once, the first bar of its session whose
+range reaches the stop loss (low <= low level) or the stop gain (high >= high level). The
+sessions are stacked into one nan padded (positions x bars) matrix so the search is a single
+argmax. A bar that opens past a level fills at its open (a gap), otherwise at the level itself.
+When one bar reaches both levels there is no telling which came first, the stop loss is assumed
+(list) sessions of INTRADAY_DTYPE records, (np.array) low, high levels per position ->
+(np.array) exited bool, price nan where not exited
+'''
+def first_crossings(sessions, low, high):
+	count = len(sessions)
+	if count == 0:
+		return np.zeros(0, dtype=bool), np.zeros(0)
+	width = max(len(session) for session in sessions)
+	opens = np.full((count, width), np.nan)
+	lows = np.full((count, width), np.nan)
+	highs = np.full((count, width), np.nan)
+	for i, session in enumerate(sessions):
+		opens[i, :len(session)] = session['open']
+		lows[i, :len(session)] = session['low']
+		highs[i, :len(session)] = session['high']
+	low = np.asarray(low, dtype=np.float64)[:, None]
+	high = np.asarray(high, dtype=np.float64)[:, None]
+	# nan padding compares False, it never triggers
+	with np.errstate(invalid='ignore'):
+		hit_low = lows <= low
+		hit_high = highs >= high
+	hits = hit_low | hit_high
+	exited = hits.any(axis=1)
+	first = hits.argmax(axis=1)
+	rows = np.arange(count)
+	bar_open = opens[rows, first]
+	loss = hit_low[rows, first]
+	# past the level at the open means the stop fills at the open, else at the level
+	loss_price = np.minimum(bar_open, low[:, 0])
+	gain_price = np.maximum(bar_open, high[:, 0])
+	prices = np.where(exited, np.where(loss, loss_price, gain_price), np.nan)
+	return exited, prices
@@ -0,0 +1,83 @@
+import numpy as np
+
+# ---------------------------
+# PERFORMANCE METRICS
+# ---------------------------
+
+TRADING_DAYS = 252
+
+'''
+daily_returns function returns the day over day returns of a value series
+(list) values -> (np.array) returns
+'''
+def daily_returns(values):
+	values = np.asarray(values, dtype=np.float64)
+	if len(values) < 2:
+		return np.zeros(0)
+	return values[1:] / values[:-1] - 1
+
+'''
+cagr function returns the compound annual growth rate between the first and last value
+(list) dates, (list) values -> (float) rate
+'''
+def cagr(dates, values):
+	if len(values) < 2 or values[0] <= 0:
+		return 0.0
+	years = (dates[len(values) - 1] - dates[0]).days / 365.25
+	if years <= 0:
+		return 0.0
+	return float((values[-1] / values[0]) ** (1 / years) - 1)
+
+'''
+max_drawdown function returns the largest fall from a running peak, 0.25 is a 25% drawdown
+(list) values -> (float) drawdown
+'''
+def max_drawdown(values):
+	values = np.asarray(values, dtype=np.float64)
+	if len(values) == 0:
+		return 0.0
+	peaks = np.maximum.accumulate(values)
+	return float(np.max(1 - values / peaks))
+
+'''
+sharpe function returns the annualized sharpe ratio of the daily returns
+(list) values, [optional] (float) risk_free annual rate -> (float) ratio
+'''
+def sharpe(values, risk_free=0.0):
+	returns = daily_returns(values) - risk_free / TRADING_DAYS
+	if len(returns) < 2 or returns.std() == 0:
+		return 0.0
+	return float(returns.mean() / returns.std() * np.sqrt(TRADING_DAYS))
+
+'''
+summarize function returns every metric of one equity curve
+(list) dates, (list) values -> (dict) final_value, cagr, max_drawdown, sharpe
+'''
+def summarize(dates, values):
+	return {
+		'final_value': float(values[-1]) if len(values) else 0.0,
+		'cagr': cagr(dates, values),
+		'max_drawdown': max_drawdown(values),
+		'sharpe': sharpe(values),
+	}
+
+'''
+summarize_paths function is summarize for many equity paths at once, one path per row, every
+path spanning the same number of years. Vectorized over the rows so thousands of simulated
+paths cost a few array operations
+(np.array) values (paths x points), (float) years -> (dict) final_value, cagr, max_drawdown, sharpe -> np.array per path
+'''
+def summarize_paths(values, years):
+	values = np.asarray(values, dtype=np.float64)
+	returns = values[:, 1:] / values[:, :-1] - 1
+	std = returns.std(axis=1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		sharpe = np.where(std > 0, returns.mean(axis=1) / std * np.sqrt(TRADING_DAYS), 0.0)
+		growth = values[:, -1] / values[:, 0]
+		cagr = np.where(growth > 0, growth ** (1 / years) - 1, -1.0) if years > 0 else np.zeros(len(values))
+	return {
+		'final_value': values[:, -1],
+		'cagr': cagr,
+		'max_drawdown': np.max(1 - values / np.maximum.accumulate(values, axis=1), axis=1),
+		'sharpe': sharpe,
+	}
@@ -0,0 +1,224 @@
+import numpy as np
+from collections.abc import MutableMapping
+
+# ---------------------------
+# PORTFOLIO
+# ---------------------------
+
+BUY = 1
+SELL = -1
+
+# one row per order, side is BUY or SELL and ticker is the portfolio's integer id for it,
+# fee is the commission paid on top of shares * price
+LEDGER_DTYPE = np.dtype([('date', 'datetime64[D]'), ('ticker', 'i4'), ('side', 'i1'), ('shares', 'f8'), ('price', 'f8'), ('fee', 'f8')])
+
+'''
+Ledger class. Append-only trade log kept in a structured numpy array that doubles in
+size when full, records is a view of the rows written so far
+'''
+class Ledger:
+	__slots__ = ('rows', 'size')
+
+	def __init__(self, capacity=16):
+		self.rows = np.zeros(capacity, dtype=LEDGER_DTYPE)
+		self.size = 0
+
+	def __len__(self):
+		return self.size
+
+	def append(self, date, ticker, side, shares, price, fee=0.0):
+		if self.size == len(self.rows):
+			self.rows = np.concatenate([self.rows, np.zeros(len(self.rows), dtype=LEDGER_DTYPE)])
+		self.rows[self.size] = (np.datetime64(date.strftime('%Y-%m-%d'), 'D') if date is not None else np.datetime64('NaT'), ticker, side, shares, price, fee)
+		self.size += 1
+
+	@property
+	def records(self):
+		return self.rows[:self.size]
+
+'''
+Position class. What portfolio[ticker] returns: a view onto one row of the position arrays
+that reads and writes like the old {'shares': ..., 'purchase_price': ...} dict
+'''
+class Position:
+	__slots__ = ('portfolio', 'id')
+
+	def __init__(self, portfolio, id):
+		self.portfolio = portfolio
+		self.id = id
+
+	def __getitem__(self, key):
+		if key == 'shares':
+			return float(self.portfolio.shares[self.id])
+		if key == 'purchase_price':
+			return float(self.portfolio.purchase_prices[self.id])
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key == 'shares':
+			self.portfolio.shares[self.id] = value
+		elif key == 'purchase_price':
+			self.portfolio.purchase_prices[self.id] = value
+		else:
+			raise KeyError(key)
+
+	def keys(self):
+		return ['shares', 'purchase_price']
+
+	def to_dict(self):
+		return {'shares': self['shares'], 'purchase_price': self['purchase_price']}
+
+	def __eq__(self, other):
+		return self.to_dict() == (other.to_dict() if isinstance(other, Position) else other)
+
+	def __repr__(self):
+		return repr(self.to_dict())
+
+'''
+Portfolio class. Initialized with (float) cash. Positions live in numpy arrays indexed by
+integer ticker ids (ids maps ticker -> id, tickers maps id -> ticker), held marks the ids
+currently owned and every order lands in the ledger. It is a MutableMapping with the same
+keys as the old portfolio dict ('cash' plus one entry per held ticker), so dict based
+decision engines, buy, sell and sell_all keep working on it unchanged:
+	portfolio['cash'] += 10
+	portfolio['amzn']['shares'] -= 1
+	portfolio['amzn'] = {'shares': 10, 'purchase_price': 128.55}
+	portfolio.pop('amzn')
+'''
+class Portfolio(MutableMapping):
+	__slots__ = ('cash', 'ids', 'tickers', 'shares', 'purchase_prices', 'held', 'ledger')
+
+	def __init__(self, cash=0, capacity=8):
+		self.cash = cash
+		self.ids = {}
+		self.tickers = []
+		self.shares = np.zeros(capacity)
+		self.purchase_prices = np.zeros(capacity)
+		self.held = np.zeros(capacity, dtype=bool)
+		self.ledger = Ledger()
+
+	'''
+	from_dict function is the adapter for engines that hand back a plain portfolio dict. With the
+	previous Portfolio of the algo its ledger is kept, and so are its ticker ids (the ledger rows
+	refer to them), whatever order the dict lists the tickers in. New tickers get the next ids
+	(dict) portfolio, [optional] (Portfolio) previous -> Portfolio
+	'''
+	@classmethod
+	def from_dict(cls, portfolio, previous=None):
+		result = cls(portfolio.get('cash', 0), len(previous.shares) if previous is not None else 8)
+		if previous is not None:
+			result.ids = dict(previous.ids)
+			result.tickers = list(previous.tickers)
+			result.ledger = previous.ledger
+		for ticker, holding in portfolio.items():
+			if ticker != 'cash':
+				result[ticker] = holding
+		return result
+
+	def to_dict(self):
+		result = {'cash': self.cash}
+		for ticker in self.held_tickers():
+			result[ticker] = self[ticker].to_dict()
+		return result
+
+	'''
+	id function returns the integer id of a ticker, adding it (and growing the arrays) when new
+	'''
+	def id(self, ticker):
+		if ticker not in self.ids:
+			if len(self.tickers) == len(self.shares):
+				grow = len(self.shares)
+				self.shares = np.concatenate([self.shares, np.zeros(grow)])
+				self.purchase_prices = np.concatenate([self.purchase_prices, np.zeros(grow)])
+				self.held = np.concatenate([self.held, np.zeros(grow, dtype=bool)])
+			self.ids[ticker] = len(self.tickers)
+			self.tickers.append(ticker)
+		return self.ids[ticker]
+
+	def held_ids(self):
+		return np.flatnonzero(self.held[:len(self.tickers)])
+
+	def held_tickers(self):
+		return [self.tickers[id] for id in self.held_ids()]
+
+	'''
+	record function appends an order to the ledger
+	(datetime) date, (string) ticker, (int) side BUY or SELL, (float) shares, price, [optional] (float) fee
+	'''
+	def record(self, date, ticker, side, shares, price, fee=0.0):
+		self.ledger.append(date, self.id(ticker), side, shares, price, fee)
+
+	'''
+	market_value function marks the portfolio to market in one vectorized shares x closes pass,
+	summed strictly in id order (not a BLAS dot) so valuation.equity_curve reproduces it exactly
+	(np.array) closes of the held tickers, in held_ids() order -> (float) total
+	'''
+	def market_value(self, closes):
+		if len(closes) == 0:
+			return self.cash
+		return self.cash + float(np.add.accumulate(self.shares[self.held_ids()] * closes)[-1])
+
+	def __getitem__(self, key):
+		if key == 'cash':
+			return self.cash
+		id = self.ids.get(key)
+		if id is None or not self.held[id]:
+			raise KeyError(key)
+		return Position(self, id)
+
+	def __setitem__(self, key, value):
+		if key == 'cash':
+			self.cash = value
+			return
+		id = self.id(key)
+		self.shares[id] = value['shares']
+		self.purchase_prices[id] = value['purchase_price']
+		self.held[id] = True
+
+	def __delitem__(self, key):
+		if key == 'cash':
+			raise KeyError('cash cannot be removed from a portfolio')
+		id = self.ids.get(key)
+		if id is None or not self.held[id]:
+			raise KeyError(key)
+		self.held[id] = False
+		self.shares[id] = 0
+		self.purchase_prices[id] = 0
+
+	'''
+	pop returns a plain dict, the Position view would read the zeroed row after the delete
+	'''
+	def pop(self, key, *default):
+		try:
+			value = self[key]
+		except KeyError:
+			if default:
+				return default[0]
+			raise
+		value = value.to_dict() if isinstance(value, Position) else value
+		del self[key]
+		return value
+
+	def __contains__(self, key):
+		if key == 'cash':
+			return True
+		id = self.ids.get(key)
+		return id is not None and bool(self.held[id])
+
+	def __iter__(self):
+		yield 'cash'
+		for ticker in self.held_tickers():
+			yield ticker
+
+	def __len__(self):
+		return 1 + int(self.held.sum())
+
+	def __repr__(self):
+		return 'Portfolio(' + repr(self.to_dict()) + ')'
+
+	def __getstate__(self):
+		return {slot: getattr(self, slot) for slot in self.__slots__}
+
+	def __setstate__(self, state):
+		for slot, value in state.items():
+			setattr(self, slot, value)
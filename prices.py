@@ -0,0 +1,428 @@
+import os
+import json
+import calendar
+import numpy as np
+from datetime import datetime, timedelta
+from profiling import span, count
+
+# ---------------------------
+# PRICE STORE
+# ---------------------------
+
+'''
+columns kept for every ticker, same order as the yahoo_fin.get_data dataframe
+'''
+FIELDS = ('open', 'high', 'low', 'close', 'adjclose', 'volume')
+
+# how far back from a requested date we fetch when the store has no range set yet
+DEFAULT_LOOKBACK = timedelta(days=30)
+
+'''
+to_day function converts a datetime (or date) into a numpy day
+(datetime) date -> (np.datetime64) day
+'''
+def to_day(date):
+	return np.datetime64(date.strftime('%Y-%m-%d'), 'D')
+
+'''
+save_array function writes an array to a .npy path through a temp file and a rename, so a reader
+never maps a half written file. np.save appends .npy to names that lack it, so the temp name keeps it
+(string) path ending in .npy, (np.array) array -> None
+'''
+def save_array(path, array):
+	tmp = path[:-len('.npy')] + '.tmp.npy'
+	np.save(tmp, array)
+	os.replace(tmp, path)
+
+'''
+Bars class. Columnar OHLCV arrays for one ticker, sorted by trading date.
+dates is a datetime64[D] array, columns maps each of FIELDS to a float64 array
+and index maps a datetime.date to its row so single day lookups are O(1)
+'''
+class Bars:
+	def __init__(self, dates, columns):
+		self.dates = np.asarray(dates, dtype='datetime64[D]')
+		self.columns = {field: np.asarray(columns[field], dtype=np.float64) for field in FIELDS}
+		self.index = {day: i for i, day in enumerate(self.dates.tolist())}
+
+	def __len__(self):
+		return len(self.dates)
+
+	'''
+	row function returns the row of a date or None when there is no bar that day
+	'''
+	def row(self, date):
+		day = date.date() if isinstance(date, datetime) else date
+		return self.index.get(day)
+
+	'''
+	window function returns the last n values of a field strictly before date
+	(string) field, (datetime) date, (int) n -> (np.array) values
+	'''
+	def window(self, field, date, n):
+		end = int(np.searchsorted(self.dates, to_day(date), side='left'))
+		return self.columns[field][max(0, end - n):end]
+
+	'''
+	merge function returns new Bars holding the rows of both, other wins on duplicate dates
+	'''
+	def merge(self, other):
+		if len(self) == 0:
+			return other
+		if len(other) == 0:
+			return self
+		dates = np.concatenate([other.dates, self.dates])
+		# np.unique keeps the first occurrence, which is the newer data from other
+		dates, keep = np.unique(dates, return_index=True)
+		columns = {field: np.concatenate([other.columns[field], self.columns[field]])[keep] for field in FIELDS}
+		return Bars(dates, columns)
+
+	'''
+	between function returns the rows with start <= date < end
+	'''
+	def between(self, start, end):
+		lo = int(np.searchsorted(self.dates, to_day(start), side='left'))
+		hi = int(np.searchsorted(self.dates, to_day(end), side='left'))
+		return Bars(self.dates[lo:hi], {field: self.columns[field][lo:hi] for field in FIELDS})
+
+def empty_bars():
+	return Bars([], {field: [] for field in FIELDS})
+
+'''
+frame_to_bars function converts a yahoo_fin style dataframe (date index, or a 'date'
+column, plus the FIELDS columns) into Bars
+'''
+def frame_to_bars(frame):
+	if 'date' in frame.columns:
+		dates = frame['date'].values
+	else:
+		dates = frame.index.values
+	dates = np.asarray(dates).astype('datetime64[D]')
+	order = np.argsort(dates, kind='stable')
+	return Bars(dates[order], {field: frame[field].values.astype(np.float64)[order] for field in FIELDS})
+
+# ---------------------------
+# SOURCES
+# ---------------------------
+
+'''
+A source is anything with a fetch(ticker, start, end) method returning Bars for
+start <= date < end. The store asks a source for each ticker's full range once.
+A source can also have fetch_many(tickers, start, end) for batches, see fetch_many below.
+'''
+
+'''
+fetch_many function fetches a batch of tickers from a source, in one concurrent batch when the
+source has its own fetch_many and one ticker at a time otherwise
+(source) source, (list) tickers, (datetime) start, end -> (dict) ticker -> Bars, or the exception
+'''
+def fetch_many(source, tickers, start, end):
+	if hasattr(source, 'fetch_many'):
+		return source.fetch_many(tickers, start, end)
+	results = {}
+	for ticker in tickers:
+		try:
+			results[ticker] = source.fetch(ticker, start, end)
+		except Exception as e:
+			results[ticker] = e
+	return results
+
+YAHOO_CHART_URL = 'https://query1.finance.yahoo.com/v8/finance/chart/'
+YAHOO_HEADERS = {'User-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+'''
+yahoo_chart_url function is the daily chart api request yahoo_fin.get_data makes
+(string) ticker, (datetime) start, end -> (string) url
+'''
+def yahoo_chart_url(ticker, start, end):
+	period1 = calendar.timegm(start.timetuple())
+	period2 = calendar.timegm(end.timetuple())
+	return YAHOO_CHART_URL + ticker.upper() + '?period1=%d&period2=%d&interval=1d&events=div,splits' % (period1, period2)
+
+'''
+parse_chart function turns a chart api response into Bars, rows with no close are dropped
+(bytes) body -> Bars
+'''
+def parse_chart(body):
+	result = json.loads(body)['chart']['result'][0]
+	if 'timestamp' not in result:
+		return empty_bars()
+	quote = result['indicators']['quote'][0]
+	columns = {field: np.array(quote[field], dtype=np.float64) for field in FIELDS if field != 'adjclose'}
+	adjclose = result['indicators'].get('adjclose')
+	columns['adjclose'] = np.array(adjclose[0]['adjclose'], dtype=np.float64) if adjclose else columns['close']
+	# timestamps are the session open in utc, flooring to the day gives the trading date
+	dates = np.array(result['timestamp'], dtype='datetime64[s]').astype('datetime64[D]')
+	keep = ~np.isnan(columns['close'])
+	order = np.argsort(dates[keep], kind='stable')
+	return Bars(dates[keep][order], {field: columns[field][keep][order] for field in FIELDS})
+
+'''
+YahooSource fetches daily bars from yahoo. fetch goes through yahoo_fin, one ticker and range
+at a time. fetch_many does not need yahoo_fin: it downloads the raw chart api json of a whole
+batch at once through an AsyncFetcher (see yahoo_chart_url) and parses it with parse_chart
+[optional] (AsyncFetcher) fetcher fetch_many downloads with, one with YAHOO_HEADERS by default
+'''
+class YahooSource:
+	def __init__(self, fetcher=None):
+		self.fetcher = fetcher
+
+	def fetch(self, ticker, start, end):
+		import yahoo_fin.stock_info as si
+		frame = si.get_data(ticker, start_date = start.strftime("%m-%d-%Y"), end_date = end.strftime("%m-%d-%Y"))
+		return frame_to_bars(frame)
+
+	def fetch_many(self, tickers, start, end):
+		from fetcher import AsyncFetcher
+		fetcher = self.fetcher if self.fetcher is not None else AsyncFetcher(headers=YAHOO_HEADERS)
+		bodies = fetcher.fetch_all([yahoo_chart_url(ticker, start, end) for ticker in tickers])
+		results = {}
+		for ticker, body in zip(tickers, bodies):
+			try:
+				if isinstance(body, Exception):
+					raise body
+				results[ticker] = parse_chart(body).between(start, end)
+			except Exception as e:
+				results[ticker] = e
+		return results
+
+'''
+MemorySource serves Bars already held in memory, e.g. generated ones
+(dict) ticker -> Bars
+'''
+class MemorySource:
+	def __init__(self, bars):
+		self.bars = {ticker.lower(): value for ticker, value in bars.items()}
+
+	def fetch(self, ticker, start, end):
+		ticker = ticker.lower()
+		if ticker not in self.bars:
+			raise KeyError('no prices for ' + ticker)
+		return self.bars[ticker].between(start, end)
+
+# one row per bar in a file PriceStore.share writes, every ticker's rows one after another
+SHARED_DTYPE = np.dtype([('date', 'datetime64[D]')] + [(field, 'f8') for field in FIELDS])
+
+'''
+MappedSource serves the bars PriceStore.share wrote from one memory-mapped file, so every
+process reading it shares the same pages instead of holding its own copy. A ticker or range
+the file does not cover is fetched from upstream, or has no prices when there is none.
+Pickling it only sends the path, each process maps the file itself
+(string) path without extension, [optional] (source) upstream
+'''
+class MappedSource:
+	def __init__(self, path, upstream=None):
+		self.path = path
+		self.upstream = upstream
+		self.records = None
+		self.index = None
+
+	def __getstate__(self):
+		return {'path': self.path, 'upstream': self.upstream, 'records': None, 'index': None}
+
+	def open(self):
+		if self.records is None:
+			self.records = np.load(self.path + '.npy', mmap_mode='r')
+			with open(self.path + '.json') as f:
+				self.index = json.load(f)
+
+	def fetch(self, ticker, start, end):
+		self.open()
+		ticker = ticker.lower()
+		entry = self.index.get(ticker)
+		if entry is None or to_day(start) < np.datetime64(entry['start']) or to_day(end) > np.datetime64(entry['end']):
+			if self.upstream is None:
+				raise KeyError('no prices for ' + ticker + ' in ' + self.path)
+			return self.upstream.fetch(ticker, start, end)
+		# views into the mapped file, nothing is copied
+		records = self.records[entry['rows'][0]:entry['rows'][1]]
+		return Bars(records['date'], {field: records[field] for field in FIELDS}).between(start, end)
+
+'''
+FileSource reads bars from local files so tests and offline runs never touch Yahoo.
+path is either a directory holding one <ticker>.csv / <ticker>.parquet per ticker,
+or a single csv/parquet file with a 'ticker' column. Files look like a saved
+si.get_data dataframe (date index or 'date' column, open/high/low/close/adjclose/volume)
+'''
+class FileSource:
+	def __init__(self, path):
+		self.path = path
+		self.frames = None
+
+	def read(self, path):
+		import pandas as pd
+		if path.endswith('.parquet'):
+			frame = pd.read_parquet(path)
+		else:
+			frame = pd.read_csv(path, index_col=0, parse_dates=True)
+		if 'date' not in frame.columns and frame.index.name != 'date':
+			frame.index.name = 'date'
+		return frame
+
+	def fetch(self, ticker, start, end):
+		ticker = ticker.lower()
+		if os.path.isdir(self.path):
+			for ext in ('.parquet', '.csv'):
+				path = os.path.join(self.path, ticker + ext)
+				if os.path.exists(path):
+					return frame_to_bars(self.read(path)).between(start, end)
+			raise KeyError('no price file for ' + ticker)
+		if self.frames is None:
+			frame = self.read(self.path)
+			self.frames = {str(name).lower(): group for name, group in frame.groupby('ticker')}
+		if ticker not in self.frames:
+			raise KeyError('no prices for ' + ticker + ' in ' + self.path)
+		return frame_to_bars(self.frames[ticker]).between(start, end)
+
+'''
+PriceStore class. Holds every ticker's bars in memory for the backtest range.
+The first lookup of a ticker fetches the whole range [start, end) from the source,
+after that every get_stock/sma/valuation call is answered from the arrays.
+A lookup outside the covered range widens it with one more fetch.
+'''
+class PriceStore:
+	def __init__(self, source=None, start=None, end=None):
+		self.source = source if source is not None else YahooSource()
+		self.start = start
+		self.end = end
+		self.bars = {}
+		self.covered = {}
+
+	'''
+	set_range function sets the window fetched for every ticker from now on
+	(datetime) start, (datetime) end -> None
+	'''
+	def set_range(self, start, end):
+		self.start = start
+		self.end = end
+
+	'''
+	load function fetches a list of tickers up front
+	'''
+	def load(self, tickers):
+		tickers = list(dict.fromkeys(ticker.lower() for ticker in tickers))
+		# tickers never fetched go out as one batch, partly covered ones are widened by get
+		new = [ticker for ticker in tickers if ticker not in self.covered]
+		if new and self.start is not None and self.end is not None:
+			with span('fetch.batch'):
+				fetched = fetch_many(self.source, new, self.start, self.end)
+			count('prices.miss', len(new))
+			for ticker, bars in fetched.items():
+				if isinstance(bars, Exception):
+					print('No price data for', ticker, bars)
+					bars = empty_bars()
+				self.bars[ticker] = bars
+				self.covered[ticker] = (self.start, self.end)
+		for ticker in tickers:
+			self.get(ticker)
+
+	'''
+	share function writes every ticker loaded so far to path.npy (bars) and path.json (where each
+	ticker's rows are and the range they cover) and returns a store reading them through a
+	MappedSource, the one to hand to worker processes: it pickles to a few bytes and every worker
+	maps the same file. Anything the file lacks is fetched from this store's source, except a
+	MemorySource, which would be pickled whole into every worker
+	(string) path without extension -> PriceStore
+	'''
+	def share(self, path):
+		tickers = sorted(self.bars)
+		records = np.empty(sum(len(self.bars[ticker]) for ticker in tickers), dtype=SHARED_DTYPE)
+		index = {}
+		row = 0
+		for ticker in tickers:
+			bars = self.bars[ticker]
+			records['date'][row:row + len(bars)] = bars.dates
+			for field in FIELDS:
+				records[field][row:row + len(bars)] = bars.columns[field]
+			start, end = self.covered[ticker]
+			index[ticker] = {'rows': [row, row + len(bars)], 'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')}
+			row += len(bars)
+		np.save(path + '.npy', records)
+		with open(path + '.json', 'w') as f:
+			json.dump(index, f)
+		upstream = None if isinstance(self.source, MemorySource) else self.source
+		return PriceStore(MappedSource(path, upstream), self.start, self.end)
+
+	def fetch(self, ticker, start, end):
+		try:
+			with span('fetch'):
+				return self.source.fetch(ticker, start, end)
+		except Exception as e:
+			# remember the miss so a bad ticker costs one request per run, not one per day
+			print('No price data for', ticker, e)
+			return empty_bars()
+
+	'''
+	get function returns the Bars of a ticker, fetching whatever part of the range
+	(and of date, when given) is not covered yet
+	(string) ticker, [optional] (datetime) date -> Bars
+	'''
+	def get(self, ticker, date=None):
+		ticker = ticker.lower()
+		start, end = self.start, self.end
+		if date is not None:
+			if start is None or date < start:
+				start = date - DEFAULT_LOOKBACK
+			if end is None or date >= end:
+				end = date + timedelta(days=1)
+		if start is None or end is None:
+			raise ValueError('PriceStore has no date range, call set_range first')
+		if ticker not in self.covered:
+			count('prices.miss')
+			self.bars[ticker] = self.fetch(ticker, start, end)
+			self.covered[ticker] = (start, end)
+			return self.bars[ticker]
+		have_start, have_end = self.covered[ticker]
+		if start >= have_start and end <= have_end:
+			count('prices.hit')
+			return self.bars[ticker]
+		count('prices.miss')
+		if start < have_start:
+			self.bars[ticker] = self.bars[ticker].merge(self.fetch(ticker, start, have_start))
+			have_start = start
+		if end > have_end:
+			self.bars[ticker] = self.bars[ticker].merge(self.fetch(ticker, have_end, end))
+			have_end = end
+		self.covered[ticker] = (have_start, have_end)
+		return self.bars[ticker]
+
+	'''
+	has_bar function returns True when the ticker traded on date
+	'''
+	def has_bar(self, ticker, date):
+		return self.get(ticker, date).row(date) is not None
+
+	'''
+	bar function returns every field of a ticker on a given day
+	(string) ticker, (datetime) date -> (dict) open, high, low, close, adjclose, volume
+	raises KeyError when there is no bar that day
+	'''
+	def bar(self, ticker, date):
+		bars = self.get(ticker, date)
+		row = bars.row(date)
+		if row is None:
+			raise KeyError('no ' + ticker + ' bar on ' + date.strftime("%m-%d-%Y"))
+		return {field: float(bars.columns[field][row]) for field in FIELDS}
+
+	def close(self, ticker, date):
+		return self.bar(ticker, date)['close']
+
+	'''
+	last_close function returns the close of the last bar on or before date, the price a holding
+	is valued at on a day it has no bar (a halt, a gap in the data)
+	(string) ticker, (datetime) date -> (float) close
+	raises KeyError when there is no bar on or before date
+	'''
+	def last_close(self, ticker, date):
+		bars = self.get(ticker, date)
+		row = int(np.searchsorted(bars.dates, to_day(date), side='right')) - 1
+		if row < 0:
+			raise KeyError('no ' + ticker + ' bar on or before ' + date.strftime("%m-%d-%Y"))
+		return float(bars.columns['close'][row])
+
+	'''
+	window function returns the last n values of a field strictly before date
+	(string) ticker, (string) field, (datetime) date, (int) n -> (np.array) values
+	'''
+	def window(self, ticker, field, date, n):
+		return self.get(ticker, date).window(field, date, n)
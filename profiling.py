@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+
+# ---------------------------
+# PROFILING
+# ---------------------------
+
+'''
+The Profiler of the running Backtester, None when profiling is off. Every probe below
+checks it first, so with profiling off a probe costs one global lookup and a compare
+'''
+active = None
+
+'''
+Profiler class. Collects per phase timers (calls and total seconds, nested phases count
+toward their parents too), counters (cache hits and misses, requests, bytes) and one trace
+event per timed call for the chrome trace
+'''
+class Profiler:
+	def __init__(self):
+		self.timers = {}
+		self.counters = {}
+		self.events = []
+		self.origin = time.perf_counter()
+
+	def record(self, name, detail, start, end):
+		key = name if detail is None else name + ':' + str(detail)
+		timer = self.timers.get(key)
+		if timer is None:
+			timer = self.timers[key] = [0, 0.0]
+		timer[0] += 1
+		timer[1] += end - start
+		self.events.append((name, detail, start - self.origin, end - start, os.getpid(), threading.get_ident()))
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	'''
+	merge function adds another profiler's numbers into this one, e.g. a worker process's
+	'''
+	def merge(self, other):
+		for key, (calls, seconds) in other.timers.items():
+			timer = self.timers.setdefault(key, [0, 0.0])
+			timer[0] += calls
+			timer[1] += seconds
+		for name, n in other.counters.items():
+			self.count(name, n)
+		# worker clocks start at their own origin, shift them onto this one
+		shift = other.origin - self.origin
+		self.events += [(name, detail, start + shift, duration, pid, tid) for name, detail, start, duration, pid, tid in other.events]
+
+	'''
+	table function returns the summary as a text table, slowest phases first
+	'''
+	def table(self):
+		lines = ['%-40s %10s %12s %12s' % ('phase', 'calls', 'total s', 'mean ms')]
+		for key, (calls, seconds) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+			lines.append('%-40s %10d %12.4f %12.4f' % (key, calls, seconds, 1000 * seconds / calls))
+		if self.counters:
+			lines.append('')
+			lines.append('%-40s %10s' % ('counter', 'value'))
+			for name in sorted(self.counters):
+				lines.append('%-40s %10d' % (name, self.counters[name]))
+		return '\n'.join(lines)
+
+	def summary(self):
+		return {
+			'timers': {key: {'calls': calls, 'seconds': seconds} for key, (calls, seconds) in self.timers.items()},
+			'counters': dict(self.counters),
+		}
+
+	def save_json(self, path):
+		with open(path, 'w') as f:
+			json.dump(self.summary(), f, indent=1)
+
+	'''
+	save_trace function writes the timed calls in the chrome trace event format, open the
+	file in chrome://tracing or ui.perfetto.dev
+	'''
+	def save_trace(self, path):
+		events = []
+		for name, detail, start, duration, pid, tid in self.events:
+			event = {'name': name if detail is None else str(detail), 'cat': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': tid}
+			events.append(event)
+		with open(path, 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+class Span:
+	__slots__ = ('profiler', 'name', 'detail', 'start')
+
+	def __init__(self, profiler, name, detail):
+		self.profiler = profiler
+		self.name = name
+		self.detail = detail
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.profiler.record(self.name, self.detail, self.start, time.perf_counter())
+		return False
+
+class NullSpan:
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+NULL_SPAN = NullSpan()
+
+'''
+span function times a phase, with an optional detail like the algo name:
+	with span('engine', algo.name):
+		...
+'''
+def span(name, detail=None):
+	if active is None:
+		return NULL_SPAN
+	return Span(active, name, detail)
+
+def count(name, n=1):
+	if active is not None:
+		active.count(name, n)
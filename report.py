@@ -0,0 +1,159 @@
+import os
+import csv
+import numpy as np
+from metrics import summarize
+from profiling import span
+
+# ---------------------------
+# REPORTING
+# ---------------------------
+
+# algos drawn on one chart, Set1 has 9 colors
+ALGOS_PER_CHART = 9
+
+'''
+darkgrid_style function returns the name of the seaborn darkgrid style, it was renamed in matplotlib 3.6
+and the old name removed in 3.8
+() -> (string) style
+'''
+def darkgrid_style():
+	import matplotlib.style
+	return 'seaborn-v0_8-darkgrid' if 'seaborn-v0_8-darkgrid' in matplotlib.style.available else 'seaborn-darkgrid'
+
+'''
+decimate function thins a long series down to about max_points for plotting. The series is cut
+into max_points / 2 equal buckets and each keeps its lowest and highest point, so every peak
+and every drawdown still shows, unlike taking every nth point
+(list) dates, (list) values, [optional] (int) max_points -> (np.array) dates, values
+'''
+def decimate(dates, values, max_points=2000):
+	dates = np.asarray(dates)
+	values = np.asarray(values, dtype=np.float64)
+	count = len(values)
+	if count <= max_points or max_points < 4:
+		return dates, values
+	width = -(-count // (max_points // 2))
+	buckets = -(-count // width)
+	# pad the last bucket with nan so the series reshapes into (buckets x width)
+	padded = np.full(buckets * width, np.nan)
+	padded[:count] = values
+	padded = padded.reshape(buckets, width)
+	offsets = np.arange(buckets) * width
+	keep = np.unique(np.concatenate([[0, count - 1], offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1)]))
+	return dates[keep], values[keep]
+
+'''
+plot_equity function draws equity curves on figure, decimated to max_points each
+(Figure) figure, (list) dates, (dict) algo name -> values, [optional] (string) title, (int) max_points -> None
+'''
+def plot_equity(figure, dates, curves, title='Backtester', max_points=2000):
+	import matplotlib
+	import matplotlib.dates as mdates
+	palette = matplotlib.colormaps['Set1']
+	ax = figure.add_subplot()
+	locator = mdates.AutoDateLocator() # date formatter on axis
+	ax.xaxis.set_major_locator(locator)
+	ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+	ax.set_title(title, loc='left', fontsize=14, fontweight='normal', color='black')
+	ax.set_ylabel('Portfolio Value ($)')
+	for index, (name, values) in enumerate(curves.items()):
+		x, y = decimate(dates, values, max_points)
+		ax.plot(x, y, marker='', color=palette(index % palette.N), linewidth=2, alpha=0.9, label=name)
+	ax.legend(loc=2, ncol=2) # legend top left
+
+'''
+save_charts function renders equity curves to image files without a display, per_chart algos
+to a chart, named equity_000.png, equity_001.png... Uses the Agg canvas directly instead of
+pyplot so there is no global figure state, no gui backend and one figure reused for every batch
+(string) out_dir, (list) dates, (dict) algo name -> values, [optional] (tuple) formats like png, svg,
+(int) per_chart, (int) max_points points per curve, (tuple) size in inches, (int) dpi -> (list) paths written
+'''
+def save_charts(out_dir, dates, curves, formats=('png',), per_chart=ALGOS_PER_CHART, max_points=2000, size=(12, 6), dpi=100):
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	import matplotlib.style
+	os.makedirs(out_dir, exist_ok=True)
+	names = list(curves)
+	batches = [names[i:i + per_chart] for i in range(0, len(names), per_chart)]
+	paths = []
+	with matplotlib.style.context(darkgrid_style()):
+		figure = Figure(figsize=size, dpi=dpi, layout='constrained')
+		FigureCanvasAgg(figure)
+		for number, batch in enumerate(batches):
+			figure.clear()
+			title = 'Backtester' if len(batches) == 1 else 'Backtester %d/%d' % (number + 1, len(batches))
+			with span('report.plot'):
+				plot_equity(figure, dates, {name: curves[name] for name in batch}, title, max_points)
+			for extension in formats:
+				path = os.path.join(out_dir, 'equity_%03d.%s' % (number, extension))
+				with span('report.save', extension):
+					figure.savefig(path, format=extension)
+				paths.append(path)
+	return paths
+
+'''
+write_table function writes rows to a csv or, for a .parquet path, a parquet file (needs pandas
+and pyarrow). Columns are the union of every row's keys in first seen order
+(list) row dicts, (string) path -> None
+'''
+def write_table(rows, path):
+	if not rows:
+		return
+	columns = []
+	for row in rows:
+		columns += [key for key in row if key not in columns]
+	if path.endswith('.parquet'):
+		import pandas as pd
+		pd.DataFrame(rows, columns=columns).to_parquet(path, index=False)
+		return
+	with open(path, 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=columns)
+		writer.writeheader()
+		writer.writerows(rows)
+
+'''
+write_curves function writes the equity curves as one wide table, a date column then one column
+per algo, to a csv or a .parquet path
+(list) dates, (dict) algo name -> values, (string) path -> None
+'''
+def write_curves(dates, curves, path):
+	days = np.asarray(dates, dtype='datetime64[s]').astype('datetime64[D]')
+	if path.endswith('.parquet'):
+		import pandas as pd
+		frame = pd.DataFrame({name: np.asarray(values, dtype=np.float64) for name, values in curves.items()})
+		frame.insert(0, 'date', days)
+		frame.to_parquet(path, index=False)
+		return
+	with open(path, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(['date'] + list(curves))
+		writer.writerows(zip(days.astype(str), *[np.asarray(values, dtype=np.float64).tolist() for values in curves.values()]))
+
+'''
+metrics_rows function returns one row of metrics.summarize per algo
+(list) dates, (dict) algo name -> values -> (list) row dicts
+'''
+def metrics_rows(dates, curves):
+	return [dict(algo=name, **summarize(dates, values)) for name, values in curves.items()]
+
+'''
+export function writes a finished run to out_dir without needing a display:
+	metrics.<table>		one row of metrics per algo
+	equity.<table>		every algo's full equity curve
+	equity_NNN.<format>	the charts, see save_charts
+table is 'csv' or 'parquet', formats are any matplotlib can save ('png', 'svg', 'pdf'...), empty
+for no charts
+(list) dates, (dict) algo name -> values, (string) out_dir, [optional] (tuple) formats, (string) table,
+(int) per_chart, (int) max_points -> (dict) 'metrics', 'curves', 'charts' -> paths written
+'''
+def export(dates, curves, out_dir, formats=('png',), table='csv', per_chart=ALGOS_PER_CHART, max_points=2000):
+	if not dates:
+		raise ValueError('no dates to report, run the backtest with history=True')
+	os.makedirs(out_dir, exist_ok=True)
+	written = {'metrics': os.path.join(out_dir, 'metrics.' + table), 'curves': os.path.join(out_dir, 'equity.' + table)}
+	with span('report.metrics'):
+		write_table(metrics_rows(dates, curves), written['metrics'])
+	with span('report.curves'):
+		write_curves(dates, curves, written['curves'])
+	written['charts'] = save_charts(out_dir, dates, curves, formats, per_chart, max_points) if formats else []
+	return written
@@ -0,0 +1,283 @@
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import bt
+import sweep
+from prices import PriceStore, YahooSource
+from bar_cache import BarCache
+from trading_calendar import nyse_calendar
+from metrics import summarize, summarize_paths
+from portfolio import BUY
+from insider import InsiderFeed
+
+# ---------------------------
+# ROBUSTNESS (WALK-FORWARD AND MONTE CARLO)
+# ---------------------------
+
+# percentiles every simulated metric is reported at
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# metrics the bootstrap reports, the trade order shuffle only changes the path so it reports drawdown
+BOOTSTRAP_METRICS = ('final_value', 'cagr', 'max_drawdown', 'sharpe')
+TRADE_METRICS = ('max_drawdown',)
+
+'''
+walk_forward_windows function splits count sessions into rolling train / test windows of
+session indices, the next window starts step sessions later (by default right after the last
+test window, so the test windows tile the history)
+(int) count, (int) train sessions, (int) test sessions, [optional] (int) step ->
+(list) (train_start, train_end, test_start, test_end) with exclusive ends
+'''
+def walk_forward_windows(count, train, test, step=None):
+	step = step or test
+	windows = []
+	start = 0
+	while start + train + test <= count:
+		windows.append((start, start + train, start + train, start + train + test))
+		start += step
+	return windows
+
+'''
+curve_slice function returns the dates and values of sessions [start, end), beginning at the
+close before start so the first session's return is part of the slice
+'''
+def curve_slice(dates, values, start, end):
+	start = max(start - 1, 0)
+	return dates[start:end], values[start:end]
+
+'''
+trade_returns function turns a portfolio's ledger into one return per closing sell: the trade's
+profit over the average cost of the shares sold (commissions included), as a fraction of the
+portfolio's value before it
+(Portfolio) portfolio, (list) dates, (list) values of its equity curve -> (np.array) returns in trade order
+'''
+def trade_returns(portfolio, dates, values):
+	days = np.array([np.datetime64(date.strftime('%Y-%m-%d'), 'D') for date in dates])
+	held = {}
+	returns = []
+	for day, ticker, side, shares, price, fee in portfolio.ledger.records.tolist():
+		held_shares, cost = held.get(ticker, (0.0, 0.0))
+		if side == BUY:
+			held[ticker] = (held_shares + shares, cost + shares * price + fee)
+			continue
+		average = cost / held_shares if held_shares else price
+		held[ticker] = (held_shares - shares, cost - shares * average)
+		profit = shares * (price - average) - fee
+		row = max(int(np.searchsorted(days, np.datetime64(day, 'D'), side='right')) - 1, 0)
+		before = values[row] - profit
+		if before > 0:
+			returns.append(profit / before)
+	return np.array(returns)
+
+'''
+resample function draws sims bootstrap resamples of returns, each as long as returns. block 1
+draws single days, a larger block draws runs of block consecutive days (wrapping around the end)
+so streaks and short term autocorrelation survive the resampling
+(np.array) returns, (int) sims, (int) block, (np.random.Generator) rng -> (np.array) sims x len(returns)
+'''
+def resample(returns, sims, block, rng):
+	count = len(returns)
+	if block <= 1:
+		return returns[rng.integers(0, count, (sims, count))]
+	blocks = -(-count // block)
+	starts = rng.integers(0, count, (sims, blocks))
+	rows = ((starts[:, :, None] + np.arange(block)) % count).reshape(sims, blocks * block)[:, :count]
+	return returns[rows]
+
+'''
+paths function compounds rows of returns into equity paths that start at start
+(np.array) sims x steps returns, (float) start -> (np.array) sims x (steps + 1) values
+'''
+def paths(returns, start):
+	values = np.empty((len(returns), returns.shape[1] + 1))
+	values[:, 0] = start
+	np.cumprod(1 + returns, axis=1, out=values[:, 1:])
+	values[:, 1:] *= start
+	return values
+
+# memory-mapped return matrices by path, each worker maps a file once and reuses it for every task
+mapped = {}
+
+def load_mapped(path):
+	if path not in mapped:
+		mapped[path] = np.load(path, mmap_mode='r')
+	return mapped[path]
+
+'''
+simulate function is the worker side of monte_carlo, one chunk of simulations of one config.
+The returns are read from the memory-mapped matrix every worker shares, only the metrics
+travel back
+(tuple) path, row, length, kind 'bootstrap' or 'trades', sims, block, seed, years, start ->
+(dict) metric -> np.array of sims values
+'''
+def simulate(task):
+	path, row, length, kind, sims, block, seed, years, start = task
+	returns = np.asarray(load_mapped(path)[row, :length])
+	rng = np.random.default_rng(seed)
+	if kind == 'bootstrap':
+		return summarize_paths(paths(resample(returns, sims, block, rng), start), years)
+	# the same trades in a shuffled order: same end value, a different path to it
+	shuffled = rng.permuted(np.broadcast_to(returns, (sims, length)), axis=1)
+	return summarize_paths(paths(shuffled, start), years)
+
+'''
+distribution function returns the mean, standard deviation and PERCENTILES of samples as
+prefix_mean, prefix_std, prefix_p5... columns
+'''
+def distribution(samples, prefix):
+	result = {prefix + '_mean': float(np.mean(samples)), prefix + '_std': float(np.std(samples))}
+	for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+		result['%s_p%d' % (prefix, percentile)] = float(value)
+	return result
+
+'''
+run_curve function backtests one config over the whole range inside a worker (the data comes
+from sweep.init_worker) and returns its equity curve and trade returns
+(tuple) start, end, params, starting_wallet, lookback_days -> (tuple) name, dates, values, trade returns
+'''
+def run_curve(task):
+	start, end, params, starting_wallet, lookback_days = task
+	name = sweep.config_name(params)
+	algo = bt.Algo(name, bt.make_cluster_engine(**params))
+	backtester = bt.Backtester(start, end, [algo], starting_wallet, store=sweep.worker_data['store'], calendar=sweep.worker_data['calendar'], lookback_days=lookback_days, insider_feed=sweep.worker_data['insider_feed'], tradability=sweep.worker_data['tradability'], prefetch=False)
+	with sweep.worker_output():
+		backtester.backtest()
+	values = np.array(backtester.portfolio_values[name])
+	return name, backtester.dates, values, trade_returns(backtester.portfolios[name], backtester.dates, values)
+
+'''
+walk_forward function picks, on every train window, the config ranking best by rank_by and
+scores that pick on the test window right after it. The windows are slices of each config's one
+continuous run, so a window starts with whatever the config held at that point, as it would
+when switching configs live. The picks' test sessions chained together make the out of sample
+curve, started at the runs' starting value and summarized in the last row (window 'all')
+(list) dates, (dict) name -> values, (int) train, test sessions, [optional] (int) step, (string) rank_by ->
+(list) row per window
+'''
+def walk_forward(dates, curves, train, test, step=None, rank_by='sharpe'):
+	names = list(curves)
+	sign = 1 if rank_by == 'max_drawdown' else -1
+	rows = []
+	chained = []
+	windows = walk_forward_windows(len(dates), train, test, step)
+	for number, (train_start, train_end, test_start, test_end) in enumerate(windows):
+		trained = [summarize(*curve_slice(dates, curves[name], train_start, train_end)) for name in names]
+		tested = [summarize(*curve_slice(dates, curves[name], test_start, test_end)) for name in names]
+		pick = min(range(len(names)), key=lambda i: sign * trained[i][rank_by])
+		# where the pick lands among every config on the test window, 1 is the best
+		rank = 1 + sorted(range(len(names)), key=lambda i: sign * tested[i][rank_by]).index(pick)
+		row = {'window': number, 'train_start': dates[train_start], 'train_end': dates[train_end - 1], 'test_start': dates[test_start], 'test_end': dates[test_end - 1], 'pick': names[pick], 'train_' + rank_by: trained[pick][rank_by]}
+		row.update({'test_' + key: value for key, value in tested[pick].items()})
+		row['test_rank'] = rank
+		row['configs'] = len(names)
+		rows.append(row)
+		# overlapping test windows only add the sessions before the next window's test starts
+		stop = min(test_end, windows[number + 1][2]) if number + 1 < len(windows) else test_end
+		values = np.asarray(curves[names[pick]], dtype=np.float64)
+		chained.append(values[test_start:stop] / values[test_start - 1:stop - 1] - 1)
+	if chained:
+		returns = np.concatenate(chained)
+		first = windows[0][2]
+		row = {'window': 'all', 'test_start': dates[first], 'test_end': dates[first + len(returns) - 1]}
+		row.update({'test_' + key: value for key, value in summarize(dates[first - 1:first + len(returns)], paths(returns[None, :], curves[names[0]][0])[0]).items()})
+		rows.append(row)
+	return rows
+
+'''
+monte_carlo function runs sims simulations of every curve across the pool, in chunks of chunk
+simulations: bootstrap resamples of its daily returns and shuffles of its trade order. Both
+return matrices are written once to a memory-mapped file that every worker maps instead of
+getting its own copy. Seeds come from one SeedSequence, so the results do not depend on the
+number of processes
+(ProcessPoolExecutor) pool, (list) dates, (dict) name -> values, (dict) name -> trade returns,
+[optional] (int) sims, (int) block, (int) chunk, (int) seed -> (dict) name -> distribution columns
+'''
+def monte_carlo(pool, dates, curves, trades, sims=10000, block=5, chunk=2500, seed=0):
+	names = list(curves)
+	years = (dates[-1] - dates[0]).days / 365.25
+	results = {name: {} for name in names}
+	with tempfile.TemporaryDirectory(prefix='robustness') as directory:
+		jobs = []
+		for kind, series in (('bootstrap', {name: np.diff(curves[name]) / curves[name][:-1] for name in names}), ('trades', trades)):
+			width = max([len(returns) for returns in series.values()] + [1])
+			matrix = np.full((len(names), width), np.nan)
+			for row, name in enumerate(names):
+				matrix[row, :len(series[name])] = series[name]
+			path = os.path.join(directory, kind + '.npy')
+			np.save(path, matrix)
+			for row, name in enumerate(names):
+				# a curve needs two returns to resample, a shuffle two trades to change anything
+				if len(series[name]) < 2:
+					continue
+				jobs += [(name, path, row, len(series[name]), kind, min(chunk, sims - offset)) for offset in range(0, sims, chunk)]
+		seeds = np.random.SeedSequence(seed).spawn(len(jobs))
+		tasks = [(path, row, length, kind, count, block, seeds[i], years, curves[name][0]) for i, (name, path, row, length, kind, count) in enumerate(jobs)]
+		samples = {}
+		for job, metrics in zip(jobs, pool.map(simulate, tasks)):
+			for metric, values in metrics.items():
+				samples.setdefault((job[0], job[4], metric), []).append(values)
+	for (name, kind, metric), chunks in samples.items():
+		if metric not in (BOOTSTRAP_METRICS if kind == 'bootstrap' else TRADE_METRICS):
+			continue
+		values = np.concatenate(chunks)
+		results[name].update(distribution(values, kind + '_' + metric))
+		if metric == 'final_value' and kind == 'bootstrap':
+			results[name]['bootstrap_prob_loss'] = float(np.mean(values < curves[name][0]))
+	return results
+
+'''
+run_robustness function backtests every ClusterEngine config in configs once over [start, end),
+then walk-forwards over train / test windows of those runs and runs sims Monte Carlo
+simulations of each (see walk_forward and monte_carlo). Prices and screens are loaded once in
+the parent and shared with the workers like run_sweep does. Writes one row per config (its
+whole run metrics plus the simulated distributions) to out_path and the walk-forward windows
+to walk_forward_path, csv or .parquet
+(list) configs from sweep.grid(), (string) start, end as m-d-Y, [optional] (int) starting_wallet,
+(int) processes, (int) train, test, step sessions, (int) sims, (int) block, (string) rank_by,
+(PriceStore) store, (int) lookback_days, (InsiderFeed) insider_feed, (TradabilityService) tradability,
+(string) out_path, walk_forward_path, (int) seed -> (dict) 'configs', 'walk_forward' -> (list) rows
+'''
+def run_robustness(configs, start, end, starting_wallet=2000, processes=None, train=63, test=21, step=None, sims=10000, block=5, rank_by='sharpe', store=None, lookback_days=30, insider_feed=None, tradability=None, out_path='robustness_results.csv', walk_forward_path='walk_forward_results.csv', seed=0):
+	start_date = datetime.strptime(start, '%m-%d-%Y')
+	end_date = datetime.strptime(end, '%m-%d-%Y')
+	store = store if store is not None else PriceStore(BarCache(YahooSource()))
+	store.set_range(start_date - timedelta(days=lookback_days), end_date)
+	calendar = nyse_calendar()
+	tradability = tradability if tradability is not None else bt.tradability
+	sweep.prefetch_screens(configs, calendar.between(start_date, end_date), store, insider_feed, tradability)
+
+	tasks = [(start, end, params, starting_wallet, lookback_days) for params in configs]
+	processes = processes or os.cpu_count()
+	curves = {}
+	trades = {}
+	dates = []
+	with tempfile.TemporaryDirectory(prefix='robustness') as directory:
+		shared = store.share(os.path.join(directory, 'prices'))
+		with ProcessPoolExecutor(max_workers=processes, initializer=sweep.init_worker, initargs=(shared, calendar, insider_feed, tradability, dict(bt.openinsider_cache), True)) as pool:
+			for name, dates, values, returns in pool.map(run_curve, tasks, chunksize=max(1, len(tasks) // (processes * 4))):
+				curves[name] = values
+				trades[name] = returns
+				print('%d/%d' % (len(curves), len(tasks)), name)
+			simulated = monte_carlo(pool, dates, curves, trades, sims, block, seed=seed)
+
+	rows = []
+	for params, name in zip(configs, curves):
+		row = {'name': name}
+		row.update(params)
+		row.update(summarize(dates, curves[name]))
+		row['trades'] = len(trades[name])
+		row.update(simulated[name])
+		rows.append(row)
+	windows = walk_forward(dates, curves, train, test, step, rank_by)
+	sweep.write_results(rows, out_path)
+	sweep.write_results(windows, walk_forward_path)
+	return {'configs': rows, 'walk_forward': windows}
+
+if __name__ == '__main__':
+	configs = sweep.grid(window=[2, 3, 4], max_price=[5, 10], stop_loss=[0.05, 0.08], stop_gain=[0.02, 0.05])
+	feed = InsiderFeed.download(datetime(2020, 12, 28), datetime(2021, 12, 31))
+	results = run_robustness(configs, '1-04-2021', '12-31-2021', insider_feed=feed)
+	for row in results['walk_forward']:
+		print(row['window'], row.get('pick', ''), round(row['test_sharpe'], 3), row.get('test_rank', ''))
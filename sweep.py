@@ -0,0 +1,187 @@
+import os
+import itertools
+import tempfile
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import bt
+from prices import PriceStore, YahooSource
+from bar_cache import BarCache
+from trading_calendar import nyse_calendar
+from metrics import summarize
+from report import write_table
+from insider import InsiderFeed
+
+# ---------------------------
+# PARAMETER SWEEP
+# ---------------------------
+
+'''
+grid function expands lists of ClusterEngine params into every combination
+grid(window=[2, 3], max_price=[5, 10]) -> [{'window': 2, 'max_price': 5}, ...]
+'''
+def grid(**axes):
+	return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+
+def config_name(params):
+	return ' '.join('%s=%s' % (key, getattr(value, '__name__', value)) for key, value in params.items())
+
+# store, calendar, insider feed and screener answers handed to each worker process once, shared by every config it runs
+worker_data = {}
+
+def init_worker(store, calendar, insider_feed, tradability, screens, quiet):
+	bt.openinsider_cache.update(screens)
+	worker_data['store'] = store
+	worker_data['calendar'] = calendar
+	worker_data['insider_feed'] = insider_feed
+	worker_data['tradability'] = tradability
+	worker_data['quiet'] = quiet
+
+'''
+worker_output function is what a worker task prints to, nowhere when the pool is quiet: the per
+day and per trade prints of hundreds of configs are just noise there
+'''
+@contextlib.contextmanager
+def worker_output():
+	if not worker_data.get('quiet'):
+		yield
+		return
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		yield
+
+'''
+run_config function backtests one ClusterEngine config inside a worker up to until, starting
+from state (the portfolio, dates and values it stopped at last time) when given, so run_sweep
+can run it one rung at a time. With prune_drawdown set the run also stops as soon as the equity
+curve falls that far from its peak
+(tuple) start, end, params, starting_wallet, lookback_days, prune_drawdown, (datetime) until, state ->
+(tuple) (dict) result row, state to carry on from
+'''
+def run_config(task):
+	start, end, params, starting_wallet, lookback_days, prune_drawdown, until, state = task
+	name = config_name(params)
+	algo = bt.Algo(name, bt.make_cluster_engine(**params))
+	backtester = bt.Backtester(start, end, [algo], starting_wallet, store=worker_data['store'], calendar=worker_data['calendar'], lookback_days=lookback_days, insider_feed=worker_data['insider_feed'], tradability=worker_data['tradability'], prefetch=False)
+	if state is not None:
+		backtester.portfolios[name], backtester.dates, backtester.portfolio_values[name], backtester.last_date = state
+	values = backtester.portfolio_values[name]
+	peak = max(values) if values else 0
+	pruned = False
+	with worker_output():
+		for date, day_values in backtester.iter_days(until):
+			if values:
+				peak = max(peak, values[-1])
+				if prune_drawdown is not None and peak > 0 and 1 - values[-1] / peak > prune_drawdown:
+					pruned = True
+					break
+	result = {'name': name}
+	result.update(params)
+	result.update(summarize(backtester.dates[:len(values)], values))
+	result['sessions'] = len(values)
+	result['pruned'] = pruned
+	return result, (backtester.portfolios[name], backtester.dates, values, backtester.last_date)
+
+'''
+rung_ends function splits the sessions into rungs equal runs and returns the (exclusive) end
+date of each, the last one is end
+(list) sessions, (int) rungs, (datetime) end -> (list) datetimes
+'''
+def rung_ends(sessions, rungs, end):
+	rungs = max(1, min(rungs, len(sessions)))
+	return [sessions[len(sessions) * rung // rungs] for rung in range(1, rungs)] + [end]
+
+'''
+survivors function picks the configs that go on to the next rung: every config not pruned yet is
+ranked by rank_by on its curve so far and the best keep fraction of them (at least one) survive
+(dict) name -> result row, (string) rank_by, (float) keep -> (set) names
+'''
+def survivors(results, rank_by, keep):
+	alive = [name for name, result in results.items() if not result['pruned']]
+	sign = 1 if rank_by == 'max_drawdown' else -1
+	alive.sort(key=lambda name: sign * results[name][rank_by])
+	return set(alive[:max(1, int(np.ceil(len(alive) * keep)))])
+
+'''
+prefetch_screens function runs every screen the configs will ask for once in the parent and
+loads the prices of the tickers they return, so the worker processes read them from the file
+run_sweep shares instead of each fetching their own copy. Without an insider feed the distinct screener pages are
+downloaded concurrently, the prices go out as one batch and the tickers are checked for
+tradability as one batch, with tradability or else the module level service
+'''
+def prefetch_screens(configs, sessions, store, insider_feed=None, tradability=None):
+	engines = [bt.make_cluster_engine(**params) for params in configs]
+	tickers = ['spy']
+	if insider_feed is None:
+		tickers += [screen.tickers[0] for screen in bt.prefetch_openinsider(engine.screen_url(date) for engine in engines for date in sessions).values() if len(screen.tickers)]
+	else:
+		for engine in engines:
+			for date in sessions:
+				tickers += insider_feed.screen(date - timedelta(days=engine.window), date, engine.min_price, engine.max_price, engine.min_value, engine.min_insiders)[:1]
+	store.load(tickers)
+	(tradability if tradability is not None else bt.tradability).check_many(tickers)
+
+'''
+run_sweep function backtests every ClusterEngine config in configs across a process pool and
+writes the results, ranked best first, to a csv (or parquet, see write_results)
+(list) configs from grid(), (string) start, end as m-d-Y, [optional] (int) starting_wallet,
+(int) processes, (string) out_path, (string) rank_by metric, (float) prune_drawdown,
+(PriceStore) store, (int) lookback_days, (bool) quiet, (InsiderFeed) insider_feed,
+(TradabilityService) tradability, (int) rungs, (float) keep -> (list) result dicts, ranked
+With an insider_feed every screen is answered in memory, without one each distinct screener
+page is downloaded once up front. Weak configs are stopped early by successive halving: the
+sessions are split into rungs equal parts, every config runs the first part, and after each
+part only the best keep fraction (by rank_by so far) runs the next one. With rungs 3 and keep
+0.5 a sweep costs about 0.58 of running every config to the end. rungs 1 runs them all to the
+end. prune_drawdown also stops any config whose curve falls that far from its peak
+'''
+def run_sweep(configs, start, end, starting_wallet=2000, processes=None, out_path='sweep_results.csv', rank_by='sharpe', prune_drawdown=None, store=None, lookback_days=30, quiet=True, insider_feed=None, tradability=None, rungs=1, keep=0.5):
+	start_date = datetime.strptime(start, '%m-%d-%Y')
+	end_date = datetime.strptime(end, '%m-%d-%Y')
+	store = store if store is not None else PriceStore(BarCache(YahooSource()))
+	store.set_range(start_date - timedelta(days=lookback_days), end_date)
+	calendar = nyse_calendar()
+	sessions = calendar.between(start_date, end_date)
+	# the workers get the service the prefetch filled in, not each a fresh one asking again
+	tradability = tradability if tradability is not None else bt.tradability
+	prefetch_screens(configs, sessions, store, insider_feed, tradability)
+
+	processes = processes or os.cpu_count()
+	results = {}
+	states = {config_name(params): None for params in configs}
+	alive = set(states)
+	ends = rung_ends(sessions, rungs, end_date)
+	with tempfile.TemporaryDirectory(prefix='sweep') as directory:
+		# the workers map one file of the prefetched prices instead of each unpickling the store
+		shared = store.share(os.path.join(directory, 'prices'))
+		with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(shared, calendar, insider_feed, tradability, dict(bt.openinsider_cache), quiet)) as pool:
+			for rung, until in enumerate(ends):
+				tasks = [(start, end, params, starting_wallet, lookback_days, prune_drawdown, until, states[config_name(params)]) for params in configs if config_name(params) in alive]
+				chunksize = max(1, len(tasks) // (processes * 4))
+				for done, (result, state) in enumerate(pool.map(run_config, tasks, chunksize=chunksize)):
+					results[result['name']] = result
+					states[result['name']] = state
+					print('rung %d/%d' % (rung + 1, len(ends)), '%d/%d' % (done + 1, len(tasks)), result['name'], round(result[rank_by], 4), 'pruned' if result['pruned'] else '')
+				if rung + 1 < len(ends):
+					alive = survivors(results, rank_by, keep)
+					for name, result in results.items():
+						result['pruned'] = result['pruned'] or name not in alive
+
+	# pruned configs rank below every finished one and the longer they ran the higher, drawdown ranks low to high
+	sign = 1 if rank_by == 'max_drawdown' else -1
+	results = sorted(results.values(), key=lambda result: (result['pruned'], -result['sessions'], sign * result[rank_by]))
+	write_results(results, out_path)
+	return results
+
+'''
+write_results function writes the ranked results to out_path, a csv or a .parquet file
+'''
+def write_results(results, out_path):
+	write_table([{key: getattr(value, '__name__', value) for key, value in result.items()} for result in results], out_path)
+
+if __name__ == '__main__':
+	configs = grid(window=[0, 2, 3, 4], max_price=[5, 10, 50], min_insiders=[None, 3], stop_loss=[0.05, 0.08], stop_gain=[0.02, 0.05, 0.1])
+	feed = InsiderFeed.download(datetime(2021, 1, 11), datetime(2021, 3, 5))
+	results = run_sweep(configs, '1-15-2021', '3-05-2021', prune_drawdown=0.3, insider_feed=feed, rungs=3)
+	for result in results[:10]:
+		print(result['name'], result['final_value'], result['sharpe'])
@@ -0,0 +1,66 @@
+import os
+import sys
+import pytest
+from datetime import datetime, timedelta
+
+# the modules live at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench
+from prices import Bars, FIELDS, PriceStore, MemorySource, to_day
+from trading_calendar import nyse_calendar
+from tradability import TradabilityService
+
+# ---------------------------
+# FIXTURE DATASET
+# ---------------------------
+
+START = datetime(2020, 9, 1)
+END = datetime(2020, 12, 31)
+LOOKBACK_DAYS = 30
+
+'''
+drop_bar function returns bars without the row of day, a halt or a gap in the data
+(Bars) bars, (datetime) day -> Bars
+'''
+def drop_bar(bars, day):
+	keep = bars.dates != to_day(day)
+	return Bars(bars.dates[keep], {field: bars.columns[field][keep] for field in FIELDS})
+
+def fixture_sessions():
+	calendar = nyse_calendar()
+	return calendar.sessions[(calendar.sessions >= to_day(START - timedelta(days=LOOKBACK_DAYS))) & (calendar.sessions < to_day(END))]
+
+'''
+fixture_bars function builds the fixture dataset: bench's synthetic bars for the named tickers
+and 20 more over START - LOOKBACK_DAYS to END, with one missing msft bar and one missing spy
+bar in the middle of the run. The insider filings are made before the bars are dropped
+[optional] (list) missing days -> (dict) ticker -> Bars, InsiderFeed
+'''
+def fixture_data(missing=(datetime(2020, 10, 15), datetime(2020, 11, 10))):
+	sessions = fixture_sessions()
+	bars = bench.synthetic_bars(bench.NAMED_TICKERS + ['t%04d' % i for i in range(20)], sessions, seed=3)
+	feed = bench.synthetic_filings(bars, sessions, 5, seed=3)
+	for ticker, day in zip(('msft', 'spy'), missing):
+		bars[ticker] = drop_bar(bars[ticker], day)
+	return bars, feed
+
+@pytest.fixture
+def data():
+	return fixture_data()
+
+@pytest.fixture
+def bars(data):
+	return data[0]
+
+@pytest.fixture
+def feed(data):
+	return data[1]
+
+@pytest.fixture
+def make_store(bars):
+	return lambda: PriceStore(MemorySource(bars))
+
+@pytest.fixture
+def offline_tradability():
+	return lambda: TradabilityService(cache_path=None, offline=True)
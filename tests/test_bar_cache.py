@@ -0,0 +1,126 @@
+import os
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+import bar_cache
+from bar_cache import BarCache, settled_end
+from prices import MemorySource
+
+'''
+CountingSource is a MemorySource that remembers every range it was asked for
+'''
+class CountingSource(MemorySource):
+	def __init__(self, bars):
+		super().__init__(bars)
+		self.asked = []
+
+	def fetch(self, ticker, start, end):
+		self.asked.append((ticker, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+		return super().fetch(ticker, start, end)
+
+@pytest.fixture
+def source(bars):
+	return CountingSource(bars)
+
+def test_fetch_only_asks_for_the_gaps(source, bars, tmp_path):
+	cache = BarCache(source, cache_dir=str(tmp_path))
+	cache.fetch('msft', datetime(2020, 10, 1), datetime(2020, 11, 1))
+	cache.fetch('msft', datetime(2020, 11, 15), datetime(2020, 12, 1))
+	source.asked.clear()
+	got = cache.fetch('msft', datetime(2020, 9, 15), datetime(2020, 12, 15))
+	# the three holes around the two cached ranges, nothing already on disk
+	assert source.asked == [('msft', '2020-09-15', '2020-10-01'), ('msft', '2020-11-01', '2020-11-15'), ('msft', '2020-12-01', '2020-12-15')]
+	expected = bars['msft'].between(datetime(2020, 9, 15), datetime(2020, 12, 15))
+	np.testing.assert_array_equal(got.dates, expected.dates)
+	np.testing.assert_array_equal(got.columns['close'], expected.columns['close'])
+	assert cache.read_index()['msft']['ranges'] == [['2020-09-15', '2020-12-15']]
+	source.asked.clear()
+	cache.fetch('msft', datetime(2020, 10, 5), datetime(2020, 12, 1))
+	assert source.asked == []
+
+def test_fetch_many_batches_the_gaps(source, tmp_path):
+	cache = BarCache(source, cache_dir=str(tmp_path))
+	cache.fetch('spy', datetime(2020, 10, 1), datetime(2020, 11, 1))
+	source.asked.clear()
+	results = cache.fetch_many(['spy', 'msft', 'nope'], datetime(2020, 10, 1), datetime(2020, 11, 1))
+	assert sorted(source.asked) == [('msft', '2020-10-01', '2020-11-01'), ('nope', '2020-10-01', '2020-11-01')]
+	assert len(results['spy']) and len(results['msft'])
+	# an upstream error comes back for that ticker and its range stays uncovered
+	assert isinstance(results['nope'], KeyError)
+	assert cache.read_index()['nope']['ranges'] == []
+
+def test_settled_end():
+	# 16:00 in new york is before the bar settles, 19:30 after it and 23:00 is still the same
+	# day there, an hour earlier each without a tz database
+	assert settled_end(datetime(2020, 7, 1, 20, 0, tzinfo=timezone.utc)) == '2020-07-01'
+	assert settled_end(datetime(2020, 7, 1, 23, 30, tzinfo=timezone.utc)) == '2020-07-02'
+	assert settled_end(datetime(2020, 7, 2, 3, 0, tzinfo=timezone.utc)) == '2020-07-02'
+
+def test_unsettled_days_are_asked_again(source, tmp_path, monkeypatch):
+	# as if today were 2020-11-16 before the close had settled
+	monkeypatch.setattr(bar_cache, 'settled_end', lambda: '2020-11-16')
+	cache = BarCache(source, cache_dir=str(tmp_path))
+	first = cache.fetch('spy', datetime(2020, 11, 2), datetime(2020, 11, 17))
+	assert cache.read_index()['spy']['ranges'] == [['2020-11-02', '2020-11-16']]
+	# the partial day is kept, but the next fetch asks for it again
+	assert first.dates[-1] == np.datetime64('2020-11-16')
+	source.asked.clear()
+	cache.fetch('spy', datetime(2020, 11, 2), datetime(2020, 11, 17))
+	assert source.asked == [('spy', '2020-11-16', '2020-11-17')]
+	monkeypatch.setattr(bar_cache, 'settled_end', lambda: '2020-11-17')
+	cache.fetch('spy', datetime(2020, 11, 2), datetime(2020, 11, 17))
+	source.asked.clear()
+	cache.fetch('spy', datetime(2020, 11, 2), datetime(2020, 11, 17))
+	assert source.asked == []
+
+def test_evicts_least_recently_used_but_keeps_the_batch(source, tmp_path):
+	start, end = datetime(2020, 10, 1), datetime(2020, 11, 1)
+	cache = BarCache(source, cache_dir=str(tmp_path))
+	cache.fetch('spy', start, end)
+	size = cache.read_index()['spy']['bytes']
+	# room for two tickers' bars
+	cache.max_bytes = 2 * size
+	cache.fetch('msft', start, end)
+	cache.fetch('spy', start, end)
+	cache.fetch('arkk', start, end)
+	index = cache.read_index()
+	# msft was used the longest ago
+	assert sorted(index) == ['arkk', 'spy']
+	assert not os.path.exists(cache.path('msft'))
+	# a batch bigger than the cache keeps every ticker it asked for
+	cache.fetch_many(['t0001', 't0002', 't0003'], start, end)
+	assert sorted(cache.read_index()) == ['t0001', 't0002', 't0003']
+
+@pytest.mark.skipif(bar_cache.fcntl is None, reason='no flock')
+def test_index_is_written_under_the_lock(source, tmp_path, monkeypatch):
+	cache = BarCache(source, cache_dir=str(tmp_path))
+	write_index = cache.write_index
+	held = []
+
+	def checked(index):
+		# another open of the lock file cannot take it while the index is written
+		with open(os.path.join(cache.cache_dir, '.lock'), 'a') as lock:
+			try:
+				bar_cache.fcntl.flock(lock, bar_cache.fcntl.LOCK_EX | bar_cache.fcntl.LOCK_NB)
+				held.append(False)
+				bar_cache.fcntl.flock(lock, bar_cache.fcntl.LOCK_UN)
+			except BlockingIOError:
+				held.append(True)
+		write_index(index)
+	monkeypatch.setattr(cache, 'write_index', checked)
+	cache.fetch('spy', datetime(2020, 10, 1), datetime(2020, 11, 1))
+	assert held == [True]
+
+def test_concurrent_fetches_keep_every_ticker(source, tmp_path):
+	tickers = ['t%04d' % i for i in range(12)]
+	caches = [BarCache(source, cache_dir=str(tmp_path)) for _ in tickers]
+	threads = [threading.Thread(target=cache.fetch, args=(ticker, datetime(2020, 10, 1), datetime(2020, 11, 1))) for cache, ticker in zip(caches, tickers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	# each commit read the index again under the lock, no write lost another's ticker
+	index = caches[0].read_index()
+	assert sorted(index) == tickers
+	assert all(index[ticker]['ranges'] == [['2020-10-01', '2020-11-01']] for ticker in tickers)
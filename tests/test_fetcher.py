@@ -0,0 +1,156 @@
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import prices
+from fetcher import AsyncFetcher, FetchError
+
+# ---------------------------
+# LOCAL STAND-IN SERVER
+# ---------------------------
+
+'''
+StandIn class. A local http server whose paths answer like a struggling remote one:
+	/ok/<name>				200 with the name as the body
+	/flaky/<n>/<name>		503 for the first n requests of that path, then 200
+	/limited/<name>			429 with Retry-After 0 the first time, then 200
+	/missing/<name>			404, never worth asking again
+	/slow/<name>			200 after 50ms, to count the requests in flight
+	/chart/<TICKER>			a yahoo chart api answer with two bars, 503 the first time
+hits counts the requests per path and peak the most in flight at once
+'''
+class StandIn:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.hits = {}
+		self.in_flight = 0
+		self.peak = 0
+		stand_in = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				status, body, headers = stand_in.answer(self.path)
+				self.send_response(status)
+				for key, value in headers.items():
+					self.send_header(key, value)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.server.daemon_threads = True
+		self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+		self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.02}, daemon=True)
+		self.thread.start()
+
+	def answer(self, path):
+		with self.lock:
+			self.hits[path] = hit = self.hits.get(path, 0) + 1
+			self.in_flight += 1
+			self.peak = max(self.peak, self.in_flight)
+		try:
+			parts = path.split('?')[0].strip('/').split('/')
+			if parts[0] == 'flaky' and hit <= int(parts[1]):
+				return 503, b'busy', {}
+			if parts[0] == 'limited' and hit == 1:
+				return 429, b'slow down', {'Retry-After': '0'}
+			if parts[0] == 'missing':
+				return 404, b'no such page', {}
+			if parts[0] == 'slow':
+				time.sleep(0.05)
+			if parts[0] == 'chart':
+				if hit == 1:
+					return 503, b'busy', {}
+				return 200, chart_body(), {}
+			return 200, parts[-1].encode(), {}
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def chart_body():
+	# two sessions, timestamps at the open in utc like the real api
+	return json.dumps({'chart': {'result': [{
+		'timestamp': [1604327400, 1604413800],
+		'indicators': {
+			'quote': [{'open': [10.0, 11.0], 'high': [12.0, 12.5], 'low': [9.5, 10.5], 'close': [11.0, 12.0], 'volume': [1000, 2000]}],
+			'adjclose': [{'adjclose': [11.0, 12.0]}],
+		},
+	}]}}).encode()
+
+@pytest.fixture
+def server():
+	stand_in = StandIn()
+	yield stand_in
+	stand_in.close()
+
+@pytest.fixture(params=['aiohttp', 'requests'])
+def backend(request, monkeypatch):
+	if request.param == 'aiohttp':
+		pytest.importorskip('aiohttp')
+	else:
+		# the fallback path, what runs wherever aiohttp is not installed
+		monkeypatch.setitem(sys.modules, 'aiohttp', None)
+	return request.param
+
+# ---------------------------
+# TESTS
+# ---------------------------
+
+def test_retries_5xx_until_it_answers(server, backend):
+	fetcher = AsyncFetcher(retries=3, backoff=0.01)
+	bodies = fetcher.fetch_all([server.url + '/flaky/2/a', server.url + '/ok/b'])
+	assert bodies == [b'a', b'b']
+	assert server.hits['/flaky/2/a'] == 3
+
+def test_gives_up_after_the_retries(server, backend):
+	fetcher = AsyncFetcher(retries=2, backoff=0.01)
+	body, = fetcher.fetch_all([server.url + '/flaky/5/a'])
+	assert isinstance(body, FetchError) and body.status == 503
+	assert server.hits['/flaky/5/a'] == 3
+
+def test_429_waits_retry_after(server, backend):
+	# a long backoff the test would notice, Retry-After 0 has to win over it
+	fetcher = AsyncFetcher(retries=1, backoff=5)
+	started = time.monotonic()
+	assert fetcher.fetch_all([server.url + '/limited/a']) == [b'a']
+	assert time.monotonic() - started < 2
+	assert server.hits['/limited/a'] == 2
+
+def test_4xx_is_not_retried(server, backend):
+	fetcher = AsyncFetcher(retries=3, backoff=0.01)
+	body, = fetcher.fetch_all([server.url + '/missing/a'])
+	assert isinstance(body, FetchError) and body.status == 404
+	assert server.hits['/missing/a'] == 1
+
+def test_concurrency_cap(server, backend):
+	fetcher = AsyncFetcher(concurrency=3)
+	urls = [server.url + '/slow/%d' % i for i in range(12)]
+	assert fetcher.fetch_all(urls) == [str(i).encode() for i in range(12)]
+	# capped, and the cap was actually reached, the batch did not run one at a time
+	assert server.peak == 3
+
+def test_backoff_doubles_with_jitter():
+	fetcher = AsyncFetcher(backoff=0.5)
+	for attempt in range(4):
+		delay = fetcher.delay(attempt)
+		assert 0.5 * 2 ** attempt <= delay <= 0.75 * 2 ** attempt
+	assert fetcher.delay(3, '2') == 2.0
+
+def test_yahoo_fetch_many_parses_the_chart_api(server, backend, monkeypatch):
+	monkeypatch.setattr(prices, 'YAHOO_CHART_URL', server.url + '/chart/')
+	source = prices.YahooSource(AsyncFetcher(backoff=0.01))
+	results = source.fetch_many(['spy', 'msft'], datetime(2020, 11, 1), datetime(2020, 11, 5))
+	for ticker in ('spy', 'msft'):
+		bars = results[ticker]
+		assert bars.dates.astype(str).tolist() == ['2020-11-02', '2020-11-03']
+		assert bars.columns['close'].tolist() == [11.0, 12.0]
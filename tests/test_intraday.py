@@ -0,0 +1,72 @@
+import pickle
+from datetime import datetime
+import numpy as np
+from intraday import IntradayStore, INTRADAY_DTYPE, first_crossings
+
+'''
+minutes function builds one session of minute bars from (open, high, low, close) rows starting at 9:30
+(string) day, (list) rows -> (np.array) INTRADAY_DTYPE records
+'''
+def minutes(day, rows):
+	records = np.empty(len(rows), dtype=INTRADAY_DTYPE)
+	records['time'] = np.datetime64(day + 'T09:30', 'm') + np.arange(len(rows))
+	for field, values in zip(('open', 'high', 'low', 'close'), zip(*rows)):
+		records[field] = values
+	records['volume'] = 1000
+	return records
+
+# held at 100 with a 5% stop each way: 95 and 105
+GAIN_FIRST = minutes('2020-11-02', [(100, 101, 99, 100), (101, 106, 100, 104), (104, 104, 90, 91)])
+LOSS_ONLY = minutes('2020-11-02', [(100, 102, 99, 99), (99, 100, 94, 96), (96, 97, 95.5, 96)])
+GAP_DOWN = minutes('2020-11-02', [(93, 94, 92, 93), (93, 110, 93, 109)])
+NEITHER = minutes('2020-11-02', [(100, 104, 96, 101)])
+
+def test_gain_before_loss_in_the_same_session():
+	exited, prices = first_crossings([GAIN_FIRST], [95.0], [105.0])
+	# the later bar reaching 90 does not matter, the gain was hit a minute before
+	assert exited.tolist() == [True]
+	assert prices.tolist() == [105.0]
+
+def test_only_the_loss():
+	exited, prices = first_crossings([LOSS_ONLY, GAP_DOWN, NEITHER], [95.0] * 3, [105.0] * 3)
+	assert exited.tolist() == [True, True, False]
+	# at the level, at the open of a bar that gapped past it, and not at all
+	assert prices[:2].tolist() == [95.0, 93.0]
+	assert np.isnan(prices[2])
+
+def test_one_bar_reaching_both_levels_is_a_loss():
+	exited, prices = first_crossings([minutes('2020-11-02', [(100, 106, 94, 100)])], [95.0], [105.0])
+	assert exited.tolist() == [True] and prices.tolist() == [95.0]
+
+def test_store_round_trip(tmp_path):
+	store = IntradayStore(str(tmp_path))
+	records = np.concatenate([minutes('2020-11-03', [(1, 2, 0.5, 1.5), (1.5, 2, 1, 1)]), GAIN_FIRST])
+	# written out of order, read back sorted and split by session
+	shuffled = records[[3, 0, 4, 2, 1]]
+	store.write('SPY', shuffled['time'], {field: shuffled[field] for field in ('open', 'high', 'low', 'close', 'volume')})
+	assert store.has('spy')
+	first = store.session('spy', datetime(2020, 11, 2))
+	assert first.tolist() == GAIN_FIRST.tolist()
+	# a view into the mapped file, not a copy
+	assert isinstance(first, np.memmap)
+	assert len(store.session('spy', datetime(2020, 11, 3))) == 2
+	assert len(store.session('spy', datetime(2020, 11, 4))) == 0
+	assert len(store.session('msft', datetime(2020, 11, 2))) == 0
+	# a pickled store maps the files again on its own
+	copy = pickle.loads(pickle.dumps(store))
+	assert len(copy.maps) == 0
+	assert copy.session('spy', datetime(2020, 11, 3)).tolist() == records[:2].tolist()
+	covered, exited, prices = copy.stop_exits(['spy', 'msft'], datetime(2020, 11, 2), [95.0, 95.0], [105.0, 105.0])
+	assert covered.tolist() == [True, False]
+	assert exited.tolist() == [True, False]
+	assert prices[0] == 105.0 and np.isnan(prices[1])
+
+def test_least_recently_used_ticker_is_unmapped(tmp_path):
+	store = IntradayStore(str(tmp_path), max_open=2)
+	for ticker in ('a', 'b', 'c'):
+		store.write(ticker, GAIN_FIRST['time'], {field: GAIN_FIRST[field] for field in ('open', 'high', 'low', 'close', 'volume')})
+	store.session('a', datetime(2020, 11, 2))
+	store.session('b', datetime(2020, 11, 2))
+	store.session('a', datetime(2020, 11, 2))
+	store.session('c', datetime(2020, 11, 2))
+	assert list(store.maps) == ['a', 'c']
@@ -0,0 +1,66 @@
+from datetime import datetime
+import pytest
+from trading_calendar import TradingCalendar, nyse_calendar, easter
+
+# NYSE's published number of sessions per year
+SESSIONS_PER_YEAR = {2001: 248, 2012: 250, 2018: 251, 2019: 252, 2020: 253, 2021: 252, 2022: 251, 2023: 250, 2024: 252, 2025: 250}
+
+CLOSED = [
+	'2020-07-03', # independence day on a saturday, observed friday
+	'2021-07-05', # independence day on a sunday, observed monday
+	'2021-12-24', # christmas on a saturday
+	'2022-12-26', # christmas on a sunday
+	'2022-06-20', # juneteenth on a sunday
+	'2020-04-10', '2024-03-29', # good friday
+	'2012-10-29', '2012-10-30', '2018-12-05', '2025-01-09', # one-off closures
+]
+
+OPEN = [
+	'2021-12-31', # new years 2022 is a saturday, the friday before still trades
+	'2021-06-18', # juneteenth before it was an NYSE holiday
+	'2020-11-27', # the friday after thanksgiving
+	'2025-01-10',
+]
+
+def day(text):
+	return datetime.strptime(text, '%Y-%m-%d')
+
+@pytest.mark.parametrize('year', sorted(SESSIONS_PER_YEAR))
+def test_sessions_per_year(year):
+	assert len(nyse_calendar().between(datetime(year, 1, 1), datetime(year + 1, 1, 1))) == SESSIONS_PER_YEAR[year]
+
+def test_known_closures_and_open_days():
+	calendar = nyse_calendar()
+	for text in CLOSED:
+		assert not calendar.is_trading_day(day(text)), text
+	for text in OPEN:
+		assert calendar.is_trading_day(day(text)), text
+
+def test_easter():
+	assert [easter(year).strftime('%Y-%m-%d') for year in (2019, 2020, 2024, 2025)] == ['2019-04-21', '2020-04-12', '2024-03-31', '2025-04-20']
+
+def test_sessions_back_and_neighbours():
+	calendar = nyse_calendar()
+	# thanksgiving and the weekend are skipped, the date itself is never counted
+	assert calendar.sessions_back(day('2020-11-30'), 1) == day('2020-11-27')
+	assert calendar.sessions_back(day('2020-11-30'), 3) == day('2020-11-24')
+	assert calendar.sessions_back(day('2020-11-28'), 1) == day('2020-11-27')
+	assert calendar.previous_session(day('2025-01-10')) == day('2025-01-08')
+	assert calendar.next_session(day('2025-01-08')) == day('2025-01-10')
+	assert calendar.next_session(day('2020-12-24')) == day('2020-12-28')
+
+def test_between():
+	calendar = nyse_calendar()
+	# start on a weekend, end excluded
+	assert calendar.between(day('2020-12-19'), day('2020-12-29')) == [day(text) for text in ('2020-12-21', '2020-12-22', '2020-12-23', '2020-12-24', '2020-12-28')]
+	assert calendar.between(day('2020-12-26'), day('2020-12-28')) == []
+
+def test_outside_the_calendar():
+	calendar = TradingCalendar.from_rules(datetime(2020, 1, 1), datetime(2021, 1, 1))
+	assert len(calendar) == 253
+	with pytest.raises(ValueError):
+		calendar.sessions_back(datetime(2020, 1, 3), 5)
+	with pytest.raises(ValueError):
+		calendar.is_trading_day(datetime(2021, 1, 4))
+	with pytest.raises(ValueError):
+		calendar.next_session(datetime(2020, 12, 31))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta
+import bt
+from indicators import Indicators
+from insider import Screen
+from conftest import START, END, LOOKBACK_DAYS
+
+SPECS = [('close',), ('sma', 5), ('sma_volume', 10), ('ema', 10), ('rsi', 14), ('atr', 14), ('relative_volume', 20)]
+
+def stored(make_store):
+	store = make_store()
+	store.set_range(START - timedelta(days=LOOKBACK_DAYS), END)
+	return store
+
+@pytest.mark.parametrize('spec', SPECS, ids=[spec[0] for spec in SPECS])
+def test_stacked_values_match_one_ticker_at_a_time(make_store, bars, spec):
+	indicators = Indicators(stored(make_store))
+	tickers = sorted(bars)
+	# msft has no bar on the 15th, spy none on 11-10
+	for date in (datetime(2020, 9, 2), datetime(2020, 10, 15), datetime(2020, 10, 16), datetime(2020, 11, 10), datetime(2020, 12, 30)):
+		expected = [indicators.value(ticker, spec[0], date, *spec[1:]) for ticker in tickers]
+		# the same numbers to the bit, nan where there is not enough history
+		np.testing.assert_array_equal(indicators.values(tickers, spec[0], date, *spec[1:]), expected)
+
+def test_build_universe_reads_the_stack(make_store, bars, monkeypatch):
+	store = stored(make_store)
+	indicators = Indicators(store)
+	monkeypatch.setattr(bt, 'price_store', store)
+	monkeypatch.setattr(bt, 'indicators', indicators)
+	date = datetime(2020, 10, 15)
+	screen = Screen(['msft', 't0001', 'spy'], [1.0, 2.0, 3.0], [10.0, 20.0, 30.0], [1.0, 2.0, 3.0])
+	portfolio = bt.Portfolio(1000)
+	portfolio['t0002'] = {'shares': 3, 'purchase_price': 10.0}
+	universe = bt.build_universe(screen, portfolio, date, {'rsi': ('rsi', 14)})
+	assert list(universe.tickers) == ['msft', 't0001', 'spy', 't0002']
+	for i, ticker in enumerate(universe.tickers):
+		row = bars[ticker].row(date)
+		assert (np.isnan(universe['open'][i]) if row is None else universe['open'][i] == bars[ticker].columns['open'][row]), ticker
+		assert universe['prev_close'][i] == indicators.value(ticker, 'close', date)
+		np.testing.assert_array_equal(universe['rsi'][i], indicators.value(ticker, 'rsi', date, 14))
+	# msft has no bar that day, so no open to trade at
+	assert np.isnan(universe['open'][0])
+
+def test_held_ticker_without_a_bar_is_valued_at_its_last_close(make_store, bars, monkeypatch):
+	store = stored(make_store)
+	indicators = Indicators(store)
+	monkeypatch.setattr(bt, 'price_store', store)
+	monkeypatch.setattr(bt, 'indicators', indicators)
+	# msft has no bar on the 15th, a halt with the position still held
+	date = datetime(2020, 10, 15)
+	portfolio = bt.Portfolio(1000)
+	portfolio['msft'] = {'shares': 4, 'purchase_price': 10.0}
+	portfolio['spy'] = {'shares': 2, 'purchase_price': 10.0}
+	universe = bt.build_universe(Screen([], [], [], []), portfolio, date, {})
+	assert list(universe.tickers) == ['msft', 'spy']
+	assert np.isnan(universe['open'][0])
+	last_close = bars['msft'].columns['close'][bars['msft'].dates < np.datetime64('2020-10-15')][-1]
+	spy_open = bars['spy'].columns['open'][bars['spy'].row(date)]
+	assert universe.equity == 1000 + (4 * last_close + 2 * spy_open)
+	assert universe['weight'][0] == 4 * last_close / universe.equity
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from datetime import datetime
+import bt
+from execution import ExecutionModel, FixedSlippage, PercentCommission, VolumeFill
+from conftest import START, END, LOOKBACK_DAYS
+
+'''
+dict_engine is written against plain dicts: it buys spy, then msft in november, and always
+hands back a new dict listing msft before spy, the reverse of the order they were bought in
+'''
+def dict_engine(portfolio, date):
+	if 'spy' not in portfolio:
+		portfolio = bt.buy(portfolio, 'spy', 5, bt.get_stock('spy', date)['open'])
+	if date.month == 11 and 'msft' not in portfolio:
+		portfolio = bt.buy(portfolio, 'msft', 5, bt.get_stock('msft', date)['open'])
+	result = {'cash': portfolio['cash']}
+	for ticker in sorted((ticker for ticker in portfolio if ticker != 'cash'), key=lambda ticker: ticker != 'msft'):
+		result[ticker] = {'shares': portfolio[ticker]['shares'], 'purchase_price': portfolio[ticker]['purchase_price']}
+	return result
+
+def fixture_algos():
+	return [
+		bt.Algo('noop', bt.noop_engine),
+		bt.Algo('spy', bt.basic_stock_engine),
+		bt.Algo('msft', bt.basic_msft_stock_engine),
+		bt.Algo('cluster', bt.make_cluster_engine(max_price=50)),
+		bt.Algo('cluster_sma', bt.make_cluster_engine(max_price=30, stop_loss=0.08, stop_gain=0.05, indicator=bt.fiveday_spy_sma_3_apart_indicator)),
+		bt.Algo('universe', bt.make_universe_engine(max_price=60, candidates=10)),
+		bt.Algo('dict', dict_engine, tickers=['spy', 'msft']),
+	]
+
+def run(make_store, feed, tradability, valuation, execution=None):
+	backtester = bt.Backtester(START.strftime('%m-%d-%Y'), END.strftime('%m-%d-%Y'), fixture_algos(), 2000, store=make_store(), lookback_days=LOOKBACK_DAYS, insider_feed=feed, tradability=tradability(), valuation=valuation, execution=execution)
+	with contextlib.redirect_stdout(io.StringIO()):
+		backtester.backtest()
+	return backtester
+
+@pytest.mark.parametrize('execution', [None, ExecutionModel(FixedSlippage(20), PercentCommission(0.001, 1.0), VolumeFill(0.0005))], ids=['no execution', 'execution'])
+def test_post_matches_daily(make_store, feed, offline_tradability, execution):
+	daily = run(make_store, feed, offline_tradability, 'daily', execution)
+	post = run(make_store, feed, offline_tradability, 'post', execution)
+	assert daily.dates == post.dates
+	for name, values in daily.portfolio_values.items():
+		assert len(values) == len(daily.dates)
+		# the same numbers to the bit, not just close
+		assert values == post.portfolio_values[name], name
+
+def test_every_algo_trades(make_store, feed, offline_tradability):
+	daily = run(make_store, feed, offline_tradability, 'daily')
+	for name, portfolio in daily.portfolios.items():
+		assert (len(portfolio.ledger) > 0) == (name != 'noop'), name
+
+def test_missing_bar_values_at_last_close(make_store, feed, offline_tradability, bars):
+	daily = run(make_store, feed, offline_tradability, 'daily')
+	missing = datetime(2020, 10, 15)
+	# the day msft has no bar is still a day of the curve
+	row = daily.dates.index(missing)
+	portfolio = daily.portfolios['msft']
+	shares = portfolio['msft']['shares']
+	closes = bars['msft'].columns['close'][bars['msft'].dates < np.datetime64('2020-10-15')]
+	# msft bought once and held, so the cash is the same on every day after the buy
+	assert daily.portfolio_values['msft'][row] == portfolio['cash'] + shares * closes[-1]
+
+def test_dict_engine_keeps_ticker_ids(make_store, feed, offline_tradability):
+	post = run(make_store, feed, offline_tradability, 'post')
+	portfolio = post.portfolios['dict']
+	records = portfolio.ledger.records
+	assert [portfolio.tickers[id] for id in records['ticker']] == ['spy', 'msft']
+
+@pytest.mark.parametrize('execution', [ExecutionModel(FixedSlippage(20), PercentCommission(0.001, 1.0)), ExecutionModel(fill=VolumeFill(1e-5))], ids=['costs', 'partial fills'])
+def test_execution_keeps_cash_above_zero(make_store, feed, offline_tradability, execution):
+	backtester = bt.Backtester(START.strftime('%m-%d-%Y'), END.strftime('%m-%d-%Y'), fixture_algos(), 2000, store=make_store(), lookback_days=LOOKBACK_DAYS, insider_feed=feed, tradability=offline_tradability(), execution=execution)
+	out = io.StringIO()
+	with contextlib.redirect_stdout(out):
+		backtester.backtest()
+	lines = [line.split() for line in out.getvalue().splitlines()]
+	for name, portfolio in backtester.portfolios.items():
+		records = portfolio.ledger.records
+		# the cash after every fill, replayed from the ledger like valuation 'post' does
+		cash = np.add.accumulate(np.concatenate([[2000.0], -records['side'] * records['shares'] * records['price'] - records['fee']]))
+		assert cash.min() >= 0, name
+		assert cash[-1] == portfolio['cash'], name
+		# every fill printed once, through the trade printer the quiet mode silences
+		assert sum(words[1:2] == [name] and 'fee' in words for words in lines) == len(records), name
@@ -0,0 +1,101 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+import bt
+import vectorized
+from conftest import START, END, LOOKBACK_DAYS
+
+'''
+momentum weights: an equal share of equity in every ticker whose last close is above its mean
+close of the 5 sessions before, looking only at the rows before each open
+'''
+def momentum(opens, closes):
+	filled = np.where(np.isfinite(closes), closes, 0)
+	counts = np.cumsum(np.isfinite(closes), axis=0)
+	sums = np.cumsum(filled, axis=0)
+	means = np.full_like(closes, np.nan)
+	means[5:] = (sums[5:] - sums[:-5]) / np.maximum(counts[5:] - counts[:-5], 1)
+	with np.errstate(invalid='ignore'):
+		up = np.vstack([np.zeros((1, closes.shape[1]), dtype=bool), (closes > means)[:-1]])
+	picks = up.sum(axis=1, keepdims=True)
+	return np.where(up, 1 / np.maximum(picks, 1), 0)
+
+def spy_only(opens, closes):
+	return np.ones_like(opens)
+
+'''
+stop_and_rebuy is a cluster engine without the screen: the 5% stops, then basic_stock_engine
+buys spy again at the same open. A held spy is not topped up with the cash left over, target
+weights have no such buys
+'''
+def stop_and_rebuy(portfolio, date):
+	portfolio = bt.limit_sells(portfolio, date, 0.05, 0.05)
+	if 'spy' in portfolio:
+		return portfolio
+	return bt.basic_stock_engine(portfolio, date, 'spy')
+
+TICKERS = ['spy', 'msft', 'arkk'] + ['t%04d' % i for i in range(8)]
+
+CASES = {
+	'buy and hold': (['spy'], spy_only, None, None, False),
+	'stops': (TICKERS, momentum, 0.05, 0.08, False),
+	'stops and reenter': (TICKERS, momentum, 0.05, 0.05, True),
+	'spy stops and reenter': (['spy'], spy_only, 0.05, 0.05, True),
+}
+
+def run(make_store, offline_tradability, algos, vectorized=True):
+	backtester = bt.Backtester(START.strftime('%m-%d-%Y'), END.strftime('%m-%d-%Y'), algos, 2000, store=make_store(), lookback_days=LOOKBACK_DAYS, tradability=offline_tradability(), vectorized=vectorized)
+	with contextlib.redirect_stdout(io.StringIO()):
+		backtester.backtest()
+	return backtester
+
+def case_algos():
+	return [bt.Algo(name, bt.WeightsEngine(tickers, weights, stop_loss, stop_gain, reenter)) for name, (tickers, weights, stop_loss, stop_gain, reenter) in CASES.items()]
+
+def test_vectorized_matches_session_loop(make_store, offline_tradability):
+	looped = run(make_store, offline_tradability, case_algos(), vectorized=False)
+	vectorized_run = run(make_store, offline_tradability, case_algos())
+	assert looped.dates == vectorized_run.dates
+	for name in CASES:
+		# the same numbers to the bit, and the same orders
+		assert looped.portfolio_values[name] == vectorized_run.portfolio_values[name], name
+		assert looped.portfolios[name].ledger.records.tolist() == vectorized_run.portfolios[name].ledger.records.tolist(), name
+		assert looped.portfolios[name].to_dict() == vectorized_run.portfolios[name].to_dict(), name
+		assert len(looped.portfolios[name].ledger) > 0, name
+
+def test_reenter_matches_stop_and_rebuy(make_store, offline_tradability):
+	looped = run(make_store, offline_tradability, [bt.Algo('event', stop_and_rebuy, tickers=['spy']), bt.Algo('weights', bt.WeightsEngine(['spy'], spy_only, 0.05, 0.05, True))])
+	records = looped.portfolios['event'].ledger.records
+	# stopped out and bought back at the same open more than once
+	assert ((records['side'] == bt.BUY)[1:] & (records['date'][1:] == records['date'][:-1])).sum() > 1
+	assert looped.portfolio_values['event'] == looped.portfolio_values['weights']
+
+def test_missing_bar_is_held(make_store):
+	store = make_store()
+	store.set_range(START, END)
+	sessions = bt.nyse_calendar().between(START, END)
+	opens, closes = vectorized.price_matrices(store, ['spy', 'msft'], sessions)
+	missing = ~np.isfinite(opens[:, 1])
+	assert missing.sum() == 1
+	row = int(np.argmax(missing))
+	weights = np.full(opens.shape, 0.5)
+	for whole_shares in (False, True):
+		result = vectorized.backtest_weights(opens, closes, weights, 2000, whole_shares=whole_shares)
+		assert np.isfinite(result['equity']).all()
+		if whole_shares:
+			shares = result['shares']
+			# one buy of each on the first day, msft valued at the close before the missing day
+			assert len(result['trades']) == 2
+			assert result['equity'][row] == result['cash'][row] + float(np.add.accumulate(shares * np.array([closes[row, 0], closes[row - 1, 1]]))[-1])
+		else:
+			assert result['held'][row, 1]
+
+@pytest.mark.parametrize('reenter', [False, True])
+def test_fractional_without_stops_is_buy_and_hold(make_store, reenter):
+	store = make_store()
+	store.set_range(START, END)
+	sessions = bt.nyse_calendar().between(START, END)
+	opens, closes = vectorized.price_matrices(store, ['t0010'], sessions)
+	result = vectorized.backtest_weights(opens, closes, np.ones(opens.shape), 1000, reenter=reenter)
+	np.testing.assert_allclose(result['equity'], 1000 * closes[:, 0] / opens[0, 0], rtol=1e-12)
@@ -0,0 +1,157 @@
+import os
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from profiling import span, count
+
+# ---------------------------
+# TRADABILITY
+# ---------------------------
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'backtest', 'tradable.json')
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+'''
+fetch_rh_valid function asks robinhood whether a ticker has a stock page, OTCMKT and
+delisted tickers come back as a 404 page
+(string) ticker -> (bool)
+'''
+def fetch_rh_valid(ticker):
+	import requests
+	from bs4 import BeautifulSoup
+	url = 'https://robinhood.com/stocks/' + ticker
+	req = requests.get(url, headers={"content-type":"text"})
+	soup = BeautifulSoup(req.content, 'html.parser')
+	for row in soup.select('header h1'):
+		if row.text == '404':
+			return False
+	return True
+
+'''
+read_listing function reads a symbol listing into {ticker: tradable}. Understands the pipe
+delimited nasdaqtraded.txt / otherlisted.txt files from nasdaq trader (test issues are not
+tradable) and plain csv files with a symbol column and an optional otc column (1/true/yes)
+(string) path -> (dict) ticker -> bool
+'''
+def read_listing(path):
+	with open(path, newline='') as f:
+		first = f.readline()
+		f.seek(0)
+		reader = csv.DictReader(f, delimiter='|' if '|' in first else ',')
+		listing = {}
+		for row in reader:
+			row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+			symbol = row.get('symbol') or row.get('act symbol') or row.get('ticker')
+			if not symbol or symbol.startswith('File Creation Time'):
+				continue
+			otc = row.get('otc', '').lower() in ('1', 'true', 'yes', 'y')
+			test = row.get('test issue', 'N') == 'Y'
+			listing[symbol.lower()] = not (otc or test)
+		return listing
+
+'''
+TradabilityService class. Answers "can this ticker be bought on robinhood" without blocking
+the backtest on a page fetch per buy:
+	listing		with a local symbol listing every answer comes from the file, tickers missing
+				from it are not tradable, nothing touches the network
+	offline		without a listing, unknown tickers get offline_default instead of a fetch
+	otherwise	answers are fetched once and kept for ttl seconds in a json file shared
+				between runs. New answers are written to it in one go by flush, once per
+				check_many batch and at the end of a run, not once per fetch
+'''
+class TradabilityService:
+	def __init__(self, cache_path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, listing=None, offline=False, offline_default=True):
+		self.cache_path = cache_path
+		self.ttl = ttl
+		self.listing = read_listing(listing) if listing is not None else None
+		self.offline = offline
+		self.offline_default = offline_default
+		self.results = self.load() if cache_path else {}
+		# answers fetched since the last save
+		self.dirty = False
+
+	def load(self):
+		try:
+			with open(self.cache_path) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	'''
+	save function merges this run's answers into the json file, other runs may have written it meanwhile
+	'''
+	def save(self):
+		if not self.cache_path:
+			return
+		os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+		results = self.load()
+		for ticker, entry in self.results.items():
+			if ticker not in results or results[ticker][1] < entry[1]:
+				results[ticker] = entry
+		self.results = results
+		tmp = self.cache_path + '.%d.tmp' % os.getpid()
+		with open(tmp, 'w') as f:
+			json.dump(results, f)
+		os.replace(tmp, self.cache_path)
+
+	'''
+	cached function returns the answer for a ticker without any fetch, or None when there is none yet
+	'''
+	def cached(self, ticker):
+		ticker = ticker.lower()
+		if self.listing is not None:
+			return self.listing.get(ticker, False)
+		entry = self.results.get(ticker)
+		if entry is not None and time.time() - entry[1] < self.ttl:
+			return entry[0]
+		if self.offline:
+			return self.offline_default
+		return None
+
+	def fetch(self, ticker):
+		try:
+			valid = fetch_rh_valid(ticker)
+		except Exception as e:
+			# don't remember network errors, just let this buy through
+			print('Tradability check failed', ticker, e)
+			return True
+		self.results[ticker] = [valid, time.time()]
+		self.dirty = True
+		return valid
+
+	'''
+	check function returns True when the ticker can be traded
+	(string) ticker -> (bool)
+	'''
+	def check(self, ticker):
+		valid = self.cached(ticker)
+		if valid is not None:
+			count('tradability.hit')
+			return valid
+		count('tradability.miss')
+		with span('tradability.fetch'):
+			return self.fetch(ticker.lower())
+
+	'''
+	check_many function answers a batch of tickers, fetching the unknown ones concurrently
+	(list) tickers -> (dict) ticker -> bool
+	'''
+	def check_many(self, tickers, threads=16):
+		answers = {ticker.lower(): self.cached(ticker) for ticker in tickers}
+		missing = [ticker for ticker, valid in answers.items() if valid is None]
+		count('tradability.hit', len(answers) - len(missing))
+		count('tradability.miss', len(missing))
+		if missing:
+			with span('tradability.fetch'), ThreadPoolExecutor(max_workers=threads) as pool:
+				answers.update(zip(missing, pool.map(self.fetch, missing)))
+			self.flush()
+		return answers
+
+	'''
+	flush function saves the answers fetched since the last save, if there are any
+	'''
+	def flush(self):
+		if self.dirty:
+			self.save()
+			self.dirty = False
@@ -0,0 +1,181 @@
+import numpy as np
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# ---------------------------
+# TRADING CALENDAR
+# ---------------------------
+
+# one-off NYSE closures that no holiday rule produces
+SPECIAL_CLOSURES = [
+	'1994-04-27', # Nixon funeral
+	'2001-09-11', '2001-09-12', '2001-09-13', '2001-09-14', # 9/11
+	'2004-06-11', # Reagan funeral
+	'2007-01-02', # Ford funeral
+	'2012-10-29', '2012-10-30', # hurricane Sandy
+	'2018-12-05', # Bush funeral
+	'2025-01-09', # Carter funeral
+]
+
+'''
+easter function returns easter sunday of a year (anonymous gregorian algorithm)
+(int) year -> (datetime) date
+'''
+def easter(year):
+	a = year % 19
+	b, c = divmod(year, 100)
+	d, e = divmod(b, 4)
+	f = (b + 8) // 25
+	g = (b - f + 1) // 3
+	h = (19 * a + b - d - g + 15) % 30
+	i, k = divmod(c, 4)
+	l = (32 + 2 * e + 2 * i - h - k) % 7
+	m = (a + 11 * h + 22 * l) // 451
+	month, day = divmod(h + l - 7 * m + 114, 31)
+	return datetime(year, month, day + 1)
+
+'''
+nth_weekday function returns the nth (1 based, -1 for last) weekday of a month
+(int) year, (int) month, (int) weekday monday=0, (int) n -> (datetime) date
+'''
+def nth_weekday(year, month, weekday, n):
+	if n > 0:
+		first = datetime(year, month, 1)
+		return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+	last = datetime(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+	return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+'''
+observed function moves a fixed date holiday off the weekend, saturday -> friday and sunday -> monday
+'''
+def observed(date):
+	if date.weekday() == 5:
+		return date - timedelta(days=1)
+	if date.weekday() == 6:
+		return date + timedelta(days=1)
+	return date
+
+'''
+nyse_holidays function returns the full day NYSE holidays of a year from the rule table
+(int) year -> (list) datetimes
+'''
+def nyse_holidays(year):
+	holidays = []
+	new_years = datetime(year, 1, 1)
+	# new years on a saturday is not observed on the friday before, that friday closes a year
+	if new_years.weekday() != 5:
+		holidays.append(observed(new_years))
+	if year >= 1998:
+		holidays.append(nth_weekday(year, 1, 0, 3)) # martin luther king jr day
+	holidays.append(nth_weekday(year, 2, 0, 3)) # presidents day
+	holidays.append(easter(year) - timedelta(days=2)) # good friday
+	holidays.append(nth_weekday(year, 5, 0, -1)) # memorial day
+	if year >= 2022:
+		holidays.append(observed(datetime(year, 6, 19))) # juneteenth
+	holidays.append(observed(datetime(year, 7, 4))) # independence day
+	holidays.append(nth_weekday(year, 9, 0, 1)) # labor day
+	holidays.append(nth_weekday(year, 11, 3, 4)) # thanksgiving
+	holidays.append(observed(datetime(year, 12, 25))) # christmas
+	return holidays
+
+'''
+TradingCalendar class. Initialized with the trading sessions (any iterable of
+datetimes or numpy days) of a date range. Builds dense per calendar day lookup tables
+so is_trading_day, next_session, previous_session and sessions_back are all O(1).
+Build one with TradingCalendar.from_rules (NYSE holiday table, no network) or
+TradingCalendar.from_bars (the trading days of a cached reference series).
+'''
+class TradingCalendar:
+	def __init__(self, sessions, start=None, end=None):
+		self.sessions = np.unique(np.asarray(list(sessions), dtype='datetime64[D]'))
+		self.first_day = np.datetime64(start.strftime('%Y-%m-%d'), 'D') if start is not None else self.sessions[0]
+		last_day = np.datetime64(end.strftime('%Y-%m-%d'), 'D') if end is not None else self.sessions[-1] + 1
+		days = int((last_day - self.first_day).astype(int))
+		self.sessions = self.sessions[(self.sessions >= self.first_day) & (self.sessions < last_day)]
+		offsets = (self.sessions - self.first_day).astype(int)
+		# session_at[d] is the index of the session on calendar day d, or -1
+		self.session_at = np.full(days, -1, dtype=np.int64)
+		self.session_at[offsets] = np.arange(len(offsets))
+		# sessions_before[d] counts the sessions strictly before calendar day d
+		is_session = np.zeros(days, dtype=np.int64)
+		is_session[offsets] = 1
+		self.sessions_before = np.concatenate([[0], np.cumsum(is_session)[:-1]])
+		self.session_dates = [datetime(day.year, day.month, day.day) for day in self.sessions.tolist()]
+
+	'''
+	from_rules function builds the NYSE calendar of [start, end) from the holiday rule table
+	(datetime) start, (datetime) end -> TradingCalendar
+	'''
+	@classmethod
+	def from_rules(cls, start, end):
+		closed = set(np.array(SPECIAL_CLOSURES, dtype='datetime64[D]').tolist())
+		for year in range(start.year, end.year + 1):
+			closed.update(day.date() for day in nyse_holidays(year))
+		days = np.arange(np.datetime64(start.strftime('%Y-%m-%d'), 'D'), np.datetime64(end.strftime('%Y-%m-%d'), 'D'))
+		weekdays = np.is_busday(days)
+		sessions = [day for day in days[weekdays].tolist() if day not in closed]
+		return cls(sessions, start, end)
+
+	'''
+	from_bars function builds the calendar from the trading days of a reference series
+	(Bars) bars -> TradingCalendar
+	'''
+	@classmethod
+	def from_bars(cls, bars, start=None, end=None):
+		return cls(bars.dates, start, end)
+
+	def offset(self, date):
+		offset = int((np.datetime64(date.strftime('%Y-%m-%d'), 'D') - self.first_day).astype(int))
+		if offset < 0 or offset >= len(self.session_at):
+			raise ValueError(date.strftime("%m-%d-%Y") + ' is outside the trading calendar')
+		return offset
+
+	def __len__(self):
+		return len(self.session_dates)
+
+	def is_trading_day(self, date):
+		return self.session_at[self.offset(date)] >= 0
+
+	'''
+	previous_session function returns the last session strictly before date
+	'''
+	def previous_session(self, date):
+		return self.sessions_back(date, 1)
+
+	'''
+	next_session function returns the first session strictly after date
+	'''
+	def next_session(self, date):
+		offset = self.offset(date)
+		index = self.sessions_before[offset] + (1 if self.session_at[offset] >= 0 else 0)
+		if index >= len(self.session_dates):
+			raise ValueError('no session after ' + date.strftime("%m-%d-%Y") + ' in the trading calendar')
+		return self.session_dates[index]
+
+	'''
+	sessions_back function returns the session n sessions before date, not counting date
+	itself, so sessions_back(date, 5) starts the window of the previous 5 sessions
+	(datetime) date, (int) n -> (datetime) session
+	'''
+	def sessions_back(self, date, n):
+		index = self.sessions_before[self.offset(date)] - n
+		if index < 0:
+			raise ValueError('not enough sessions before ' + date.strftime("%m-%d-%Y") + ' in the trading calendar')
+		return self.session_dates[index]
+
+	'''
+	between function returns the sessions with start <= date < end
+	(datetime) start, (datetime) end -> (list) datetimes
+	'''
+	def between(self, start, end):
+		lo = int(np.searchsorted(self.sessions, np.datetime64(start.strftime('%Y-%m-%d'), 'D'), side='left'))
+		hi = int(np.searchsorted(self.sessions, np.datetime64(end.strftime('%Y-%m-%d'), 'D'), side='left'))
+		return self.session_dates[lo:hi]
+
+'''
+nyse_calendar function returns a rule based NYSE calendar covering 1990 through 2035,
+shared by everything that does not bring its own
+'''
+@lru_cache(maxsize=1)
+def nyse_calendar():
+	return TradingCalendar.from_rules(datetime(1990, 1, 1), datetime(2036, 1, 1))
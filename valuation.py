@@ -0,0 +1,54 @@
+import numpy as np
+
+# ---------------------------
+# POST-PASS VALUATION
+# ---------------------------
+
+'''
+close_matrix function returns a (dates x tickers) matrix of closes. A day a ticker has no bar
+carries its last close forward (nan before its first bar), the same price
+PriceStore.last_close gives the daily valuation
+(PriceStore) store, (list) tickers, (np.array) days datetime64[D] -> (np.array) closes
+'''
+def close_matrix(store, tickers, days):
+	closes = np.full((len(days), len(tickers)), np.nan)
+	for column, ticker in enumerate(tickers):
+		bars = store.get(ticker)
+		if len(bars) == 0:
+			continue
+		# row of the last bar on or before each day
+		rows = np.searchsorted(bars.dates, days, side='right') - 1
+		known = rows >= 0
+		closes[known, column] = bars.columns['close'][rows[known]]
+	return closes
+
+'''
+equity_curve function rebuilds a portfolio's end of day value for every day from its ledger:
+positions are the running sum of the signed order sizes, cash the running sum of the order
+cash flows less their fees (in ledger order, so it rounds exactly like the day loop did) and the value of the
+holdings one accumulate over the (dates x tickers) shares * closes matrix
+(Portfolio) portfolio, (float) starting_cash, (list) datetimes, (PriceStore) store -> (np.array) values
+'''
+def equity_curve(portfolio, starting_cash, dates, store):
+	days = np.array([date.strftime('%Y-%m-%d') for date in dates], dtype='datetime64[D]')
+	trades = portfolio.ledger.records
+	trades = trades[~np.isnat(trades['date'])]
+	# the day each order landed on, and the last order of every day
+	trade_days = np.searchsorted(days, trades['date'], side='left')
+	last_trade = np.searchsorted(trade_days, np.arange(len(days)), side='right') - 1
+
+	flows = np.concatenate([[starting_cash], -trades['side'] * trades['shares'] * trades['price'] - trades['fee']])
+	cash = np.add.accumulate(flows)[last_trade + 1]
+
+	tickers = len(portfolio.tickers)
+	shares = np.zeros((len(days), tickers))
+	np.add.at(shares, (trade_days, trades['ticker']), trades['side'] * trades['shares'])
+	shares = np.add.accumulate(shares, axis=0)
+
+	held = shares != 0
+	if tickers == 0 or not held.any():
+		return cash
+	closes = close_matrix(store, portfolio.tickers, days)
+	# zero positions add nothing even where the close is unknown
+	holdings = np.where(held, shares * np.where(held, closes, 0), 0)
+	return cash + np.add.accumulate(holdings, axis=1)[:, -1]
@@ -0,0 +1,281 @@
+import numpy as np
+
+# ---------------------------
+# VECTORIZED BACKTEST
+# ---------------------------
+
+'''
+Backtests strategies written as a (dates x tickers) target weight matrix without the day by
+day loop of Backtester.backtest. Semantics are the ones bt.WeightsEngine runs day by day, so
+the two give the same curve:
+	- a run of days with weight > 0 is a holding block, bought at the open of its first day
+	- limit_sells style stops are checked from the session after the buy: past a stop at the
+	  open sells at the open, otherwise past one at the close sells at the close
+	- after a stop the ticker stays flat until its block ends, or with reenter=True it is
+	  bought again at the open of the same session, like limit_sells followed by
+	  basic_stock_engine
+	- when the weight goes back to 0 the position is sold at that day's open
+	- a day without a bar changes nothing: the position is still held, valued at its last
+	  close, with no stop check, buy or sell, and the weight of the last day with a bar stands
+Fractional equity is a cumulative product over whole-history arrays (positions rebalanced to
+their target weight every open). With whole_shares=True the cash bookkeeping steps once per
+buy/sell event instead of once per day, the next exit of each day's buys found with array scans
+'''
+
+'''
+price_matrices function returns (dates x tickers) open and close matrices from a PriceStore,
+nan where a ticker has no bar
+(PriceStore) store, (list) tickers, (list) datetimes -> (np.array) opens, (np.array) closes
+'''
+def price_matrices(store, tickers, dates):
+	days = np.array([date.strftime('%Y-%m-%d') for date in dates], dtype='datetime64[D]')
+	opens = np.full((len(days), len(tickers)), np.nan)
+	closes = np.full((len(days), len(tickers)), np.nan)
+	for column, ticker in enumerate(tickers):
+		bars = store.get(ticker)
+		rows = np.searchsorted(bars.dates, days)
+		found = rows < len(bars)
+		found[found] = bars.dates[rows[found]] == days[found]
+		opens[found, column] = bars.columns['open'][rows[found]]
+		closes[found, column] = bars.columns['close'][rows[found]]
+	return opens, closes
+
+'''
+segment_cumsum function is a cumulative sum down each column that restarts at every row where starts is True
+'''
+def segment_cumsum(values, starts):
+	total = np.cumsum(values, axis=0)
+	# total just before each segment start, carried down to every row of the segment
+	before = np.where(starts, total - values, 0)
+	rows = np.where(starts, np.arange(len(values))[:, None], 0)
+	rows = np.maximum.accumulate(rows, axis=0)
+	return total - np.take_along_axis(before, rows, axis=0)
+
+'''
+shift function moves a matrix down one row, the first row filled with fill
+'''
+def shift(values, fill):
+	return np.vstack([np.full((1, values.shape[1]), fill, dtype=values.dtype), values[:-1]])
+
+'''
+carry function returns each row's values as of the last row with a bar, False or nan before the first one
+(np.array) values, bar (dates x tickers) -> (np.array) values
+'''
+def carry(values, bar):
+	rows = np.maximum.accumulate(np.where(bar, np.arange(len(bar))[:, None], -1), axis=0)
+	carried = np.take_along_axis(values, np.maximum(rows, 0), axis=0)
+	return np.where(rows >= 0, carried, False if values.dtype == bool else np.nan)
+
+'''
+stop_levels function turns optional stops into the stop_loss, stop_gain limit_sells takes:
+no stop loss is a level of 0 and no stop gain one of inf, neither of which a price crosses
+'''
+def stop_levels(stop_loss, stop_gain):
+	return (stop_loss if stop_loss is not None else 1.0), (stop_gain if stop_gain is not None else np.inf)
+
+'''
+weight_frame function is everything both the vectorized run and bt.WeightsEngine read off the
+price and weight matrices, so the two decide from the same arrays:
+	bar			the ticker has an open and a close that day
+	on			the weight is on, as of the last day with a bar
+	weights		the weights, as of the last day with a bar
+	buys		a ticker not held is bought at that open: the first day of a block, or with
+				reenter every day of a block with a bar
+	marks		the close, the last one on days without a bar
+	open_marks	the open, the last close on days without a bar
+(np.array) opens, closes, weights (dates x tickers), (bool) reenter -> (dict) name -> (np.array)
+'''
+def weight_frame(opens, closes, weights, reenter):
+	opens = np.asarray(opens, dtype=np.float64)
+	closes = np.asarray(closes, dtype=np.float64)
+	weights = np.asarray(weights, dtype=np.float64)
+	bar = np.isfinite(opens) & np.isfinite(closes)
+	on = carry(weights > 0, bar)
+	marks = carry(closes, bar)
+	block_starts = on & ~shift(on, False)
+	return {
+		'opens': opens,
+		'closes': closes,
+		'bar': bar,
+		'on': on,
+		'weights': carry(weights, bar),
+		'block_starts': block_starts,
+		'buys': on & bar if reenter else block_starts,
+		'marks': marks,
+		'open_marks': np.where(bar, opens, marks),
+	}
+
+'''
+stops function finds every holding segment and its stop exit for the fractional run. A stop
+on a day is checked against the position bought at the last entry before that day, and with
+reenter the day it sells on is also the next position's entry
+(dict) weight_frame, (float) stop_loss, stop_gain, (bool) reenter ->
+(np.array) entries, held (intraday), carried (held over the close), exits_at_open, exits_at_close
+'''
+def stops(frame, stop_loss, stop_gain, reenter):
+	on, bar, opens, closes = frame['on'], frame['bar'], frame['opens'], frame['closes']
+	stop_loss, stop_gain = stop_levels(stop_loss, stop_gain)
+	days = np.arange(len(on))[:, None]
+	entries = frame['block_starts'].copy()
+	checked = on & bar & ~entries
+	while True:
+		# purchase price a row is checked against is the open of the last entry before it
+		before = shift(np.maximum.accumulate(np.where(entries, days, -1), axis=0), -1)
+		purchase = np.take_along_axis(opens, np.maximum(before, 0), axis=0)
+		low = (1 - stop_loss) * purchase
+		high = (1 + stop_gain) * purchase
+		with np.errstate(invalid='ignore'):
+			at_open = checked & ((opens < low) | (opens > high))
+			at_close = checked & ~at_open & ((closes < low) | (closes > high))
+		triggered = at_open | at_close
+		# a position's checks run from the day after its entry up to the next entry, only the first trigger sells
+		first = triggered & (segment_cumsum(triggered.astype(np.int64), shift(entries, False)) == 1)
+		if not reenter:
+			break
+		new_entries = first & ~entries
+		if not new_entries.any():
+			break
+		entries |= new_entries
+	# stops not followed by a buy the same session leave the ticker flat until the next entry
+	flat = first & ~entries
+	stopped_before = (segment_cumsum(flat.astype(np.int64), entries) - flat) > 0
+	held = on & ~stopped_before & ~(flat & at_open)
+	carried = held & ~(flat & at_close)
+	return entries, held, carried, first & at_open, first & at_close
+
+'''
+backtest_weights function runs a target weight strategy over the whole history at once
+(np.array) opens, closes, weights (dates x tickers, each row summing to at most 1),
+(float) starting_cash, [optional] (float) stop_loss, stop_gain, (bool) reenter, whole_shares ->
+(dict) equity (end of day values), cash, and with fractional shares entries, exits_at_open,
+exits_at_close, held or with whole shares trades (TRADE_DTYPE rows in the order they happen),
+shares and purchase_prices (the positions at the end, per ticker)
+'''
+def backtest_weights(opens, closes, weights, starting_cash, stop_loss=None, stop_gain=None, reenter=False, whole_shares=False):
+	frame = weight_frame(opens, closes, weights, reenter)
+	if whole_shares:
+		return whole_share_run(frame, starting_cash, stop_loss, stop_gain)
+
+	entries, held, carried, exits_at_open, exits_at_close = stops(frame, stop_loss, stop_gain, reenter)
+	result = {'entries': entries, 'exits_at_open': exits_at_open, 'exits_at_close': exits_at_close, 'held': held}
+	marks = np.where(held, frame['marks'], 1)
+	open_marks = np.where(held, frame['open_marks'], 1)
+	# intraday leg open -> close on the day's holdings, overnight leg close -> next open on what was carried,
+	# both 0 across a day without a bar
+	intraday = np.where(held, marks / open_marks - 1, 0)
+	next_opens = np.vstack([frame['open_marks'][1:], np.full((1, marks.shape[1]), np.nan)])
+	with np.errstate(invalid='ignore', divide='ignore'):
+		overnight = np.where(carried & np.isfinite(next_opens), next_opens / marks - 1, 0)
+	positions = np.where(held, frame['weights'], 0)
+	growth = 1 - positions.sum(axis=1) + (positions * (1 + intraday) * (1 + overnight)).sum(axis=1)
+	at_open = starting_cash * np.concatenate([[1.0], np.cumprod(growth[:-1])])
+	result['equity'] = at_open * (1 + (positions * intraday).sum(axis=1))
+	result['cash'] = at_open * (1 - positions.sum(axis=1)) + np.where(held & ~carried, at_open[:, None] * positions * (1 + intraday), 0).sum(axis=1)
+	return result
+
+# one row per whole share order, ticker is the column and side BUY (1) or SELL (-1) like the ledger's
+TRADE_DTYPE = np.dtype([('row', 'i8'), ('ticker', 'i8'), ('side', 'i1'), ('shares', 'f8'), ('price', 'f8')])
+
+'''
+next_exits function returns the first row after entry where each of the holdings bought that
+day leaves: its weight goes off, or a day with a bar crosses one of its stop levels. Scans a
+short stretch for all of them first and longer ones for those still held, most leave soon
+(dict) weight_frame, (np.array) columns, (int) entry row, (np.array) low, high per column ->
+(np.array) rows, len of the frame for a holding that never leaves
+'''
+def next_exits(frame, columns, entry, low, high):
+	days = len(frame['on'])
+	exits = np.full(len(columns), days)
+	left = np.arange(len(columns))
+	start = entry + 1
+	size = 16
+	while start < days and len(left):
+		end = min(days, start + size)
+		stretch = (slice(start, end), columns[left])
+		opens = frame['opens'][stretch]
+		closes = frame['closes'][stretch]
+		with np.errstate(invalid='ignore'):
+			crossed = frame['bar'][stretch] & ((opens < low[left]) | (opens > high[left]) | (closes < low[left]) | (closes > high[left]))
+		leaves = ~frame['on'][stretch] | crossed
+		found = leaves.any(axis=0)
+		exits[left[found]] = start + np.argmax(leaves[:, found], axis=0)
+		left = left[~found]
+		start = end
+		size *= 4
+	return exits
+
+'''
+whole_share_run function is the whole share bookkeeping, the same orders in the same order as
+bt.WeightsEngine places them: on each event day the holdings whose weight went off sell at the
+open, then the stops sell (at the open, then at the close) in the order the tickers were first
+bought (a Portfolio's id order), then the tickers to buy are bought in column order, each
+min(floor(weight * equity at the open / open), cash // open) shares. Between events nothing
+trades, so each stretch is valued at once, summed in id order like Portfolio.market_value
+(dict) weight_frame, (float) starting_cash, stop_loss, stop_gain -> (dict) see backtest_weights
+'''
+def whole_share_run(frame, starting_cash, stop_loss, stop_gain):
+	opens, closes, marks, open_marks, weights = frame['opens'], frame['closes'], frame['marks'], frame['open_marks'], frame['weights']
+	stop_loss, stop_gain = stop_levels(stop_loss, stop_gain)
+	days, tickers = opens.shape
+	# next row at or after each row where a ticker not held would be bought, days when none
+	buy_rows = np.where(frame['buys'], np.arange(days)[:, None], days)
+	next_buys = np.vstack([np.minimum.accumulate(buy_rows[::-1], axis=0)[::-1], np.full((1, tickers), days)])
+	cash = float(starting_cash)
+	shares = np.zeros(tickers)
+	purchase_prices = np.zeros(tickers)
+	held = np.zeros(tickers, dtype=bool)
+	exits = np.full(tickers, days)
+	# portfolio id of each ticker, in the order they were first bought
+	ids = np.full(tickers, tickers)
+	bought = 0
+	trades = []
+	equity = np.full(days, cash)
+	cash_series = np.full(days, cash)
+	row = int(next_buys[0].min()) if tickers else days
+	while row < days:
+		leaving = np.flatnonzero(held & (exits == row))
+		leaving = leaving[np.argsort(ids[leaving])]
+		off = ~frame['on'][row, leaving]
+		low = (1 - stop_loss) * purchase_prices[leaving]
+		high = (1 + stop_gain) * purchase_prices[leaving]
+		at_open = ~off & ((opens[row, leaving] < low) | (opens[row, leaving] > high))
+		for column, price in [(column, opens[row, column]) for column in np.concatenate([leaving[off], leaving[at_open]])] + [(column, closes[row, column]) for column in leaving[~off & ~at_open]]:
+			trades.append((row, column, -1, shares[column], price))
+			cash += shares[column] * price
+			shares[column] = 0
+			purchase_prices[column] = 0
+			held[column] = False
+		buying = np.flatnonzero(frame['buys'][row] & ~held)
+		if len(buying):
+			holding = np.flatnonzero(held)
+			holding = holding[np.argsort(ids[holding])]
+			budget = cash + float(np.add.accumulate(shares[holding] * open_marks[row, holding])[-1]) if len(holding) else cash
+			for column in buying:
+				price = opens[row, column]
+				units = min(np.floor(weights[row, column] * budget / price), cash // price)
+				if units > 0 and units * price <= cash:
+					trades.append((row, column, 1, units, price))
+					cash -= units * price
+					shares[column] = units
+					purchase_prices[column] = price
+					held[column] = True
+					if ids[column] == tickers:
+						ids[column] = bought
+						bought += 1
+			bought_today = buying[held[buying]]
+			exits[bought_today] = next_exits(frame, bought_today, row, (1 - stop_loss) * purchase_prices[bought_today], (1 + stop_gain) * purchase_prices[bought_today])
+		upcoming = [days]
+		if held.any():
+			upcoming.append(exits[held].min())
+		if not held.all():
+			upcoming.append(next_buys[row + 1][~held].min())
+		end = int(min(upcoming))
+		holding = np.flatnonzero(held)
+		holding = holding[np.argsort(ids[holding])]
+		if len(holding):
+			equity[row:end] = cash + np.add.accumulate(marks[row:end][:, holding] * shares[holding], axis=1)[:, -1]
+		else:
+			equity[row:end] = cash
+		cash_series[row:end] = cash
+		row = end
+	return {'equity': equity, 'cash': cash_series, 'trades': np.array(trades, dtype=TRADE_DTYPE), 'shares': shares, 'purchase_prices': purchase_prices}